@@ -0,0 +1,146 @@
+"""
+出荷のロット引き当て（先入れ先出し）
+
+茶葉の種類・品質評価ごとに在庫のあるロットを (生産日, ID) のヒープで保持し、注文量を生産日の古いロットから順に引き当てる
+在庫テーブルを毎回検索せず、ヒープの先頭のロットの在庫だけを主キーで読むため、1ロットあたり O(log n) で選べる
+
+ヒープはデータベースから作る索引なので、書き込みとは次のように同期する
+- 新しいロットは、取り込み済みの最大の生産データIDより後ろのロットだけを引き当て時に読み足す
+- 出荷で在庫がなくなったロットは、引き当て時に在庫を読んだ時点でヒープから外す
+- 在庫がなくなったあとに在庫が戻ったロット（出荷の削除・修正や同期による在庫の再計算）は、
+  呼び出し側が渡す版（在庫が戻るたびに変わる値）が前回と異なる場合に作り直して読み込む
+  （別のプロセスや同期での書き込みでも版が変わるよう、版はデータベースやキャッシュに置く）
+- 茶葉の種類・品質評価・生産日が変わったロットは、引き当て時に正しいヒープへ移す
+  （書き込む側がわかっている場合は invalidate() で作り直す）
+- 在庫が足りない場合は、取りこぼしがないよう一度だけ作り直してから判定する
+
+TeaProductionManager（database.py のスキーマ）と tea_production.allocation（Django）から使う
+"""
+import heapq
+import threading
+
+# 浮動小数点の数量の誤差とみなす値
+EPSILON = 1e-9
+
+
+class LotIndex:
+    """
+    在庫のあるロットの優先度付きの索引
+    データベースの読み出しは呼び出し側が渡す関数で行う
+    """
+
+    def __init__(self):
+        self._heaps = {}
+        self._last_id = 0
+        self._loaded = False
+        self._version = None
+        self._lock = threading.RLock()
+        self.rebuilds = 0
+
+    def invalidate(self):
+        """
+        索引を破棄し、次の引き当て時にデータベースから作り直す
+        """
+        with self._lock:
+            self._loaded = False
+
+    def _push(self, production_id, tea_type, quality_check, production_date):
+        heapq.heappush(self._heaps.setdefault((tea_type, quality_check), []), (production_date, production_id))
+
+    def sync(self, load_lots):
+        """
+        索引を読み込む（読み込み済みなら、その後に追加されたロットだけを読み足す）
+
+        :param load_lots: load_lots(after_id) が生産データIDが after_id より大きい在庫のあるロットを
+                          (生産データID, 茶葉の種類, 品質評価, 生産日) で返す関数
+        """
+        with self._lock:
+            if self._loaded:
+                for production_id, tea_type, quality_check, production_date in load_lots(self._last_id):
+                    self._push(production_id, tea_type, quality_check, production_date)
+                    self._last_id = max(self._last_id, production_id)
+                return
+
+            # 全件を読み込む場合は、1件ずつ入れるよりまとめてヒープにするほうが速い
+            heaps = {}
+            last_id = 0
+            for production_id, tea_type, quality_check, production_date in load_lots(0):
+                heaps.setdefault((tea_type, quality_check), []).append((production_date, production_id))
+                last_id = max(last_id, production_id)
+            for heap in heaps.values():
+                heapq.heapify(heap)
+            self._heaps, self._last_id, self._loaded = heaps, last_id, True
+            self.rebuilds += 1
+
+    def _take(self, tea_type, quality_check, quantity, read_lot):
+        """
+        ヒープの先頭から注文量に達するまでロットを取り出す
+        在庫が足りない場合は取り出したロットを戻して None を返す
+        """
+        key = (tea_type, quality_check)
+        heap = self._heaps.get(key, [])
+        popped = []
+        allocations = []
+        remaining = quantity
+        while remaining > EPSILON and heap:
+            production_date, production_id = heapq.heappop(heap)
+            lot = read_lot(production_id)
+            if lot is None:
+                continue
+            stock, lot_tea_type, lot_quality_check, lot_date = lot
+            if (lot_tea_type, lot_quality_check) != key or lot_date != production_date:
+                # 生産データが変更されたロットは正しい位置に入れ直す
+                if stock > EPSILON:
+                    self._push(production_id, lot_tea_type, lot_quality_check, lot_date)
+                continue
+            if stock <= EPSILON:
+                continue
+            popped.append((production_date, production_id))
+            quantity_taken = min(stock, remaining)
+            allocations.append((production_id, quantity_taken))
+            remaining -= quantity_taken
+            if stock - quantity_taken > EPSILON:
+                # 使い切らなかったロットは次の注文でも先頭になる
+                heapq.heappush(heap, (production_date, production_id))
+                popped.pop()
+
+        if remaining > EPSILON:
+            for entry in popped:
+                heapq.heappush(heap, entry)
+            return None
+        return allocations
+
+    def allocate(self, tea_type, quality_check, quantity, load_lots, read_lot, version=None):
+        """
+        注文量を生産日の古いロットから順に引き当てる
+        データベースには書き込まない。呼び出し側は同じトランザクションで返されたロットから在庫を差し引き、
+        書き込みに失敗した場合は invalidate() を呼ぶ
+
+        :param tea_type: 茶葉の種類
+        :param quality_check: 品質評価
+        :param quantity: 注文量
+        :param load_lots: sync() に渡す関数
+        :param read_lot: read_lot(production_id) が現在の (在庫量, 茶葉の種類, 品質評価, 生産日) を返す関数
+                         （ロットがなければ None）
+        :param version: 在庫が戻ったロットがあると変わる値（前回の引き当てと異なれば索引を作り直す）
+        :return: [(生産データID, 引き当てる量)]（生産日の古い順）
+        """
+        if quantity <= 0:
+            raise ValueError("出荷量は0より大きい値を指定してください")
+        with self._lock:
+            if version != self._version:
+                self.invalidate()
+                self._version = version
+            self.sync(load_lots)
+            allocations = self._take(tea_type, quality_check, quantity, read_lot)
+            if allocations is None:
+                self.invalidate()
+                self.sync(load_lots)
+                allocations = self._take(tea_type, quality_check, quantity, read_lot)
+            if allocations is None:
+                raise ValueError("在庫が不足しています")
+            return allocations
+
+    def __len__(self):
+        with self._lock:
+            return sum(len(heap) for heap in self._heaps.values())
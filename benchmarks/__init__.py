@@ -0,0 +1,4 @@
+"""
+性能計測用のスクリプト群
+リポジトリのルートから ``python -m benchmarks.<module>`` で実行する
+"""
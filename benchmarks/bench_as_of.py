@@ -0,0 +1,118 @@
+"""
+時点指定の在庫（as-of）クエリの計測
+
+合成データ（5年分の生産・出荷）を入れた database.py のスキーマで、ランダムな日付のロットごとの在庫を
+次の3つの方法で求め、応答時間を比べる。結果が一致することも確認する
+- replay: 生産・出荷データの全履歴から再計算する（台帳がない場合の方法）
+- ledger: 台帳だけを先頭から合計する（スナップショットを使わない場合）
+- snapshot: 最も近いスナップショットとその後の台帳だけを読む（TeaProductionManager.get_stock_as_of）
+
+    python -m benchmarks.bench_as_of --scale 1m --queries 50
+"""
+import argparse
+import datetime
+import json
+import os
+import random
+import statistics
+import tempfile
+import time
+
+from benchmarks.generate import DAYS, START_DATE, generate_raw
+
+REPLAY_QUERY = '''
+    SELECT p.id, p.quantity - COALESCE(s.quantity, 0) AS quantity
+    FROM production p
+    LEFT JOIN (
+        SELECT production_id, SUM(quantity) AS quantity
+        FROM shipment
+        WHERE shipment_date <= ?
+        GROUP BY production_id
+    ) s ON s.production_id = p.id
+    WHERE p.production_date <= ? AND ABS(p.quantity - COALESCE(s.quantity, 0)) > 1e-9
+'''
+
+LEDGER_QUERY = '''
+    SELECT production_id, SUM(quantity) AS quantity
+    FROM stock_ledger
+    WHERE movement_date <= ?
+    GROUP BY production_id
+    HAVING ABS(SUM(quantity)) > 1e-9
+'''
+
+
+def _summary(latencies):
+    latencies = sorted(latencies)
+    return {
+        'median_ms': statistics.median(latencies) * 1000,
+        'p95_ms': latencies[min(int(len(latencies) * 0.95), len(latencies) - 1)] * 1000,
+        'max_ms': latencies[-1] * 1000,
+    }
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description='時点指定の在庫クエリの計測')
+    parser.add_argument('--scale', default='100k', help='合成データの規模')
+    parser.add_argument('--seed', type=int, default=0)
+    parser.add_argument('--queries', type=int, default=30, help='計測する日付の数')
+    parser.add_argument('--output', help='結果を書き出すJSONファイル')
+    args = parser.parse_args(argv)
+
+    from tea_manager import TeaProductionManager
+
+    rng = random.Random(args.seed)
+    # 出荷は生産日から最大60日後まであるため、その分も含める
+    dates = [(START_DATE + datetime.timedelta(days=rng.randrange(DAYS + 60))).isoformat()
+             for _ in range(args.queries)]
+
+    with tempfile.TemporaryDirectory() as tmp:
+        db_file = os.path.join(tmp, 'as_of.db')
+        plan = generate_raw(db_file, args.scale, args.seed)
+        manager = TeaProductionManager(db_file, cache_size=0)
+        conn = manager.conn
+        ledger_rows = conn.execute('SELECT COUNT(*) FROM stock_ledger').fetchone()[0]
+        print(f'scale {args.scale}: {plan.productions} lots, {plan.shipments} shipments, {ledger_rows} ledger rows')
+
+        start = time.perf_counter()
+        checkpoints = manager.create_stock_snapshots()
+        build_s = time.perf_counter() - start
+        snapshot_rows = conn.execute('SELECT COUNT(*) FROM stock_snapshot').fetchone()[0]
+        print(f'  snapshots: {checkpoints} checkpoints, {snapshot_rows} rows, built in {build_s:.2f} s')
+
+        methods = {
+            'replay': lambda d: dict(conn.execute(REPLAY_QUERY, (d, d)).fetchall()),
+            'ledger': lambda d: dict(conn.execute(LEDGER_QUERY, (d,)).fetchall()),
+            'snapshot': lambda d: dict(manager.get_stock_as_of(d)[['production_id', 'quantity']].itertuples(
+                index=False, name=None)),
+        }
+        latencies = {name: [] for name in methods}
+        for date in dates:
+            results = {}
+            for name, method in methods.items():
+                start = time.perf_counter()
+                results[name] = method(date)
+                latencies[name].append(time.perf_counter() - start)
+            expected = results['replay']
+            for name, result in results.items():
+                if result.keys() != expected.keys() or any(
+                        abs(result[lot] - expected[lot]) > 1e-6 for lot in expected):
+                    raise SystemExit(f'{name} の結果が一致しません: {date}')
+
+        report = {'scale': args.scale, 'seed': args.seed, 'ledger_rows': ledger_rows,
+                  'checkpoints': checkpoints, 'snapshot_rows': snapshot_rows, 'snapshot_build_s': build_s,
+                  'results': {}}
+        for name, values in latencies.items():
+            report['results'][name] = _summary(values)
+            result = report['results'][name]
+            print(f"  {name:<9} median {result['median_ms']:>9.2f} ms  p95 {result['p95_ms']:>9.2f} ms  "
+                  f"max {result['max_ms']:>9.2f} ms")
+        manager.pool.close_all()
+
+    if args.output:
+        with open(args.output, 'w', encoding='utf-8') as f:
+            json.dump(report, f, ensure_ascii=False, indent=2)
+    return report
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,184 @@
+"""
+ASGI（非同期のビュー）とWSGI（同期のビュー）の同時アクセス時の応答時間の比較
+
+合成データを入れたデータベースで、uvicorn で config.asgi を、Django のスレッド付き開発サーバーで config.wsgi を起動し、
+参照系の画面に複数のクライアントから同時にリクエストを送って応答時間の分布を計測する
+ASGI側の計測には uvicorn が必要（pip install uvicorn）
+
+    python -m benchmarks.bench_asgi --scale 100k --concurrency 32 --requests 20
+    python -m benchmarks.bench_asgi --servers asgi --paths /api/shipment/ --output asgi.json
+"""
+import argparse
+import json
+import logging
+import os
+import socket
+import statistics
+import subprocess
+import sys
+import tempfile
+import threading
+import time
+import urllib.error
+import urllib.request
+
+# 計測する画面（参照系のビューとJSON API）
+DEFAULT_PATHS = [
+    '/',
+    '/production/',
+    '/shipment/',
+    '/inventory/',
+    '/production/lookup/?tea_type=煎茶',
+    '/api/inventory/',
+    '/api/production/summary/',
+    '/api/shipment/',
+]
+
+
+def _free_port():
+    with socket.socket() as sock:
+        sock.bind(('127.0.0.1', 0))
+        return sock.getsockname()[1]
+
+
+def _serve(server, db_file, port):
+    """
+    子プロセス側でDjangoを初期化し、サーバーを起動する（終了させられるまで戻らない）
+    """
+    from benchmarks.generate import setup_django
+
+    # URLconf は設定の読み込み時に同期・非同期のビューを選ぶため、Djangoの初期化より前に決める
+    os.environ['TEA_ASYNC_VIEWS'] = '1' if server == 'asgi' else '0'
+    setup_django(db_file)
+
+    if server == 'asgi':
+        import uvicorn
+        from django.core.asgi import get_asgi_application
+
+        uvicorn.run(get_asgi_application(), host='127.0.0.1', port=port, log_level='warning')
+    else:
+        from django.core.servers.basehttp import run
+        from django.core.wsgi import get_wsgi_application
+
+        application = get_wsgi_application()
+        # アクセスログは出力しない（アプリケーションの作成時にログの設定が読み直されるため、その後で変える）
+        logging.getLogger('django.server').setLevel(logging.CRITICAL)
+        run('127.0.0.1', port, application, threading=True)
+
+
+def start_server(server, db_file):
+    """
+    サーバーを子プロセスで起動し、応答するまで待つ
+
+    :return: (子プロセス, ベースURL)
+    """
+    port = _free_port()
+    process = subprocess.Popen(
+        [sys.executable, '-m', 'benchmarks.bench_asgi', '--_serve', server, '--db', db_file, '--port', str(port)])
+    base_url = f'http://127.0.0.1:{port}'
+    deadline = time.monotonic() + 60
+    while time.monotonic() < deadline:
+        if process.poll() is not None:
+            raise SystemExit(f'{server} サーバーの起動に失敗しました')
+        try:
+            urllib.request.urlopen(f'{base_url}/api/inventory/', timeout=5).read()
+            return process, base_url
+        except (urllib.error.URLError, ConnectionError):
+            time.sleep(0.2)
+    process.terminate()
+    raise SystemExit(f'{server} サーバーが応答しません')
+
+
+def load(base_url, path, concurrency, requests):
+    """
+    concurrency 個のスレッドからそれぞれ requests 回続けてリクエストを送る
+
+    :return: 応答時間の分布とスループットの辞書
+    """
+    url = base_url + urllib.request.quote(path, safe='/?=&')
+    latencies = []
+    errors = 0
+    lock = threading.Lock()
+
+    def worker():
+        nonlocal errors
+        for _ in range(requests):
+            start = time.perf_counter()
+            try:
+                urllib.request.urlopen(url, timeout=120).read()
+            except (urllib.error.URLError, ConnectionError):
+                with lock:
+                    errors += 1
+                continue
+            elapsed = time.perf_counter() - start
+            with lock:
+                latencies.append(elapsed)
+
+    workers = [threading.Thread(target=worker) for _ in range(concurrency)]
+    start = time.perf_counter()
+    for t in workers:
+        t.start()
+    for t in workers:
+        t.join()
+    wall = time.perf_counter() - start
+
+    latencies.sort()
+    if not latencies:
+        return {'errors': errors}
+    return {
+        'requests': len(latencies),
+        'errors': errors,
+        'p50_ms': statistics.median(latencies) * 1000,
+        'p95_ms': latencies[min(int(len(latencies) * 0.95), len(latencies) - 1)] * 1000,
+        'max_ms': latencies[-1] * 1000,
+        'requests_per_sec': len(latencies) / wall,
+    }
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description='ASGIとWSGIの同時アクセス時の応答時間の比較')
+    parser.add_argument('--scale', default='10k', help='合成データの規模')
+    parser.add_argument('--seed', type=int, default=0)
+    parser.add_argument('--servers', nargs='+', choices=['wsgi', 'asgi'], default=['wsgi', 'asgi'])
+    parser.add_argument('--paths', nargs='+', default=DEFAULT_PATHS, help='計測する画面のパス')
+    parser.add_argument('--concurrency', type=int, default=16, help='同時に送るクライアントの数')
+    parser.add_argument('--requests', type=int, default=10, help='クライアントごとのリクエスト数')
+    parser.add_argument('--output', help='結果を書き出すJSONファイル')
+    parser.add_argument('--_serve', dest='serve', help=argparse.SUPPRESS)
+    parser.add_argument('--db', help=argparse.SUPPRESS)
+    parser.add_argument('--port', type=int, help=argparse.SUPPRESS)
+    args = parser.parse_args(argv)
+
+    if args.serve:
+        _serve(args.serve, args.db, args.port)
+        return
+
+    results = []
+    with tempfile.TemporaryDirectory() as tmp:
+        db_file = os.path.join(tmp, 'asgi.sqlite3')
+        # データは1回だけ生成し、両方のサーバーで同じファイルを読む
+        subprocess.run([sys.executable, '-m', 'benchmarks.generate', '--scale', str(args.scale),
+                        '--seed', str(args.seed), '--django', db_file], check=True)
+        for server in args.servers:
+            process, base_url = start_server(server, db_file)
+            try:
+                for path in args.paths:
+                    result = {'server': server, 'path': path, 'concurrency': args.concurrency,
+                              **load(base_url, path, args.concurrency, args.requests)}
+                    results.append(result)
+                    print(f"  {server} {path:<36} p50 {result.get('p50_ms', 0):>9.1f} ms  "
+                          f"p95 {result.get('p95_ms', 0):>9.1f} ms  "
+                          f"{result.get('requests_per_sec', 0):>8.1f} req/s  errors {result['errors']}")
+            finally:
+                process.terminate()
+                process.wait()
+
+    report = {'scale': args.scale, 'seed': args.seed, 'results': results}
+    if args.output:
+        with open(args.output, 'w', encoding='utf-8') as f:
+            json.dump(report, f, ensure_ascii=False, indent=2)
+    return report
+
+
+if __name__ == '__main__':
+    main()
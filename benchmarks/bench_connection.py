@@ -0,0 +1,98 @@
+"""
+接続設定による書き込みスループットの比較
+
+既定設定の接続（チューニング前）と PRAGMAS を適用した接続（チューニング後）で
+1行ずつコミットする生産データ登録と、複数スレッドからの同時書き込みを計測する
+
+    python -m benchmarks.bench_connection --rows 2000 --threads 4
+"""
+import argparse
+import json
+import os
+import tempfile
+import threading
+import time
+
+from database import ConnectionPool, create_tables
+from tea_manager import TeaProductionManager
+
+
+def _prepare(db_file, tuned):
+    pool = ConnectionPool(db_file, tuned=tuned)
+    create_tables(pool.get_connection())
+    return pool
+
+
+def bench_single_writer(db_file, tuned, rows):
+    """
+    1スレッドで1行ずつ登録したときの毎秒行数を返す
+    """
+    pool = _prepare(db_file, tuned)
+    manager = TeaProductionManager(pool=pool)
+    start = time.perf_counter()
+    for i in range(rows):
+        manager.add_production('煎茶', 10.0 + i % 5, '2024-04-01', 'A級')
+    elapsed = time.perf_counter() - start
+    pool.close_all()
+    return rows / elapsed
+
+
+def bench_concurrent_writers(db_file, tuned, rows, threads):
+    """
+    複数スレッドが同じファイルに書き込んだときの毎秒行数とロックエラー数を返す
+    """
+    pool = _prepare(db_file, tuned)
+    manager = TeaProductionManager(pool=pool)
+    errors = []
+
+    def worker():
+        for i in range(rows // threads):
+            try:
+                manager.add_production('玉露', 5.0, '2024-04-01', 'B級')
+            except Exception as e:
+                errors.append(str(e))
+                manager.conn.rollback()
+
+    workers = [threading.Thread(target=worker) for _ in range(threads)]
+    start = time.perf_counter()
+    for t in workers:
+        t.start()
+    for t in workers:
+        t.join()
+    elapsed = time.perf_counter() - start
+    pool.close_all()
+    return (rows - len(errors)) / elapsed, len(errors)
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description=__doc__.strip().splitlines()[0])
+    parser.add_argument('--rows', type=int, default=2000)
+    parser.add_argument('--threads', type=int, default=4)
+    parser.add_argument('--output', help='結果を書き出すJSONファイル')
+    args = parser.parse_args(argv)
+
+    results = {}
+    with tempfile.TemporaryDirectory() as tmp:
+        for label, tuned in (('before', False), ('after', True)):
+            single = bench_single_writer(os.path.join(tmp, f'{label}_single.db'), tuned, args.rows)
+            concurrent, errors = bench_concurrent_writers(
+                os.path.join(tmp, f'{label}_concurrent.db'), tuned, args.rows, args.threads)
+            results[label] = {
+                'single_writer_rows_per_sec': round(single, 1),
+                'concurrent_rows_per_sec': round(concurrent, 1),
+                'concurrent_lock_errors': errors,
+            }
+
+    for label, result in results.items():
+        print(f"{label:>6}: 単一 {result['single_writer_rows_per_sec']:>10.1f} 行/秒  "
+              f"並行 {result['concurrent_rows_per_sec']:>10.1f} 行/秒  "
+              f"ロックエラー {result['concurrent_lock_errors']}")
+
+    if args.output:
+        with open(args.output, 'w', encoding='utf-8') as f:
+            json.dump(results, f, ensure_ascii=False, indent=2)
+    return results
+
+
+if __name__ == '__main__':
+    main()
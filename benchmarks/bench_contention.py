@@ -0,0 +1,154 @@
+"""
+同じロットへの同時出荷の負荷試験
+
+複数スレッドが在庫の限られた同じロットに出荷を記録し続け、
+売り越し（在庫の合計を超える出荷）が起きないことを確認して、毎秒の出荷件数を計測する
+
+    python -m benchmarks.bench_contention --target manager --threads 8 --attempts 500
+    python -m benchmarks.bench_contention --target django --threads 8 --attempts 200
+"""
+import argparse
+import json
+import logging
+import os
+import tempfile
+import threading
+import time
+from decimal import Decimal
+
+from database import ConnectionPool, create_tables
+
+
+def run_manager(tmp, threads, attempts, stock, quantity):
+    """
+    TeaProductionManager.record_shipment を複数スレッドから呼び出す
+    """
+    from tea_manager import TeaProductionManager
+
+    pool = ConnectionPool(os.path.join(tmp, 'contention.db'))
+    create_tables(pool.get_connection())
+    manager = TeaProductionManager(pool=pool, cache_size=0)
+    lot = manager.add_production('煎茶', stock, '2024-04-01', 'A級')
+
+    counts = {'shipped': 0, 'rejected': 0, 'errors': 0}
+    lock = threading.Lock()
+
+    def worker():
+        for _ in range(attempts):
+            try:
+                manager.record_shipment(lot, quantity, '顧客000', '2024-04-02')
+                key = 'shipped'
+            except ValueError:
+                key = 'rejected'
+            except Exception:
+                key = 'errors'
+            with lock:
+                counts[key] += 1
+
+    elapsed = _run_threads(worker, threads)
+    conn = pool.get_connection()
+    remaining = conn.execute('SELECT quantity FROM inventory WHERE production_id = ?', (lot,)).fetchone()[0]
+    shipped_total = conn.execute(
+        'SELECT COALESCE(SUM(quantity), 0) FROM shipment WHERE production_id = ?', (lot,)).fetchone()[0]
+    pool.close_all()
+    return counts, elapsed, remaining, shipped_total
+
+
+def run_django(tmp, threads, attempts, stock, quantity):
+    """
+    shipment_create ビューを複数スレッドから呼び出す
+    """
+    from benchmarks.generate import setup_django
+
+    setup_django(os.path.join(tmp, 'contention.sqlite3'))
+
+    from django.db import connection
+    from django.db.models import Sum
+    from django.test import Client
+    from django.test.utils import setup_test_environment
+    from django.urls import reverse
+    from tea_production.models import Inventory, Production, Shipment
+
+    setup_test_environment()
+    # ロック待ちのタイムアウトなどはエラー件数として数えるため、スタックトレースは出力しない
+    logging.getLogger('django.request').setLevel(logging.CRITICAL)
+    production = Production.objects.create(
+        tea_type='煎茶', production_date='2024-04-01', quantity=Decimal(stock), quality_check='A級')
+    Inventory.objects.create(production=production, quantity=Decimal(stock))
+    url = reverse('tea_production:shipment_create')
+
+    counts = {'shipped': 0, 'rejected': 0, 'errors': 0}
+    lock = threading.Lock()
+
+    def worker():
+        client = Client()
+        try:
+            for _ in range(attempts):
+                try:
+                    response = client.post(url, {
+                        'production': production.pk, 'shipment_date': '2024-04-02',
+                        'quantity': str(quantity), 'customer_name': '顧客000',
+                    })
+                    # 登録できた場合は一覧へリダイレクトし、在庫不足やロット不可の場合はフォームを再表示する
+                    key = 'shipped' if response.status_code == 302 else 'rejected'
+                except Exception:
+                    key = 'errors'
+                with lock:
+                    counts[key] += 1
+        finally:
+            connection.close()
+
+    elapsed = _run_threads(worker, threads)
+    remaining = Inventory.objects.get(production=production).quantity
+    shipped_total = Shipment.objects.filter(production=production).aggregate(total=Sum('quantity'))['total'] or 0
+    return counts, elapsed, float(remaining), float(shipped_total)
+
+
+def _run_threads(worker, threads):
+    workers = [threading.Thread(target=worker) for _ in range(threads)]
+    start = time.perf_counter()
+    for t in workers:
+        t.start()
+    for t in workers:
+        t.join()
+    return time.perf_counter() - start
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description='同じロットへの同時出荷の負荷試験')
+    parser.add_argument('--target', choices=['manager', 'django'], default='manager')
+    parser.add_argument('--threads', type=int, default=8)
+    parser.add_argument('--attempts', type=int, default=500, help='スレッドごとの出荷の試行回数')
+    parser.add_argument('--stock', type=float, default=1000.0, help='ロットの在庫量')
+    parser.add_argument('--quantity', type=float, default=1.0, help='1回の出荷量')
+    parser.add_argument('--output', help='結果を書き出すJSONファイル')
+    args = parser.parse_args(argv)
+
+    run = run_manager if args.target == 'manager' else run_django
+    with tempfile.TemporaryDirectory() as tmp:
+        counts, elapsed, remaining, shipped_total = run(
+            tmp, args.threads, args.attempts, args.stock, args.quantity)
+
+    oversold = shipped_total > args.stock or remaining < 0 or abs(args.stock - shipped_total - remaining) > 1e-6
+    result = {
+        'target': args.target,
+        'threads': args.threads,
+        'attempts': args.threads * args.attempts,
+        **counts,
+        'shipments_per_sec': counts['shipped'] / elapsed,
+        'stock': args.stock,
+        'shipped_quantity': shipped_total,
+        'remaining_stock': remaining,
+        'oversold': oversold,
+    }
+    print(json.dumps(result, ensure_ascii=False, indent=2))
+    if args.output:
+        with open(args.output, 'w', encoding='utf-8') as f:
+            json.dump(result, f, ensure_ascii=False, indent=2)
+    if oversold:
+        raise SystemExit('売り越しが発生しました')
+    return result
+
+
+if __name__ == '__main__':
+    main()
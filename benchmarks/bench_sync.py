@@ -0,0 +1,190 @@
+"""
+tea_production.db とDjangoのデータベースの同期（tea_production.sync）の計測
+
+合成データを入れた tea_production.db を空のDjangoのデータベースに最初に同期したあと、
+双方で変更を加えて同期する時間を変更の件数ごとに計測し、両方のデータベースの内容が一致することを確認する
+同期の時間はテーブルの行数ではなく変更の件数に比例する（規模を変えて実行しても変更あたりの時間はほぼ同じ）
+
+    python -m benchmarks.bench_sync --scale 100k --changes 10 100 1000
+"""
+import argparse
+import json
+import os
+import random
+import tempfile
+import time
+from decimal import Decimal
+
+from benchmarks.generate import generate_raw, setup_django
+
+
+def _raw_state(conn):
+    """
+    tea_production.db の内容（IDによらない比較用）
+    """
+    lots = {row[0]: row[1:] for row in conn.execute(
+        'SELECT id, tea_type, production_date, ROUND(quantity, 2), quality_check FROM production')}
+    shipments = conn.execute('SELECT production_id, shipment_date, ROUND(quantity, 2), customer_name FROM shipment')
+    inventory = conn.execute('SELECT production_id, ROUND(quantity, 2) FROM inventory')
+    return (sorted(lots.values()),
+            sorted((lots[lot], *rest) for lot, *rest in shipments),
+            sorted((lots[lot], quantity) for lot, quantity in inventory))
+
+
+def _django_state():
+    """
+    Djangoのデータベースの内容（IDによらない比較用）
+    """
+    from tea_production.models import Inventory, Production, Shipment
+
+    lots = {pk: (tea_type, date.isoformat(), float(quantity), grade) for pk, tea_type, date, quantity, grade in
+            Production.objects.values_list('id', 'tea_type', 'production_date', 'quantity', 'quality_check')}
+    shipments = Shipment.objects.values_list('production_id', 'shipment_date', 'quantity', 'customer_name')
+    inventory = Inventory.objects.values_list('production_id', 'quantity')
+    return (sorted(lots.values()),
+            sorted((lots[lot], date.isoformat(), float(quantity), customer)
+                   for lot, date, quantity, customer in shipments),
+            sorted((lots[lot], float(quantity)) for lot, quantity in inventory))
+
+
+def _make_changes(manager, rng, count):
+    """
+    tea_production.db とDjangoのデータベースのそれぞれで count 件ずつ変更する
+    （tea_production.db では品質評価の変更、Djangoでは出荷の登録と在庫の差し引き）
+    """
+    from tea_production.models import Inventory, Shipment
+
+    lots = [row[0] for row in manager.conn.execute('SELECT id FROM production ORDER BY RANDOM() LIMIT ?',
+                                                   (count,))]
+    for lot in lots:
+        manager.update_quality_check(lot, rng.choice(['A級', 'B級', 'C級']), 'bench_sync')
+    inventories = list(Inventory.objects.filter(quantity__gte=1).order_by('?')[:count])
+    for inventory in inventories:
+        Shipment.objects.create(production_id=inventory.production_id, shipment_date='2025-01-01',
+                                quantity=Decimal('1'), customer_name='bench_sync')
+        inventory.quantity -= 1
+        inventory.save()
+
+
+def _make_conflicts(manager):
+    """
+    Djangoで削除した行を tea_production.db で変更する（同期では tea_production.db の値で作り直す）
+    tea_production.db から同期したロットと、Djangoで登録して同期した出荷を1件ずつ使う
+
+    :return: 作り直されるロットの生産データID（tea_production.db）
+    """
+    from tea_production.models import Inventory, Production, Shipment, SyncedRow
+
+    raw_lot, lot = SyncedRow.objects.filter(table_name='production').values_list('raw_id', 'django_id')[0]
+    Shipment.objects.filter(production_id=lot).delete()
+    Inventory.objects.filter(production_id=lot).delete()
+    Production.objects.filter(pk=lot).delete()
+    manager.update_quality_check(raw_lot, 'A級', 'bench_sync conflict')
+
+    shipment = Shipment.objects.filter(customer_name='bench_sync').exclude(production_id=lot).first()
+    raw_shipment = manager.conn.execute(
+        "SELECT raw_id FROM sync_id_map WHERE table_name = 'shipment' AND django_id = ?", (shipment.pk,)).fetchone()[0]
+    shipment.delete()
+    with manager.conn:
+        manager.conn.execute("UPDATE shipment SET customer_name = 'bench_sync conflict' WHERE id = ?",
+                             (raw_shipment,))
+    return raw_lot
+
+
+def _make_concurrent_shipments(manager):
+    """
+    同じロットから tea_production.db とDjangoの両方で出荷する（同期では両方の出荷を在庫から差し引く）
+
+    :return: (ロットの生産データID（tea_production.db）, 同期後に期待する在庫量)
+    """
+    from tea_production.models import Inventory, Shipment, SyncedRow
+
+    raw_lot, lot = (SyncedRow.objects.filter(table_name='production', django_id__in=Inventory.objects.filter(
+        quantity__gte=2).values('production_id')).values_list('raw_id', 'django_id')[0])
+    stock = manager.conn.execute('SELECT quantity FROM inventory WHERE production_id = ?', (raw_lot,)).fetchone()[0]
+    manager.record_shipment(raw_lot, 1, 'bench_sync concurrent', '2025-01-02')
+    Shipment.objects.create(production_id=lot, shipment_date='2025-01-02',
+                            quantity=Decimal('0.5'), customer_name='bench_sync concurrent')
+    inventory = Inventory.objects.get(production_id=lot)
+    inventory.quantity -= Decimal('0.5')
+    inventory.save()
+    return raw_lot, round(stock - 1.5, 2)
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description='データベースの同期の計測')
+    parser.add_argument('--scale', default='10k', help='合成データの規模')
+    parser.add_argument('--seed', type=int, default=0)
+    parser.add_argument('--changes', type=int, nargs='+', default=[10, 100, 1000],
+                        help='1回の同期の前に双方で加える変更の件数')
+    parser.add_argument('--batch-size', type=int, help='1トランザクションで反映する変更の件数')
+    parser.add_argument('--output', help='結果を書き出すJSONファイル')
+    args = parser.parse_args(argv)
+
+    with tempfile.TemporaryDirectory() as tmp:
+        raw_file = os.path.join(tmp, 'tea_production.db')
+        plan = generate_raw(raw_file, args.scale, args.seed)
+        setup_django(os.path.join(tmp, 'django.sqlite3'))
+
+        from tea_manager import TeaProductionManager
+        from tea_production.sync import BATCH_SIZE, sync
+
+        batch_size = args.batch_size or BATCH_SIZE
+        manager = TeaProductionManager(raw_file, cache_size=0)
+        conn = manager.conn
+        rng = random.Random(args.seed)
+        report = {'scale': args.scale, 'seed': args.seed, 'batch_size': batch_size, 'results': []}
+
+        start = time.perf_counter()
+        result = sync(conn, batch_size)
+        elapsed = time.perf_counter() - start
+        print(f'scale {args.scale}: {plan.productions} lots, {plan.shipments} shipments')
+        print(f"  initial     {result['pulled']:>8} changes  {elapsed:>8.2f} s")
+        report['initial'] = {**result, 'seconds': elapsed}
+
+        for count in args.changes:
+            _make_changes(manager, rng, count)
+            start = time.perf_counter()
+            result = sync(conn, batch_size)
+            elapsed = time.perf_counter() - start
+            changes = result['pulled'] + result['pushed']
+            print(f'  {count:>5} each {changes:>8} changes  {elapsed * 1000:>8.1f} ms  '
+                  f'({elapsed * 1000 / changes:.3f} ms/change)')
+            report['results'].append({'changes_each': count, **result, 'seconds': elapsed})
+
+        if _raw_state(conn) != _django_state():
+            raise SystemExit('同期後のデータベースの内容が一致しません')
+
+        # 一方で削除した行を他方で変更しても、同期が止まらず tea_production.db の値で作り直されること
+        raw_lot = _make_conflicts(manager)
+        result = sync(conn, batch_size)
+        from tea_production.models import SyncedRow
+        if _raw_state(conn) != _django_state():
+            raise SystemExit('削除と変更が重なった行の同期後に、データベースの内容が一致しません')
+        if SyncedRow.objects.filter(table_name='production', raw_id=raw_lot).count() != 1:
+            raise SystemExit(f'作り直したロット {raw_lot} のIDの対応が1件ではありません')
+        print(f"  conflicts   {result['pulled'] + result['pushed']:>8} changes  recreated on the Django side")
+
+        # 同じロットから双方で出荷しても、どちらの出荷も在庫から差し引かれること
+        raw_lot, expected = _make_concurrent_shipments(manager)
+        result = sync(conn, batch_size)
+        stock = conn.execute('SELECT ROUND(quantity, 2) FROM inventory WHERE production_id = ?', (raw_lot,)).fetchone()[0]
+        if stock != expected:
+            raise SystemExit(f'双方で出荷したロット {raw_lot} の在庫量が {stock} です（期待値 {expected}）')
+        if _raw_state(conn) != _django_state():
+            raise SystemExit('双方で出荷したロットの同期後に、データベースの内容が一致しません')
+        print(f"  concurrent  {result['pulled'] + result['pushed']:>8} changes  both shipments deducted")
+        again = sync(conn, batch_size)
+        if again['pulled'] or again['pushed']:
+            raise SystemExit(f'変更がないのに反映されました: {again}')
+        print('  both databases match')
+        manager.pool.close_all()
+
+    if args.output:
+        with open(args.output, 'w', encoding='utf-8') as f:
+            json.dump(report, f, ensure_ascii=False, indent=2)
+    return report
+
+
+if __name__ == '__main__':
+    main()
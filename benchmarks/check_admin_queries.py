@@ -0,0 +1,103 @@
+"""
+管理画面の一覧のクエリ数が件数によらず一定であることを確認する
+
+小さい規模と大きい規模の合成データで各一覧を表示し、発行されたクエリ数が期待値と一致しない場合
+（行ごとに関連データを読むN+1や、件数に応じて増えるクエリがある場合）は終了コード1で終わる
+
+    python -m benchmarks.check_admin_queries
+    python -m benchmarks.check_admin_queries --scales 1000 100k --verbose
+"""
+import argparse
+import os
+import tempfile
+
+from benchmarks.generate import generate_django, setup_django
+
+# 1ページの表示に使うクエリ数（セッション・ログインユーザーの読み込みを含む）
+BASE_QUERIES = 2
+
+
+def query_cases():
+    """
+    確認する一覧を (名前, URL名, GETパラメータ, 期待するクエリ数) で返す
+    一覧のクエリは、件数（見積もり）・1ページ分の行・日付階層の範囲と年の一覧の4件
+    日付階層で絞り込んだ場合は範囲の代わりに月・日の一覧を読み、件数は正確に数える
+    """
+    return [
+        ('production', 'admin:tea_production_production_changelist', {}, BASE_QUERIES + 4),
+        ('production[p=2]', 'admin:tea_production_production_changelist', {'p': '2'}, BASE_QUERIES + 4),
+        ('production[tea_type]', 'admin:tea_production_production_changelist',
+         {'tea_type__exact': '玉露'}, BASE_QUERIES + 4),
+        ('shipment', 'admin:tea_production_shipment_changelist', {}, BASE_QUERIES + 4),
+        ('shipment[p=2]', 'admin:tea_production_shipment_changelist', {'p': '2'}, BASE_QUERIES + 4),
+        ('shipment[year]', 'admin:tea_production_shipment_changelist',
+         {'shipment_date__year': '2021'}, BASE_QUERIES + 3),
+        ('shipment[tea_type]', 'admin:tea_production_shipment_changelist',
+         {'production__tea_type': '煎茶'}, BASE_QUERIES + 4),
+        ('inventory', 'admin:tea_production_inventory_changelist', {}, BASE_QUERIES + 4),
+        ('inventory[p=2]', 'admin:tea_production_inventory_changelist', {'p': '2'}, BASE_QUERIES + 4),
+    ]
+
+
+def count_queries(client, connection, url, params):
+    """
+    一覧を表示して発行されたクエリを返す
+    """
+    from django.test.utils import CaptureQueriesContext
+
+    with CaptureQueriesContext(connection) as captured:
+        response = client.get(url, params)
+    if response.status_code != 200:
+        raise SystemExit(f'{url}: HTTP {response.status_code}')
+    return [query['sql'] for query in captured.captured_queries]
+
+
+def _clear():
+    from tea_production.models import Inventory, Production, Shipment
+
+    Shipment.objects.all().delete()
+    Inventory.objects.all().delete()
+    Production.objects.all().delete()
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description='管理画面の一覧のクエリ数を確認する')
+    parser.add_argument('--scales', nargs=2, default=['1000', '10k'], help='比べる2つの規模')
+    parser.add_argument('--seed', type=int, default=0)
+    parser.add_argument('--verbose', action='store_true', help='発行されたクエリを表示する')
+    args = parser.parse_args(argv)
+
+    with tempfile.TemporaryDirectory() as tmp:
+        setup_django(os.path.join(tmp, 'admin_queries.sqlite3'))
+
+        from django.contrib.auth import get_user_model
+        from django.db import connection
+        from django.test import Client
+        from django.test.utils import setup_test_environment
+        from django.urls import reverse
+
+        setup_test_environment()
+        client = Client()
+        client.force_login(get_user_model().objects.create_superuser('queries', 'queries@example.com', 'queries'))
+
+        failed = False
+        for scale in args.scales:
+            _clear()
+            generate_django(scale, args.seed)
+            print(f'scale {scale}')
+            for name, url_name, params, expected in query_cases():
+                queries = count_queries(client, connection, reverse(url_name), params)
+                ok = len(queries) == expected
+                print(f"  {'OK' if ok else 'NG'} {name:<24} {len(queries)} queries (expected {expected})")
+                if not ok or args.verbose:
+                    for sql in queries:
+                        print(f'     {sql[:160]}')
+                failed = failed or not ok
+        connection.close()
+
+    if failed:
+        raise SystemExit(1)
+
+
+if __name__ == '__main__':
+    main()
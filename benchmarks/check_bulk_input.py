@@ -0,0 +1,89 @@
+"""
+一括登録（add_productions_bulk, record_shipments_bulk）がDataFrameの日付の列を受け付けることを確認する
+
+datetime64 の列、datetime.date の列、文字列の列のそれぞれで登録し、
+生産日・出荷日が YYYY-MM-DD の文字列として保存されていない場合は終了コード1で終わる
+
+    python -m benchmarks.check_bulk_input
+"""
+import datetime
+import os
+import tempfile
+
+import pandas as pd
+
+from tea_manager import TeaProductionManager
+
+# 登録する日付と、保存されるべき値
+DATES = ['2024-04-01', '2024-04-15', '2024-05-01']
+
+
+def date_columns():
+    """
+    確認する日付の列を (名前, 列の値) で返す
+    """
+    return [
+        ('datetime64', pd.to_datetime(DATES)),
+        ('datetime64[tz]', pd.to_datetime(DATES).tz_localize('Asia/Tokyo')),
+        ('datetime64[time]', pd.to_datetime(DATES) + pd.Timedelta(hours=9, minutes=30)),
+        ('datetime.date', [datetime.date.fromisoformat(value) for value in DATES]),
+        ('str', DATES),
+    ]
+
+
+def check(manager, values):
+    """
+    日付の列を持つDataFrameで生産・出荷データを一括登録し、保存された日付を調べる
+
+    :return: 問題の一覧
+    """
+    productions = pd.DataFrame({
+        'tea_type': ['煎茶'] * len(DATES),
+        'quantity': [100.0] * len(DATES),
+        'production_date': values,
+        'quality_check': ['A級'] * len(DATES),
+    })
+    production_ids = manager.add_productions_bulk(productions)
+    shipments = pd.DataFrame({
+        'production_id': production_ids,
+        'quantity': [10.0] * len(DATES),
+        'customer_name': ['check_bulk_input'] * len(DATES),
+        'shipment_date': values,
+    })
+    shipment_ids, failures = manager.record_shipments_bulk(shipments)
+
+    problems = [f"出荷の登録に失敗しました: {failure['reason']}" for failure in failures]
+    placeholders = ', '.join('?' * len(production_ids))
+    stored = [row[0] for row in manager.conn.execute(
+        f'SELECT production_date FROM production WHERE id IN ({placeholders}) ORDER BY id', production_ids)]
+    if stored != DATES:
+        problems.append(f'生産日が {stored} で保存されました')
+    placeholders = ', '.join('?' * len(shipment_ids))
+    stored = [row[0] for row in manager.conn.execute(
+        f'SELECT shipment_date FROM shipment WHERE id IN ({placeholders}) ORDER BY id', shipment_ids)]
+    if stored != DATES:
+        problems.append(f'出荷日が {stored} で保存されました')
+    return problems
+
+
+def main():
+    failed = False
+    with tempfile.TemporaryDirectory() as tmp:
+        manager = TeaProductionManager(os.path.join(tmp, 'tea_production.db'), cache_size=0)
+        for name, values in date_columns():
+            try:
+                problems = check(manager, values)
+            except Exception as e:
+                problems = [f'{type(e).__name__}: {e}']
+            print(f"{'NG' if problems else 'OK'} {name}")
+            for problem in problems:
+                print(f'   {problem}')
+            failed = failed or bool(problems)
+        manager.pool.close_all()
+
+    if failed:
+        raise SystemExit(1)
+
+
+if __name__ == '__main__':
+    main()
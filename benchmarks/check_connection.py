@@ -0,0 +1,106 @@
+"""
+接続の設定（database.PRAGMAS）と接続プールのスレッドごとの接続を確認する
+
+create_connection の接続と ConnectionPool の各スレッドの接続で PRAGMA の値を読み返し、
+スレッドごとに別の接続が作られ、同じスレッドでは同じ接続が返ることを調べる
+期待と異なる場合は終了コード1で終わる
+
+    python -m benchmarks.check_connection --threads 8
+"""
+import argparse
+import os
+import tempfile
+import threading
+
+from database import PRAGMAS, ConnectionPool, create_connection, create_tables
+from tea_manager import TeaProductionManager
+
+# PRAGMA を読み返したときの値（名前で設定した値は数値で返る）
+EXPECTED = {
+    'journal_mode': 'wal',
+    'synchronous': 1,
+    'cache_size': PRAGMAS['cache_size'],
+    'mmap_size': PRAGMAS['mmap_size'],
+    'busy_timeout': PRAGMAS['busy_timeout'],
+    'temp_store': 2,
+}
+
+
+def check_pragmas(conn):
+    """
+    接続の PRAGMA の値を調べる
+
+    :return: 問題の一覧
+    """
+    problems = []
+    for name, expected in EXPECTED.items():
+        actual = conn.execute(f'PRAGMA {name}').fetchone()[0]
+        if actual != expected:
+            problems.append(f'{name} = {actual}（期待値 {expected}）')
+    return problems
+
+
+def check_pool(db_file, threads):
+    """
+    複数のスレッドで接続プールから接続を取得し、スレッドごとの接続と PRAGMA を調べる
+
+    :return: 問題の一覧
+    """
+    pool = ConnectionPool(db_file)
+    manager = TeaProductionManager(pool=pool, cache_size=0)
+    results = {}
+    barrier = threading.Barrier(threads, timeout=30)
+
+    def worker(index):
+        conn = pool.get_connection()
+        # すべてのスレッドが接続を持った状態で比べる（終了したスレッドの接続のIDが再利用されないように）
+        barrier.wait()
+        problems = [f'スレッド{index}: {problem}' for problem in check_pragmas(conn)]
+        if pool.get_connection() is not conn or manager.conn is not conn:
+            problems.append(f'スレッド{index}: 同じスレッドで別の接続が返りました')
+        results[index] = (conn, problems)
+        barrier.wait()
+
+    workers = [threading.Thread(target=worker, args=(i,)) for i in range(threads)]
+    for t in workers:
+        t.start()
+    for t in workers:
+        t.join()
+
+    problems = [problem for _, thread_problems in results.values() for problem in thread_problems]
+    connections = {id(conn) for conn, _ in results.values()}
+    if len(results) != threads:
+        problems.append(f'{threads - len(results)}個のスレッドが接続を取得できませんでした')
+    elif len(connections) != threads:
+        problems.append(f'{threads}個のスレッドで接続が{len(connections)}個しか作られていません')
+    pool.close_all()
+    return problems
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description='接続の設定と接続プールを確認する')
+    parser.add_argument('--threads', type=int, default=4, help='接続プールを使うスレッド数')
+    args = parser.parse_args(argv)
+
+    with tempfile.TemporaryDirectory() as tmp:
+        db_file = os.path.join(tmp, 'tea_production.db')
+        conn = create_connection(db_file)
+        create_tables(conn)
+        cases = [
+            ('create_connection', check_pragmas(conn)),
+            (f'ConnectionPool[{args.threads} threads]', check_pool(db_file, args.threads)),
+        ]
+        conn.close()
+
+    failed = False
+    for name, problems in cases:
+        print(f"{'NG' if problems else 'OK'} {name}")
+        for problem in problems:
+            print(f'   {problem}')
+        failed = failed or bool(problems)
+    if failed:
+        raise SystemExit(1)
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,126 @@
+"""
+一覧画面と管理画面のクエリがインデックスを使っていることを確認する
+
+合成データを入れたデータベースで各画面を表示し、発行されたSELECT文の実行計画（EXPLAIN QUERY PLAN）を調べる
+期待するインデックスが使われていない場合や、並び替えのために一時的なB-treeを作る場合は終了コード1で終わる
+
+    python -m benchmarks.check_plans
+    python -m benchmarks.check_plans --scale 100k --verbose
+"""
+import argparse
+import os
+import tempfile
+
+from benchmarks.generate import generate_django, setup_django
+
+# 並び替えのために全件を一時的に並べ直していることを示す実行計画
+TEMP_SORT = 'USE TEMP B-TREE FOR ORDER BY'
+
+
+def plan_cases():
+    """
+    確認する画面を (名前, URL名, GETパラメータ, 使われるべきインデックス) で返す
+    """
+    return [
+        ('production_list', 'tea_production:production_list', {}, 'production_date_idx'),
+        ('production_list[tea_type]', 'tea_production:production_list',
+         {'tea_type': '玉露'}, 'production_tea_type_date_idx'),
+        ('shipment_list', 'tea_production:shipment_list', {}, 'shipment_date_idx'),
+        ('shipment_list[customer]', 'tea_production:shipment_list',
+         {'customer_name': '顧客001'}, 'shipment_customer_date_idx'),
+        ('inventory_list', 'tea_production:inventory_list', {}, 'inventory_last_updated_idx'),
+        ('production_lookup', 'tea_production:production_lookup',
+         {'tea_type': '煎茶'}, 'production_tea_type_date_idx'),
+        ('index', 'tea_production:index', {}, 'inventory_in_stock_idx'),
+        ('admin:production', 'admin:tea_production_production_changelist', {}, 'production_date_idx'),
+        ('admin:production[tea_type]', 'admin:tea_production_production_changelist',
+         {'tea_type__exact': '玉露'}, 'production_tea_type_date_idx'),
+        ('admin:production[quality_check]', 'admin:tea_production_production_changelist',
+         {'quality_check__exact': 'C級'}, 'production_quality_check_idx'),
+        ('admin:shipment', 'admin:tea_production_shipment_changelist', {}, 'shipment_date_idx'),
+        ('admin:inventory', 'admin:tea_production_inventory_changelist', {}, 'inventory_last_updated_idx'),
+    ]
+
+
+def explain(connection, sql, params):
+    """
+    SELECT文の実行計画を1行ずつの文字列で返す
+    """
+    with connection.cursor() as cursor:
+        cursor.execute(f'EXPLAIN QUERY PLAN {sql}', params)
+        return [row[-1] for row in cursor.fetchall()]
+
+
+def check(client, connection, url, params, index):
+    """
+    画面を表示して発行されたSELECT文の実行計画を調べる
+
+    :return: (問題の一覧, [(SQL, 実行計画)])
+    """
+    from django.test.utils import CaptureQueriesContext
+
+    with CaptureQueriesContext(connection) as captured:
+        response = client.get(url, params)
+    problems = []
+    if response.status_code != 200:
+        problems.append(f'HTTP {response.status_code}')
+
+    plans = []
+    for query in captured.captured_queries:
+        sql = query['sql']
+        # 計測のためにキャプチャしたSQLはパラメータが展開されているため、そのまま実行計画を取る
+        if not sql.startswith('SELECT') or 'django_session' in sql or 'auth_user' in sql:
+            continue
+        plans.append((sql, explain(connection, sql, ())))
+
+    if not any(f'INDEX {index}' in line for _, plan in plans for line in plan):
+        problems.append(f'{index} が使われていません')
+    for sql, plan in plans:
+        if any(TEMP_SORT in line for line in plan):
+            problems.append(f'並び替えに一時的なB-treeを使っています: {sql[:120]}')
+    return problems, plans
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description='一覧画面と管理画面の実行計画を確認する')
+    parser.add_argument('--scale', default='10k', help='合成データの規模')
+    parser.add_argument('--seed', type=int, default=0)
+    parser.add_argument('--verbose', action='store_true', help='すべての実行計画を表示する')
+    args = parser.parse_args(argv)
+
+    with tempfile.TemporaryDirectory() as tmp:
+        setup_django(os.path.join(tmp, 'plans.sqlite3'))
+
+        from django.contrib.auth import get_user_model
+        from django.db import connection
+        from django.test import Client
+        from django.test.utils import setup_test_environment
+        from django.urls import reverse
+
+        setup_test_environment()
+        generate_django(args.scale, args.seed)
+        with connection.cursor() as cursor:
+            cursor.execute('ANALYZE')
+        client = Client()
+        client.force_login(get_user_model().objects.create_superuser('plans', 'plans@example.com', 'plans'))
+
+        failed = False
+        for name, url_name, params, index in plan_cases():
+            problems, plans = check(client, connection, reverse(url_name), params, index)
+            print(f"{'NG' if problems else 'OK'} {name}")
+            for problem in problems:
+                print(f'   {problem}')
+            if problems or args.verbose:
+                for sql, plan in plans:
+                    print(f'   {sql[:160]}')
+                    for line in plan:
+                        print(f'     {line}')
+            failed = failed or bool(problems)
+        connection.close()
+
+    if failed:
+        raise SystemExit(1)
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,122 @@
+"""
+database.py のスキーマ（tea_production.db）のクエリがインデックスを使っていることを確認する
+
+合成データを入れたデータベースで TeaProductionManager の在庫の引き当て・日付範囲のレポート・
+茶葉の種類と日付での絞り込みを実行し、発行されたSQL文の実行計画（EXPLAIN QUERY PLAN）を調べる
+期待するインデックスが使われていない場合や、並び替えのために一時的なB-treeを作る場合は終了コード1で終わる
+
+    python -m benchmarks.check_raw_plans
+    python -m benchmarks.check_raw_plans --scale 100k --verbose
+"""
+import argparse
+import datetime
+import os
+import tempfile
+
+from benchmarks.check_plans import TEMP_SORT
+from benchmarks.generate import START_DATE, generate_raw
+from tea_manager import TeaProductionManager
+
+# 日付範囲のレポートで使う期間（1か月分）
+RANGE_START = START_DATE + datetime.timedelta(days=365)
+RANGE_END = RANGE_START + datetime.timedelta(days=30)
+
+
+def plan_cases(lot):
+    """
+    確認する処理を (名前, 処理, 使われるべきインデックス) で返す
+
+    :param lot: 在庫の引き当てに使う生産データID
+    """
+    start, end = RANGE_START.isoformat(), RANGE_END.isoformat()
+    return [
+        ('record_shipment', lambda m: m.record_shipment(lot, 0.01, 'check_raw_plans', end),
+         'idx_inventory_production_id'),
+        ('shipment_history[date]', lambda m: m.get_shipment_history(start, end),
+         'idx_shipment_shipment_date'),
+        ('shipment_history_page[date]', lambda m: m.get_shipment_history_page(start, end),
+         'idx_shipment_shipment_date'),
+        ('quality_report[date]', lambda m: m.get_quality_report(start, end),
+         'idx_production_production_date'),
+        ('quality_report_page[date]', lambda m: m.get_quality_report_page(start, end),
+         'idx_production_production_date'),
+        ('quality_report[tea_type, date]', lambda m: m.get_quality_report(start, end, '玉露'),
+         'idx_production_tea_type_date'),
+        ('quality_report_page[tea_type, date]', lambda m: m.get_quality_report_page(start, end, '玉露'),
+         'idx_production_tea_type_date'),
+    ]
+
+
+def explain(conn, sql):
+    """
+    SQL文の実行計画を1行ずつの文字列で返す
+    """
+    return [row[-1] for row in conn.execute(f'EXPLAIN QUERY PLAN {sql}')]
+
+
+def check(manager, action, index):
+    """
+    処理を実行して発行されたSELECT・UPDATE文の実行計画を調べる
+
+    :return: (問題の一覧, [(SQL, 実行計画)])
+    """
+    conn = manager.conn
+    statements = []
+    # トレースで受け取るSQLはパラメータが展開されているため、そのまま実行計画を取る
+    conn.set_trace_callback(statements.append)
+    try:
+        action(manager)
+    finally:
+        conn.set_trace_callback(None)
+
+    plans = []
+    # トリガーが動くと同じ文が何度も通知されるため、1回ずつ調べる
+    for sql in dict.fromkeys(sql.strip() for sql in statements):
+        if not sql.upper().startswith(('SELECT', 'UPDATE')) or 'sqlite_master' in sql:
+            continue
+        plans.append((sql, explain(conn, sql)))
+
+    problems = []
+    if not any(f'INDEX {index}' in line for _, plan in plans for line in plan):
+        problems.append(f'{index} が使われていません')
+    for sql, plan in plans:
+        if any(TEMP_SORT in line for line in plan):
+            problems.append(f'並び替えに一時的なB-treeを使っています: {" ".join(sql.split())[:120]}')
+    return problems, plans
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description='tea_production.db のクエリの実行計画を確認する')
+    parser.add_argument('--scale', default='10k', help='合成データの規模')
+    parser.add_argument('--seed', type=int, default=0)
+    parser.add_argument('--verbose', action='store_true', help='すべての実行計画を表示する')
+    args = parser.parse_args(argv)
+
+    with tempfile.TemporaryDirectory() as tmp:
+        db_file = os.path.join(tmp, 'tea_production.db')
+        generate_raw(db_file, args.scale, args.seed)
+        manager = TeaProductionManager(db_file, cache_size=0)
+        manager.conn.execute('ANALYZE')
+        lot = manager.conn.execute(
+            'SELECT production_id FROM inventory WHERE quantity >= 1 ORDER BY production_id LIMIT 1').fetchone()[0]
+
+        failed = False
+        for name, action, index in plan_cases(lot):
+            problems, plans = check(manager, action, index)
+            print(f"{'NG' if problems else 'OK'} {name}")
+            for problem in problems:
+                print(f'   {problem}')
+            if problems or args.verbose:
+                for sql, plan in plans:
+                    print(f'   {" ".join(sql.split())[:160]}')
+                    for line in plan:
+                        print(f'     {line}')
+            failed = failed or bool(problems)
+        manager.pool.close_all()
+
+    if failed:
+        raise SystemExit(1)
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,138 @@
+"""
+サマリーレポート（get_summary_report）がトリガーで更新する tea_type_summary から正しい値を返し、
+全履歴からの再計算（database.SUMMARY_RECOMPUTE_QUERY）より速いことを確認する
+
+合成データを入れた tea_production.db に一括登録・出荷・品質評価の変更・茶葉の種類の変更・削除を加えたあと、
+両方の結果と実行時間を比べる。値が一致しない場合や、サマリーレポートの方が遅い場合は終了コード1で終わる
+
+    python -m benchmarks.check_summary
+    python -m benchmarks.check_summary --scale 1m --writes 5000
+"""
+import argparse
+import json
+import os
+import random
+import statistics
+import tempfile
+import time
+
+import pandas as pd
+
+from benchmarks.generate import QUALITY_GRADES, TEA_TYPES, generate_raw
+from database import SUMMARY_RECOMPUTE_QUERY, verify_summary
+from tea_manager import TeaProductionManager
+
+# 再計算の結果をサマリーレポートと同じ形にするクエリ
+RECOMPUTE_REPORT_QUERY = f'''
+    SELECT
+        tea_type,
+        total_productions,
+        total_production_quantity,
+        total_shipments,
+        total_shipment_quantity,
+        current_stock,
+        quality_a_count * 100.0 / total_productions as quality_a_percentage
+    FROM ({SUMMARY_RECOMPUTE_QUERY})
+    WHERE total_productions > 0
+    ORDER BY tea_type
+'''
+
+
+def apply_writes(manager, rng, count):
+    """
+    サマリーに影響するあらゆる種類の書き込みを count 件ずつ加える
+    """
+    conn = manager.conn
+    production_ids = manager.add_productions_bulk([
+        {'tea_type': rng.choice(TEA_TYPES), 'quantity': round(rng.uniform(10, 500), 2),
+         'production_date': '2024-04-01', 'quality_check': rng.choice(QUALITY_GRADES)}
+        for _ in range(count)
+    ])
+    manager.record_shipments_bulk([
+        {'production_id': rng.choice(production_ids), 'quantity': round(rng.uniform(0.1, 5), 2),
+         'customer_name': 'check_summary', 'shipment_date': '2024-04-02'}
+        for _ in range(count)
+    ])
+    lots = [row[0] for row in conn.execute('SELECT id FROM production ORDER BY RANDOM() LIMIT ?', (count,))]
+    for lot in lots:
+        manager.update_quality_check(lot, rng.choice(QUALITY_GRADES))
+
+    # 管理画面や同期による直接の変更（茶葉の種類の変更、出荷の修正・削除、出荷のないロットの削除）
+    with conn:
+        conn.executemany('UPDATE production SET tea_type = ?, quantity = quantity + 1 WHERE id = ?',
+                         [(rng.choice(TEA_TYPES), lot) for lot in lots[:count // 2]])
+        conn.execute('''
+            UPDATE shipment SET quantity = quantity / 2
+            WHERE id IN (SELECT id FROM shipment ORDER BY RANDOM() LIMIT ?)
+        ''', (count,))
+        conn.execute('DELETE FROM shipment WHERE id IN (SELECT id FROM shipment ORDER BY RANDOM() LIMIT ?)',
+                     (count,))
+        unshipped = [row[0] for row in conn.execute('''
+            SELECT id FROM production p
+            WHERE NOT EXISTS (SELECT 1 FROM shipment s WHERE s.production_id = p.id)
+            ORDER BY RANDOM() LIMIT ?
+        ''', (count,))]
+        conn.executemany('DELETE FROM inventory WHERE production_id = ?', [(lot,) for lot in unshipped])
+        conn.executemany('DELETE FROM production WHERE id = ?', [(lot,) for lot in unshipped])
+
+
+def measure(func, repeat):
+    """
+    実行時間の中央値（秒）を返す
+    """
+    times = []
+    for _ in range(repeat):
+        start = time.perf_counter()
+        func()
+        times.append(time.perf_counter() - start)
+    return statistics.median(times)
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description='サマリーレポートの正しさと速さを確認する')
+    parser.add_argument('--scale', default='100k', help='合成データの規模')
+    parser.add_argument('--seed', type=int, default=0)
+    parser.add_argument('--writes', type=int, default=1000, help='種類ごとに加える書き込みの件数')
+    parser.add_argument('--repeat', type=int, default=5, help='実行時間の計測の繰り返し回数')
+    parser.add_argument('--output', help='結果を書き出すJSONファイル')
+    args = parser.parse_args(argv)
+
+    with tempfile.TemporaryDirectory() as tmp:
+        db_file = os.path.join(tmp, 'tea_production.db')
+        plan = generate_raw(db_file, args.scale, args.seed)
+        manager = TeaProductionManager(db_file, cache_size=0)
+        apply_writes(manager, random.Random(args.seed), args.writes)
+
+        problems = [f'{tea_type} の {column}: {actual} != {expected}'
+                    for tea_type, column, actual, expected in verify_summary(manager.conn)]
+        report = manager.get_summary_report()
+        expected = pd.read_sql_query(RECOMPUTE_REPORT_QUERY, manager.conn)
+        try:
+            pd.testing.assert_frame_equal(report, expected, check_dtype=False, rtol=1e-9)
+        except AssertionError as e:
+            problems.append(f'サマリーレポートが再計算の結果と一致しません: {e}')
+
+        rollup_s = measure(manager.get_summary_report, args.repeat)
+        recompute_s = measure(lambda: pd.read_sql_query(RECOMPUTE_REPORT_QUERY, manager.conn), args.repeat)
+        manager.pool.close_all()
+
+    print(f'scale {args.scale}: {plan.productions} lots, {plan.shipments} shipments, {args.writes} writes each')
+    print(f'  get_summary_report  {rollup_s * 1000:>10.2f} ms')
+    print(f'  full recompute      {recompute_s * 1000:>10.2f} ms  ({recompute_s / rollup_s:.0f}x)')
+    if rollup_s > recompute_s:
+        problems.append('サマリーレポートが全履歴からの再計算より遅くなっています')
+    print(f"{'NG' if problems else 'OK'} summary")
+    for problem in problems:
+        print(f'   {problem}')
+
+    if args.output:
+        with open(args.output, 'w', encoding='utf-8') as f:
+            json.dump({'scale': args.scale, 'seed': args.seed, 'writes': args.writes,
+                       'summary_report_s': rollup_s, 'full_recompute_s': recompute_s, 'problems': problems},
+                      f, ensure_ascii=False, indent=2)
+    if problems:
+        raise SystemExit(1)
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,225 @@
+"""
+性能計測用の合成データ生成
+
+同じシードからは同じデータを生成する。生産データは出荷件数の1/10件作り、
+各ロットの生産量はそのロットへの出荷量の合計より多くなるようにする
+
+    python -m benchmarks.generate --scale 1m --db /tmp/tea_1m.db
+    python -m benchmarks.generate --scale 10k --django /tmp/django_10k.sqlite3
+"""
+import argparse
+import datetime
+import time
+from decimal import Decimal
+
+import numpy as np
+
+from database import create_connection, migrate
+
+# 規模の名前と出荷件数
+SCALES = {
+    '10k': 10_000,
+    '100k': 100_000,
+    '1m': 1_000_000,
+    '10m': 10_000_000,
+}
+
+TEA_TYPES = ['煎茶', '玉露', '抹茶', 'ほうじ茶']
+QUALITY_GRADES = ['A級', 'B級', 'C級']
+QUALITY_WEIGHTS = [0.3, 0.5, 0.2]
+CUSTOMERS = [f'顧客{i:03d}' for i in range(200)]
+
+# 生産日の範囲（この日から DAYS 日間）
+START_DATE = datetime.date(2020, 1, 1)
+DAYS = 5 * 365
+
+# 1回の書き込みで扱う行数
+BATCH_SIZE = 50_000
+
+
+def scale_rows(scale):
+    """
+    規模の名前または件数から出荷件数を求める
+
+    :param scale: '10k' などの規模の名前、または件数
+    :return: 出荷件数
+    """
+    if isinstance(scale, int):
+        return scale
+    if scale in SCALES:
+        return SCALES[scale]
+    return int(scale)
+
+
+class Plan:
+    """
+    生成するデータの内容（NumPy配列）
+    生産データと出荷データはどちらも0始まりの行番号+1をIDとする
+    """
+
+    def __init__(self, shipments: int, seed: int = 0):
+        """
+        :param shipments: 出荷件数
+        :param seed: 乱数のシード
+        """
+        rng = np.random.default_rng(seed)
+        productions = max(shipments // 10, 1)
+        self.productions = productions
+        self.shipments = shipments
+
+        self.tea_type = rng.integers(0, len(TEA_TYPES), productions)
+        self.quality = rng.choice(len(QUALITY_GRADES), productions, p=QUALITY_WEIGHTS)
+        self.production_day = np.sort(rng.integers(0, DAYS, productions))
+
+        self.lot = rng.integers(0, productions, shipments)
+        self.shipment_quantity = rng.integers(2, 41, shipments) / 2
+        self.shipment_day = self.production_day[self.lot] + rng.integers(0, 60, shipments)
+        self.customer = rng.integers(0, len(CUSTOMERS), shipments)
+
+        shipped = np.bincount(self.lot, weights=self.shipment_quantity, minlength=productions)
+        self.production_quantity = shipped + rng.integers(0, 200, productions)
+        self.stock = self.production_quantity - shipped
+
+    def production_rows(self, start: int, stop: int):
+        """
+        生産データの行を (id, 茶葉の種類, 生産日, 生産量, 品質評価) で返す
+        """
+        for i in range(start, min(stop, self.productions)):
+            yield (i + 1,
+                   TEA_TYPES[self.tea_type[i]],
+                   START_DATE + datetime.timedelta(days=int(self.production_day[i])),
+                   float(self.production_quantity[i]),
+                   QUALITY_GRADES[self.quality[i]])
+
+    def shipment_rows(self, start: int, stop: int):
+        """
+        出荷データの行を (id, 生産データID, 出荷日, 出荷量, 顧客名) で返す
+        """
+        for i in range(start, min(stop, self.shipments)):
+            yield (i + 1,
+                   int(self.lot[i]) + 1,
+                   START_DATE + datetime.timedelta(days=int(self.shipment_day[i])),
+                   float(self.shipment_quantity[i]),
+                   CUSTOMERS[self.customer[i]])
+
+
+def generate_raw(db_file: str, scale, seed: int = 0):
+    """
+    database.py のスキーマに合成データを書き込む
+
+    :param db_file: データベースファイルのパス（空のファイルであること）
+    :param scale: 規模の名前または出荷件数
+    :param seed: 乱数のシード
+    :return: Plan
+    """
+    plan = Plan(scale_rows(scale), seed)
+    conn = create_connection(db_file)
+    migrate(conn)
+    try:
+        conn.execute('BEGIN IMMEDIATE')
+        for start in range(0, plan.productions, BATCH_SIZE):
+            rows = [(i, t, d.isoformat(), q, g) for i, t, d, q, g in plan.production_rows(start, start + BATCH_SIZE)]
+            conn.executemany('''
+                INSERT INTO production (id, tea_type, production_date, quantity, quality_check)
+                VALUES (?, ?, ?, ?, ?)
+            ''', rows)
+            # 在庫は出荷分を差し引いた値で作る
+            conn.executemany('INSERT INTO inventory (production_id, quantity) VALUES (?, ?)',
+                             [(row[0], float(plan.stock[row[0] - 1])) for row in rows])
+        for start in range(0, plan.shipments, BATCH_SIZE):
+            rows = [(i, p, d.isoformat(), q, c) for i, p, d, q, c in plan.shipment_rows(start, start + BATCH_SIZE)]
+            conn.executemany('''
+                INSERT INTO shipment (id, production_id, shipment_date, quantity, customer_name)
+                VALUES (?, ?, ?, ?, ?)
+            ''', rows)
+        conn.commit()
+    finally:
+        conn.close()
+    return plan
+
+
+def generate_django(scale, seed: int = 0):
+    """
+    Djangoのモデル（tea_production.models）に合成データを書き込む
+    呼び出し前に django.setup() とマイグレーションを済ませておくこと
+
+    :param scale: 規模の名前または出荷件数
+    :param seed: 乱数のシード
+    :return: Plan
+    """
+    from django.db import transaction
+    from tea_production.changes import capture_changes
+    from tea_production.ledger import production_movements, record_movements, shipment_movements
+    from tea_production.models import Inventory, Production, Shipment
+
+    plan = Plan(scale_rows(scale), seed)
+    with transaction.atomic():
+        for start in range(0, plan.productions, BATCH_SIZE):
+            rows = list(plan.production_rows(start, start + BATCH_SIZE))
+            productions = Production.objects.bulk_create([
+                Production(id=i, tea_type=t, production_date=d, quantity=Decimal(str(q)), quality_check=g)
+                for i, t, d, q, g in rows
+            ], batch_size=BATCH_SIZE)
+            record_movements(production_movements(productions), batch_size=BATCH_SIZE)
+            Inventory.objects.bulk_create([
+                Inventory(production_id=i, quantity=Decimal(str(float(plan.stock[i - 1]))))
+                for i, *_ in rows
+            ], batch_size=BATCH_SIZE)
+            capture_changes('production', [i for i, *_ in rows], 'insert')
+            capture_changes('inventory', [i for i, *_ in rows], 'insert')
+        for start in range(0, plan.shipments, BATCH_SIZE):
+            shipments = Shipment.objects.bulk_create([
+                Shipment(id=i, production_id=p, shipment_date=d, quantity=Decimal(str(q)), customer_name=c)
+                for i, p, d, q, c in plan.shipment_rows(start, start + BATCH_SIZE)
+            ], batch_size=BATCH_SIZE)
+            record_movements(shipment_movements(shipments), batch_size=BATCH_SIZE)
+            capture_changes('shipment', [shipment.pk for shipment in shipments], 'insert')
+    return plan
+
+
+def setup_django(db_file: str):
+    """
+    指定したSQLiteファイルを既定のデータベースとしてDjangoを初期化し、マイグレーションを適用する
+
+    :param db_file: Django用のデータベースファイルのパス
+    """
+    import os
+
+    import django
+    from django.conf import settings
+    from django.core.management import call_command
+
+    os.environ.setdefault('DJANGO_SETTINGS_MODULE', 'config.settings')
+    # 接続は最初のクエリまで作られないため、setup前にファイル名を差し替えられる
+    settings.DATABASES['default']['NAME'] = db_file
+    # 以前の計測のキャッシュが残らないよう、プロセス内のキャッシュを使う
+    settings.CACHES = {'default': {'BACKEND': 'django.core.cache.backends.locmem.LocMemCache'}}
+    django.setup()
+    call_command('migrate', verbosity=0)
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description='性能計測用の合成データを生成する')
+    parser.add_argument('--scale', default='10k', help=f"規模（{', '.join(SCALES)} または出荷件数）")
+    parser.add_argument('--seed', type=int, default=0)
+    parser.add_argument('--db', help='database.py のスキーマで書き込むSQLiteファイル')
+    parser.add_argument('--django', help='Djangoのモデルで書き込むSQLiteファイル')
+    args = parser.parse_args(argv)
+
+    if not args.db and not args.django:
+        parser.error('--db または --django を指定してください')
+    if args.db:
+        start = time.perf_counter()
+        plan = generate_raw(args.db, args.scale, args.seed)
+        print(f"{args.db}: 生産 {plan.productions} 件、出荷 {plan.shipments} 件 "
+              f"({time.perf_counter() - start:.1f}秒)")
+    if args.django:
+        setup_django(args.django)
+        start = time.perf_counter()
+        plan = generate_django(args.scale, args.seed)
+        print(f"{args.django}: 生産 {plan.productions} 件、出荷 {plan.shipments} 件 "
+              f"({time.perf_counter() - start:.1f}秒)")
+
+
+if __name__ == '__main__':
+    main()
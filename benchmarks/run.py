@@ -0,0 +1,270 @@
+"""
+TeaProductionManager の各メソッドと tea_production.views の各ビューの実行時間を計測する
+
+規模ごとに合成データを生成し（benchmarks.generate）、結果をJSONで書き出す
+--compare で以前の結果と比較し、遅くなった項目を表示する
+
+    python -m benchmarks.run --scales 10k 1m --output bench.json
+    python -m benchmarks.run --scales 10k --targets views --compare bench.json
+"""
+import argparse
+import datetime
+import json
+import os
+import platform
+import statistics
+import subprocess
+import sys
+import tempfile
+import time
+
+from benchmarks.generate import SCALES, generate_django, generate_raw, scale_rows, setup_django
+
+
+def measure(func, repeat: int = 5):
+    """
+    関数の実行時間を計測する
+
+    :param func: 計測する関数
+    :param repeat: 繰り返し回数
+    :return: 最小・中央値・平均の秒数の辞書
+    """
+    times = []
+    for _ in range(repeat):
+        start = time.perf_counter()
+        func()
+        times.append(time.perf_counter() - start)
+    return {
+        'repeat': repeat,
+        'min_s': min(times),
+        'median_s': statistics.median(times),
+        'mean_s': statistics.fmean(times),
+    }
+
+
+def manager_cases(manager, plan, tmp):
+    """
+    TeaProductionManager の計測項目を (名前, 関数) で返す
+    """
+    counter = iter(range(10 ** 9))
+    lot = plan.productions // 2
+
+    def bulk_productions():
+        manager.add_productions_bulk([
+            {'tea_type': '煎茶', 'quantity': 100.0, 'production_date': '2024-04-01', 'quality_check': 'A級'}
+        ] * 1000)
+
+    def bulk_shipments():
+        manager.record_shipments_bulk([
+            {'production_id': lot + i % 100, 'quantity': 0.01, 'customer_name': '顧客000'}
+            for i in range(1000)
+        ])
+
+    return [
+        ('add_production', lambda: manager.add_production('煎茶', 100.0, '2024-04-01', 'A級')),
+        ('record_shipment', lambda: manager.record_shipment(lot, 0.01, '顧客000', '2024-04-02')),
+        ('allocate_shipment', lambda: manager.allocate_shipment('煎茶', 'A級', 50.0, '顧客000', '2024-04-02')),
+        ('add_productions_bulk[1000]', bulk_productions),
+        ('record_shipments_bulk[1000]', bulk_shipments),
+        ('update_quality_check', lambda: manager.update_quality_check(lot, 'B級', 'benchmark')),
+        ('get_inventory_report', manager.get_inventory_report),
+        ('get_shipment_history', manager.get_shipment_history),
+        ('get_shipment_history[1month]',
+         lambda: manager.get_shipment_history('2022-01-01', '2022-01-31')),
+        ('get_shipment_history_page', lambda: manager.get_shipment_history_page(page_size=100)),
+        ('get_quality_report', manager.get_quality_report),
+        ('get_quality_report[1month]',
+         lambda: manager.get_quality_report('2022-01-01', '2022-01-31')),
+        ('get_quality_report_page', lambda: manager.get_quality_report_page(page_size=100)),
+        ('get_summary_report', manager.get_summary_report),
+        ('export_data', lambda: manager.export_data(os.path.join(tmp, f'export_{next(counter)}'))),
+    ]
+
+
+def run_manager(scale, repeat, tmp, seed, only=None):
+    """
+    TeaProductionManager の各メソッドを計測する
+    """
+    from tea_manager import TeaProductionManager
+
+    db_file = os.path.join(tmp, f'raw_{scale}.db')
+    plan = generate_raw(db_file, scale, seed)
+    # キャッシュを無効にしてクエリ自体の時間を計測する
+    manager = TeaProductionManager(db_file, cache_size=0)
+    results = []
+    for name, func in manager_cases(manager, plan, tmp):
+        if only and name not in only:
+            continue
+        results.append({'target': 'manager', 'name': name, 'scale': scale, **measure(func, repeat)})
+        print(f"  manager {name:<32} {results[-1]['median_s'] * 1000:>10.2f} ms")
+    return results
+
+
+def view_cases(plan):
+    """
+    tea_production.views の計測項目を (名前, HTTPメソッド, URL名, POSTデータ) で返す
+    """
+    lot = plan.productions // 2
+    return [
+        ('index', 'get', 'tea_production:index', None),
+        ('production_list', 'get', 'tea_production:production_list', None),
+        ('production_create[GET]', 'get', 'tea_production:production_create', None),
+        ('production_create[POST]', 'post', 'tea_production:production_create', {
+            'tea_type': '煎茶', 'production_date': '2024-04-01', 'quantity': '100',
+            'quality_check': 'A級', 'quality_notes': '',
+        }),
+        ('shipment_list', 'get', 'tea_production:shipment_list', None),
+        ('shipment_create[GET]', 'get', 'tea_production:shipment_create', None),
+        ('shipment_create[POST]', 'post', 'tea_production:shipment_create', {
+            'production': lot, 'shipment_date': '2024-04-02', 'quantity': '0.01',
+            'customer_name': '顧客000', 'customer_contact': '',
+        }),
+        ('shipment_allocate[POST]', 'post', 'tea_production:shipment_allocate', {
+            'tea_type': '煎茶', 'quality_check': 'A級', 'quantity': '50', 'shipment_date': '2024-04-02',
+            'customer_name': '顧客000', 'customer_contact': '',
+        }),
+        ('inventory_list', 'get', 'tea_production:inventory_list', None),
+        ('production_lookup', 'get', 'tea_production:production_lookup', {
+            'tea_type': '煎茶', 'quality_check': 'A級',
+        }),
+        ('shipment_export[csv]', 'get', 'tea_production:shipment_export', {'format': 'csv'}),
+        ('shipment_export[json]', 'get', 'tea_production:shipment_export', {'format': 'json'}),
+        ('production_export[csv,1month]', 'get', 'tea_production:production_export', {
+            'format': 'csv', 'start_date': '2022-01-01', 'end_date': '2022-01-31',
+        }),
+        ('inventory_api', 'get', 'tea_production:inventory_api', None),
+        ('production_summary_api', 'get', 'tea_production:production_summary_api', None),
+        ('shipment_history_api', 'get', 'tea_production:shipment_history_api', None),
+    ]
+
+
+def run_views(scale, repeat, tmp, seed, only=None):
+    """
+    tea_production.views の各ビューを計測する
+    Djangoは1プロセスで1回しか初期化できないため、規模ごとに子プロセスで実行する
+    """
+    output = os.path.join(tmp, f'views_{scale}.json')
+    subprocess.run(
+        [sys.executable, '-m', 'benchmarks.run', '--_views-child', str(scale),
+         '--repeat', str(repeat), '--seed', str(seed), '--output', output, '--tmp', tmp]
+        + (['--only', *only] if only else []),
+        check=True,
+    )
+    with open(output, encoding='utf-8') as f:
+        return json.load(f)
+
+
+def _run_views_child(scale, repeat, tmp, seed, only=None):
+    """
+    子プロセス側でDjangoを初期化し、ビューを計測する
+    """
+    setup_django(os.path.join(tmp, f'django_{scale}.sqlite3'))
+
+    from django.test import Client
+    from django.test.utils import setup_test_environment
+    from django.urls import reverse
+
+    setup_test_environment()
+    plan = generate_django(scale, seed)
+    client = Client()
+    results = []
+    for name, method, url_name, data in view_cases(plan):
+        if only and name not in only:
+            continue
+        url = reverse(url_name)
+
+        def request():
+            response = getattr(client, method)(url, data) if data else getattr(client, method)(url)
+            if response.status_code >= 400:
+                raise RuntimeError(f"{name}: HTTP {response.status_code}")
+            # ストリーミングレスポンスも最後まで読み出して計測する
+            if response.streaming:
+                for _ in response.streaming_content:
+                    pass
+
+        results.append({'target': 'view', 'name': name, 'scale': scale, **measure(request, repeat)})
+        print(f"  view    {name:<32} {results[-1]['median_s'] * 1000:>10.2f} ms")
+    return results
+
+
+def _git_commit():
+    try:
+        return subprocess.run(['git', 'rev-parse', '--short', 'HEAD'], capture_output=True,
+                              text=True, check=True).stdout.strip()
+    except (OSError, subprocess.CalledProcessError):
+        return None
+
+
+def compare(results, baseline_file, threshold: float = 1.2):
+    """
+    以前の結果と比較し、中央値が threshold 倍以上になった項目を返す
+
+    :param results: 今回の計測結果のリスト
+    :param baseline_file: 以前の結果のJSONファイル
+    :param threshold: 遅くなったとみなす比率
+    :return: (項目, 以前の中央値, 今回の中央値, 比率) のリスト
+    """
+    with open(baseline_file, encoding='utf-8') as f:
+        baseline = {(r['target'], r['name'], str(r['scale'])): r for r in json.load(f)['results']}
+    regressions = []
+    for r in results:
+        before = baseline.get((r['target'], r['name'], str(r['scale'])))
+        if before and before['median_s'] > 0:
+            ratio = r['median_s'] / before['median_s']
+            if ratio >= threshold:
+                regressions.append((f"{r['target']}:{r['name']}@{r['scale']}",
+                                    before['median_s'], r['median_s'], ratio))
+    return regressions
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description='茶生産管理システムの性能計測')
+    parser.add_argument('--scales', nargs='+', default=['10k'],
+                        help=f"計測する規模（{', '.join(SCALES)} または出荷件数）")
+    parser.add_argument('--targets', nargs='+', choices=['manager', 'views'], default=['manager', 'views'])
+    parser.add_argument('--only', nargs='+', help='計測する項目名（省略時はすべて）')
+    parser.add_argument('--repeat', type=int, default=5)
+    parser.add_argument('--seed', type=int, default=0)
+    parser.add_argument('--output', help='結果を書き出すJSONファイル')
+    parser.add_argument('--compare', help='比較する以前の結果のJSONファイル')
+    parser.add_argument('--tmp', help=argparse.SUPPRESS)
+    parser.add_argument('--_views-child', dest='views_child', help=argparse.SUPPRESS)
+    args = parser.parse_args(argv)
+
+    if args.views_child:
+        results = _run_views_child(args.views_child, args.repeat, args.tmp, args.seed, args.only)
+        with open(args.output, 'w', encoding='utf-8') as f:
+            json.dump(results, f)
+        return
+
+    results = []
+    with tempfile.TemporaryDirectory() as tmp:
+        for scale in args.scales:
+            print(f"scale {scale} ({scale_rows(scale)} shipments)")
+            if 'manager' in args.targets:
+                results.extend(run_manager(scale, args.repeat, tmp, args.seed, args.only))
+            if 'views' in args.targets:
+                results.extend(run_views(scale, args.repeat, tmp, args.seed, args.only))
+
+    report = {
+        'commit': _git_commit(),
+        'timestamp': datetime.datetime.now().isoformat(timespec='seconds'),
+        'python': platform.python_version(),
+        'platform': platform.platform(),
+        'seed': args.seed,
+        'results': results,
+    }
+    if args.output:
+        with open(args.output, 'w', encoding='utf-8') as f:
+            json.dump(report, f, ensure_ascii=False, indent=2)
+    if args.compare:
+        regressions = compare(results, args.compare)
+        for name, before, after, ratio in regressions:
+            print(f"遅くなった項目: {name} {before * 1000:.2f} ms -> {after * 1000:.2f} ms ({ratio:.2f}倍)")
+        if regressions:
+            raise SystemExit(1)
+    return report
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,259 @@
+"""
+database.py のスキーマの変更の記録（change_log）の読み出しと、同期での書き込み
+
+change_log には変更された行のテーブル名と行のID（在庫は生産データID）だけをトリガーが記録し、
+同期では記録された行の同期の時点の値を読んで相手のデータベースに反映する
+同じ行が何度変更されても反映は1回で済み、行が見つからなければ削除されたものとして扱う
+
+Djangoのデータベースとの同期（tea_production.sync）から使う
+"""
+from contextlib import contextmanager
+
+# 同期するテーブル（生産データを参照する在庫・出荷より先に反映する）
+TABLES = ('production', 'inventory', 'shipment')
+
+# 行を識別する列（在庫は生産データと1対1なので生産データIDで識別する）
+KEY_COLUMNS = {
+    'production': 'id',
+    'inventory': 'production_id',
+    'shipment': 'id',
+}
+
+# 同期する列（Djangoのモデルのフィールド名と同じ）
+COLUMNS = {
+    'production': ('tea_type', 'production_date', 'quantity', 'quality_check', 'quality_notes', 'created_at'),
+    'inventory': ('production_id', 'quantity'),
+    'shipment': ('production_id', 'shipment_date', 'quantity', 'customer_name', 'customer_contact', 'created_at'),
+}
+
+# 1回のIN句に含めるIDの数
+MAX_IDS = 500
+
+# 在庫量の正しい値（生産量から出荷量の合計を引いた値）
+EXPECTED_STOCK = '''
+    ROUND((SELECT p.quantity FROM production p WHERE p.id = inventory.production_id)
+          - (SELECT COALESCE(SUM(s.quantity), 0) FROM shipment s WHERE s.production_id = inventory.production_id), 2)
+'''
+
+
+def chunked(values, size=MAX_IDS):
+    """
+    IDを昇順に並べ、IN句に含められる数ずつに分ける
+    """
+    values = sorted(values)
+    for start in range(0, len(values), size):
+        yield values[start:start + size]
+
+
+def read_changes(conn, after: int, limit: int):
+    """
+    after より後の変更を記録順に読む
+
+    :param conn: データベース接続オブジェクト
+    :param after: 反映済みの最後の記録番号
+    :param limit: 読む件数
+    :return: [(記録番号, テーブル名, 行のID)]
+    """
+    return conn.execute('''
+        SELECT seq, table_name, row_id FROM change_log
+        WHERE seq > ?
+        ORDER BY seq
+        LIMIT ?
+    ''', (after, limit)).fetchall()
+
+
+def read_rows(conn, table: str, keys):
+    """
+    行の現在の値を読む
+
+    :param conn: データベース接続オブジェクト
+    :param table: テーブル名
+    :param keys: 行のID（在庫は生産データID）
+    :return: {行のID: {列名: 値}}（見つからない行は含まない）
+    """
+    key_column, columns = KEY_COLUMNS[table], COLUMNS[table]
+    rows = {}
+    for chunk in chunked(keys):
+        placeholders = ', '.join('?' * len(chunk))
+        cursor = conn.execute(
+            f"SELECT {key_column}, {', '.join(columns)} FROM {table} WHERE {key_column} IN ({placeholders})", chunk)
+        for key, *values in cursor:
+            rows[key] = dict(zip(columns, values))
+    return rows
+
+
+def read_id_map(conn, table: str, column: str, ids):
+    """
+    同期で作成した行のIDの対応を読む
+
+    :param conn: データベース接続オブジェクト
+    :param table: テーブル名
+    :param column: ids の種類（raw_id または django_id）
+    :param ids: 行のID
+    :return: [(raw_id, django_id)]
+    """
+    pairs = []
+    for chunk in chunked(ids):
+        placeholders = ', '.join('?' * len(chunk))
+        pairs.extend(conn.execute(
+            f'SELECT raw_id, django_id FROM sync_id_map WHERE table_name = ? AND {column} IN ({placeholders})',
+            [table, *chunk]).fetchall())
+    return pairs
+
+
+def forget_ids(conn, table: str, column: str, ids):
+    """
+    同期で作成した行のIDの対応を削除する（作成した行が相手のデータベースで削除され、作り直すとき）
+
+    :param conn: データベース接続オブジェクト
+    :param table: テーブル名
+    :param column: ids の種類（raw_id または django_id）
+    :param ids: 行のID
+    """
+    for chunk in chunked(ids):
+        placeholders = ', '.join('?' * len(chunk))
+        conn.execute(f'DELETE FROM sync_id_map WHERE table_name = ? AND {column} IN ({placeholders})',
+                     [table, *chunk])
+
+
+def read_shipment_ids(conn, production_ids):
+    """
+    ロットの出荷データのIDを読む
+
+    :param conn: データベース接続オブジェクト
+    :param production_ids: 生産データID
+    :return: 出荷データIDのセット
+    """
+    ids = set()
+    for chunk in chunked(production_ids):
+        placeholders = ', '.join('?' * len(chunk))
+        ids.update(row[0] for row in conn.execute(
+            f'SELECT id FROM shipment WHERE production_id IN ({placeholders})', chunk))
+    return ids
+
+
+def get_sync_position(conn, source: str):
+    """
+    相手のデータベースの変更をどこまで反映したかを読む
+
+    :param conn: データベース接続オブジェクト
+    :param source: 相手のデータベースの名前
+    :return: 反映済みの最後の記録番号（未同期なら0）
+    """
+    row = conn.execute('SELECT last_seq FROM sync_state WHERE source = ?', (source,)).fetchone()
+    return row[0] if row else 0
+
+
+@contextmanager
+def applying(conn):
+    """
+    相手のデータベースの変更を反映するトランザクション
+    反映する間は変更を記録しない（記録すると次の同期で相手に送り返すため）
+
+    :param conn: データベース接続オブジェクト
+    """
+    if not conn.in_transaction:
+        conn.execute('BEGIN IMMEDIATE')
+    try:
+        conn.execute('UPDATE change_capture SET paused = 1 WHERE id = 1')
+        yield conn
+        conn.execute('UPDATE change_capture SET paused = 0 WHERE id = 1')
+        conn.commit()
+    except Exception:
+        conn.rollback()
+        raise
+
+
+def insert_row(conn, table: str, values, source_id: int = None):
+    """
+    行を追加する（applying の中で呼ぶ）
+
+    :param conn: データベース接続オブジェクト
+    :param table: テーブル名
+    :param values: {列名: 値}
+    :param source_id: 元になったDjangoの行のID（在庫以外は対応を記録する）
+    :return: 追加した行のID（在庫は生産データID）
+    """
+    columns = list(values)
+    cursor = conn.execute(
+        f"INSERT INTO {table} ({', '.join(columns)}) VALUES ({', '.join('?' * len(columns))})",
+        [values[column] for column in columns])
+    if KEY_COLUMNS[table] != 'id':
+        return values[KEY_COLUMNS[table]]
+    if source_id is not None:
+        conn.execute('INSERT INTO sync_id_map (table_name, raw_id, django_id) VALUES (?, ?, ?)',
+                     (table, cursor.lastrowid, source_id))
+    return cursor.lastrowid
+
+
+def update_row(conn, table: str, key: int, values):
+    """
+    行を更新する（applying の中で呼ぶ）
+
+    :param conn: データベース接続オブジェクト
+    :param table: テーブル名
+    :param key: 行のID（在庫は生産データID）
+    :param values: {列名: 値}
+    """
+    assignments = [f'{column} = ?' for column in values]
+    if table == 'inventory':
+        assignments.append('last_updated = CURRENT_TIMESTAMP')
+    conn.execute(f"UPDATE {table} SET {', '.join(assignments)} WHERE {KEY_COLUMNS[table]} = ?",
+                 [*values.values(), key])
+
+
+def recompute_inventory(conn, production_ids):
+    """
+    ロットの在庫量を、生産量から出荷量の合計を引いた値に更新する（applying の中で呼ぶ）
+    同期では在庫量を相手からコピーせず、反映した生産・出荷データから求め直す
+    （双方で同じロットから出荷された場合に、一方の引き当てが上書きされて売り越さないように）
+
+    :param conn: データベース接続オブジェクト
+    :param production_ids: 生産データID
+    """
+    for chunk in chunked(production_ids):
+        conn.execute(f'''
+            UPDATE inventory
+            SET quantity = {EXPECTED_STOCK}, last_updated = CURRENT_TIMESTAMP
+            WHERE production_id IN ({', '.join('?' * len(chunk))})
+              AND ABS(quantity - {EXPECTED_STOCK}) >= 0.005
+        ''', chunk)
+
+
+def delete_rows(conn, table: str, keys):
+    """
+    行を削除する（applying の中で呼ぶ）
+
+    :param conn: データベース接続オブジェクト
+    :param table: テーブル名
+    :param keys: 行のID（在庫は生産データID）
+    """
+    for chunk in chunked(keys):
+        conn.execute(f"DELETE FROM {table} WHERE {KEY_COLUMNS[table]} IN ({', '.join('?' * len(chunk))})", chunk)
+
+
+def set_sync_position(conn, source: str, last_seq: int):
+    """
+    相手のデータベースの変更をどこまで反映したかを記録する（applying の中で呼び、反映と同時にコミットする）
+
+    :param conn: データベース接続オブジェクト
+    :param source: 相手のデータベースの名前
+    :param last_seq: 反映した最後の記録番号
+    """
+    conn.execute('''
+        INSERT INTO sync_state (source, last_seq, synced_at) VALUES (?, ?, CURRENT_TIMESTAMP)
+        ON CONFLICT (source) DO UPDATE SET last_seq = excluded.last_seq, synced_at = excluded.synced_at
+    ''', (source, last_seq))
+
+
+def prune_changes(conn, upto: int):
+    """
+    相手のデータベースに反映済みの変更の記録を削除する
+
+    :param conn: データベース接続オブジェクト
+    :param upto: 反映済みの最後の記録番号
+    :return: 削除した件数
+    """
+    cursor = conn.execute('DELETE FROM change_log WHERE seq <= ?', (upto,))
+    conn.commit()
+    return cursor.rowcount
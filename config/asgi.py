@@ -2,5 +2,7 @@ import os
 from django.core.asgi import get_asgi_application
 
 os.environ.setdefault('DJANGO_SETTINGS_MODULE', 'config.settings')
+# ASGIでは参照系のビューを非同期版にする（設定 TEA_ASYNC_VIEWS）
+os.environ.setdefault('TEA_ASYNC_VIEWS', '1')
 
 application = get_asgi_application() 
\ No newline at end of file
@@ -26,6 +26,8 @@ INSTALLED_APPS = [
 ]
 
 MIDDLEWARE = [
+    # 設定 TEA_PERF_ENABLED が無効な場合は読み込まれない
+    'tea_production.middleware.PerfStatsMiddleware',
     'django.middleware.security.SecurityMiddleware',
     'django.contrib.sessions.middleware.SessionMiddleware',
     'django.middleware.common.CommonMiddleware',
@@ -63,6 +65,38 @@ DATABASES = {
     }
 }
 
+# Cache
+# 複数のワーカープロセスで無効化を共有できるよう、ファイルベースのキャッシュを使う
+CACHES = {
+    'default': {
+        'BACKEND': 'django.core.cache.backends.filebased.FileBasedCache',
+        'LOCATION': BASE_DIR / 'cache',
+        'TIMEOUT': 300,
+    }
+}
+
+# ダッシュボードのサマリーをキャッシュする秒数（更新時はシグナルで無効化される）
+DASHBOARD_CACHE_TIMEOUT = 300
+
+# 一覧画面の1ページの表示件数（?page_size= で変更でき、上限は TEA_LIST_MAX_PAGE_SIZE）
+TEA_LIST_PAGE_SIZE = 50
+TEA_LIST_MAX_PAGE_SIZE = 500
+
+# 参照系のビューを非同期版（tea_production.async_views）にするかどうか
+# config/asgi.py から起動した場合は既定で有効になる（環境変数 TEA_ASYNC_VIEWS=0 で無効にできる）
+TEA_ASYNC_VIEWS = os.environ.get('TEA_ASYNC_VIEWS', '0') == '1'
+
+# ビューごとの応答時間とSQLを計測する（tea_production.middleware.PerfStatsMiddleware）
+# 集計はプロセスごとに TEA_PERF_STATS_DIR に書き出され、manage.py perfstats で表示する
+TEA_PERF_ENABLED = os.environ.get('TEA_PERF_ENABLED', '0') == '1'
+TEA_PERF_STATS_DIR = BASE_DIR / 'perfstats'
+# 集計をファイルに書き出す間隔（秒）
+TEA_PERF_FLUSH_INTERVAL = 10
+# 1リクエストで同じ形のSQLをこの回数以上実行したら N+1 の疑いとして数える
+TEA_PERF_N_PLUS_ONE_THRESHOLD = 5
+# 応答ごとの計測結果を Server-Timing ヘッダーで返す
+TEA_PERF_SERVER_TIMING = False
+
 # Password validation
 AUTH_PASSWORD_VALIDATORS = [
     {
@@ -1,28 +1,611 @@
+import os
 import sqlite3
+import threading
 from sqlite3 import Error
 
-def create_connection():
+# 既定のデータベースファイル（カレントディレクトリに依存しないよう絶対パスにする）
+DEFAULT_DB_PATH = os.path.join(os.path.dirname(os.path.abspath(__file__)), 'tea_production.db')
+
+# 接続ごとに適用するPRAGMA
+PRAGMAS = {
+    'journal_mode': 'WAL',       # 読み取りと書き込みを並行させる
+    'synchronous': 'NORMAL',     # WALではコミットごとのfsyncを省略しても安全
+    'cache_size': -64000,        # ページキャッシュ 約64MB（負の値はKiB単位）
+    'mmap_size': 268435456,      # 256MBまでメモリマップドI/Oを使う
+    'busy_timeout': 5000,        # ロック待ちのミリ秒数
+    'temp_store': 'MEMORY',
+}
+
+def apply_pragmas(conn, pragmas=None):
+    """
+    接続にPRAGMAを適用する
+
+    :param conn: データベース接続オブジェクト
+    :param pragmas: 適用するPRAGMAの辞書（省略時はPRAGMAS）
+    """
+    for name, value in (PRAGMAS if pragmas is None else pragmas).items():
+        conn.execute(f'PRAGMA {name} = {value}')
+
+def create_connection(db_file: str = None, tuned: bool = True, check_same_thread: bool = True):
     """
     SQLiteデータベースへの接続を作成する
+    :param db_file: データベースファイルのパス（省略時はDEFAULT_DB_PATH）
+    :param tuned: PRAGMAS を適用するかどうか
+    :param check_same_thread: 作成したスレッド以外からの利用を禁止するかどうか
     :return: Connection オブジェクト
     """
     try:
-        conn = sqlite3.connect('tea_production.db')
+        conn = sqlite3.connect(db_file or DEFAULT_DB_PATH, timeout=PRAGMAS['busy_timeout'] / 1000,
+                               check_same_thread=check_same_thread)
+        if tuned:
+            apply_pragmas(conn)
         return conn
     except Error as e:
         print(f"データベース接続エラー: {e}")
         return None
 
-def create_tables(conn):
+class ConnectionPool:
     """
-    必要なテーブルを作成する
-    :param conn: データベース接続オブジェクト
+    スレッドごとに1つの接続を保持する接続プール
+    同じデータベースファイルを複数のワーカーで共有するために使う
     """
-    try:
-        cursor = conn.cursor()
-        
+
+    def __init__(self, db_file: str = None, tuned: bool = True):
+        """
+        :param db_file: データベースファイルのパス（省略時はDEFAULT_DB_PATH）
+        :param tuned: PRAGMAS を適用するかどうか
+        """
+        self.db_file = db_file or DEFAULT_DB_PATH
+        self.tuned = tuned
+        self._local = threading.local()
+        self._connections = []
+        self._lock = threading.Lock()
+
+    def get_connection(self):
+        """
+        現在のスレッドの接続を取得する（なければ作成する）
+
+        :return: Connection オブジェクト
+        """
+        conn = getattr(self._local, 'conn', None)
+        if conn is None:
+            # close_all()は別スレッドから呼ばれるため、スレッドチェックは無効にする
+            conn = create_connection(self.db_file, tuned=self.tuned, check_same_thread=False)
+            if conn is None:
+                raise Error(f"データベースに接続できません: {self.db_file}")
+            self._local.conn = conn
+            with self._lock:
+                self._connections.append(conn)
+        return conn
+
+    def close_connection(self):
+        """
+        現在のスレッドの接続を閉じる
+        """
+        conn = getattr(self._local, 'conn', None)
+        if conn is not None:
+            self._local.conn = None
+            with self._lock:
+                self._connections.remove(conn)
+            conn.close()
+
+    def close_all(self):
+        """
+        プール内のすべての接続を閉じる
+        """
+        with self._lock:
+            connections, self._connections = self._connections, []
+        for conn in connections:
+            conn.close()
+        self._local = threading.local()
+
+# 茶葉の種類ごとのサマリーを全履歴から再計算するクエリ
+# 出荷は生産データ単位で先に集計し、在庫は生産データと1対1なので、結合しても行が増えない
+SUMMARY_RECOMPUTE_QUERY = '''
+    WITH shipment_totals AS (
+        SELECT
+            production_id,
+            COUNT(*) as shipment_count,
+            SUM(quantity) as shipment_quantity
+        FROM shipment
+        GROUP BY production_id
+    )
+    SELECT
+        p.tea_type,
+        COUNT(*) as total_productions,
+        SUM(p.quantity) as total_production_quantity,
+        COALESCE(SUM(st.shipment_count), 0) as total_shipments,
+        COALESCE(SUM(st.shipment_quantity), 0) as total_shipment_quantity,
+        COALESCE(SUM(i.quantity), 0) as current_stock,
+        SUM(CASE WHEN p.quality_check = 'A級' THEN 1 ELSE 0 END) as quality_a_count
+    FROM production p
+    LEFT JOIN shipment_totals st ON st.production_id = p.id
+    LEFT JOIN inventory i ON i.production_id = p.id
+    GROUP BY p.tea_type
+'''
+
+SUMMARY_COLUMNS = (
+    'total_productions', 'total_production_quantity', 'total_shipments',
+    'total_shipment_quantity', 'current_stock', 'quality_a_count',
+)
+
+# tea_type_summary を全履歴から作り直すSQL
+REBUILD_SUMMARY_SQL = [
+    'DELETE FROM tea_type_summary',
+    f'''
+        INSERT INTO tea_type_summary (tea_type, {', '.join(SUMMARY_COLUMNS)})
+        SELECT tea_type, {', '.join(SUMMARY_COLUMNS)}
+        FROM ({SUMMARY_RECOMPUTE_QUERY})
+    ''',
+]
+
+# 茶葉の種類ごとのサマリー（ロールアップ）テーブルと、それを書き込みと同じトランザクションで更新するトリガー
+SUMMARY_ROLLUP_SQL = [
+    '''
+        CREATE TABLE IF NOT EXISTS tea_type_summary (
+            tea_type TEXT PRIMARY KEY,
+            total_productions INTEGER NOT NULL DEFAULT 0,
+            total_production_quantity REAL NOT NULL DEFAULT 0,
+            total_shipments INTEGER NOT NULL DEFAULT 0,
+            total_shipment_quantity REAL NOT NULL DEFAULT 0,
+            current_stock REAL NOT NULL DEFAULT 0,
+            quality_a_count INTEGER NOT NULL DEFAULT 0
+        )
+    ''',
+    # 生産データ
+    '''
+        CREATE TRIGGER IF NOT EXISTS trg_summary_production_insert
+        AFTER INSERT ON production
+        BEGIN
+            INSERT INTO tea_type_summary (tea_type, total_productions, total_production_quantity, quality_a_count)
+            VALUES (NEW.tea_type, 1, NEW.quantity, IFNULL(NEW.quality_check = 'A級', 0))
+            ON CONFLICT (tea_type) DO UPDATE SET
+                total_productions = total_productions + 1,
+                total_production_quantity = total_production_quantity + excluded.total_production_quantity,
+                quality_a_count = quality_a_count + excluded.quality_a_count;
+        END
+    ''',
+    '''
+        CREATE TRIGGER IF NOT EXISTS trg_summary_production_delete
+        AFTER DELETE ON production
+        BEGIN
+            UPDATE tea_type_summary SET
+                total_productions = total_productions - 1,
+                total_production_quantity = total_production_quantity - OLD.quantity,
+                quality_a_count = quality_a_count - IFNULL(OLD.quality_check = 'A級', 0)
+            WHERE tea_type = OLD.tea_type;
+        END
+    ''',
+    # 茶葉の種類が変わった場合は、そのロットの出荷と在庫も新しい種類に移す
+    '''
+        CREATE TRIGGER IF NOT EXISTS trg_summary_production_update
+        AFTER UPDATE OF tea_type, quantity, quality_check ON production
+        BEGIN
+            UPDATE tea_type_summary SET
+                total_productions = total_productions - 1,
+                total_production_quantity = total_production_quantity - OLD.quantity,
+                quality_a_count = quality_a_count - IFNULL(OLD.quality_check = 'A級', 0),
+                total_shipments = total_shipments
+                    - (SELECT COUNT(*) FROM shipment WHERE production_id = OLD.id),
+                total_shipment_quantity = total_shipment_quantity
+                    - (SELECT COALESCE(SUM(quantity), 0) FROM shipment WHERE production_id = OLD.id),
+                current_stock = current_stock
+                    - (SELECT COALESCE(SUM(quantity), 0) FROM inventory WHERE production_id = OLD.id)
+            WHERE tea_type = OLD.tea_type;
+            INSERT INTO tea_type_summary (tea_type) VALUES (NEW.tea_type)
+            ON CONFLICT (tea_type) DO NOTHING;
+            UPDATE tea_type_summary SET
+                total_productions = total_productions + 1,
+                total_production_quantity = total_production_quantity + NEW.quantity,
+                quality_a_count = quality_a_count + IFNULL(NEW.quality_check = 'A級', 0),
+                total_shipments = total_shipments
+                    + (SELECT COUNT(*) FROM shipment WHERE production_id = NEW.id),
+                total_shipment_quantity = total_shipment_quantity
+                    + (SELECT COALESCE(SUM(quantity), 0) FROM shipment WHERE production_id = NEW.id),
+                current_stock = current_stock
+                    + (SELECT COALESCE(SUM(quantity), 0) FROM inventory WHERE production_id = NEW.id)
+            WHERE tea_type = NEW.tea_type;
+        END
+    ''',
+    # 出荷データ
+    '''
+        CREATE TRIGGER IF NOT EXISTS trg_summary_shipment_insert
+        AFTER INSERT ON shipment
+        BEGIN
+            UPDATE tea_type_summary SET
+                total_shipments = total_shipments + 1,
+                total_shipment_quantity = total_shipment_quantity + NEW.quantity
+            WHERE tea_type = (SELECT tea_type FROM production WHERE id = NEW.production_id);
+        END
+    ''',
+    '''
+        CREATE TRIGGER IF NOT EXISTS trg_summary_shipment_delete
+        AFTER DELETE ON shipment
+        BEGIN
+            UPDATE tea_type_summary SET
+                total_shipments = total_shipments - 1,
+                total_shipment_quantity = total_shipment_quantity - OLD.quantity
+            WHERE tea_type = (SELECT tea_type FROM production WHERE id = OLD.production_id);
+        END
+    ''',
+    '''
+        CREATE TRIGGER IF NOT EXISTS trg_summary_shipment_update
+        AFTER UPDATE OF production_id, quantity ON shipment
+        BEGIN
+            UPDATE tea_type_summary SET
+                total_shipments = total_shipments - 1,
+                total_shipment_quantity = total_shipment_quantity - OLD.quantity
+            WHERE tea_type = (SELECT tea_type FROM production WHERE id = OLD.production_id);
+            UPDATE tea_type_summary SET
+                total_shipments = total_shipments + 1,
+                total_shipment_quantity = total_shipment_quantity + NEW.quantity
+            WHERE tea_type = (SELECT tea_type FROM production WHERE id = NEW.production_id);
+        END
+    ''',
+    # 在庫データ
+    '''
+        CREATE TRIGGER IF NOT EXISTS trg_summary_inventory_insert
+        AFTER INSERT ON inventory
+        BEGIN
+            UPDATE tea_type_summary SET current_stock = current_stock + NEW.quantity
+            WHERE tea_type = (SELECT tea_type FROM production WHERE id = NEW.production_id);
+        END
+    ''',
+    '''
+        CREATE TRIGGER IF NOT EXISTS trg_summary_inventory_delete
+        AFTER DELETE ON inventory
+        BEGIN
+            UPDATE tea_type_summary SET current_stock = current_stock - OLD.quantity
+            WHERE tea_type = (SELECT tea_type FROM production WHERE id = OLD.production_id);
+        END
+    ''',
+    '''
+        CREATE TRIGGER IF NOT EXISTS trg_summary_inventory_update
+        AFTER UPDATE OF production_id, quantity ON inventory
+        BEGIN
+            UPDATE tea_type_summary SET current_stock = current_stock - OLD.quantity
+            WHERE tea_type = (SELECT tea_type FROM production WHERE id = OLD.production_id);
+            UPDATE tea_type_summary SET current_stock = current_stock + NEW.quantity
+            WHERE tea_type = (SELECT tea_type FROM production WHERE id = NEW.production_id);
+        END
+    ''',
+]
+
+# 書き込まれた日付を期間ロールアップの未更新の範囲として記録するSQL
+# （更新済み（clean = 1）なら X から、未更新なら今までの日付と X の古い方から。全期間が未更新（NULL）ならそのまま）
+_MARK_ROLLUP_DIRTY = '''
+    UPDATE period_rollup_state SET
+        dirty_since = CASE WHEN clean THEN {date} ELSE MIN(dirty_since, {date}) END,
+        clean = 0
+    WHERE id = 1;
+'''
+
+# 期間ごと（日次・週次・月次）のロールアップテーブルと、未更新の範囲を記録するトリガー（集計は rollups.py）
+PERIOD_ROLLUP_SQL = [
+    '''
+        CREATE TABLE IF NOT EXISTS period_rollup (
+            period TEXT NOT NULL,
+            period_start DATE NOT NULL,
+            tea_type TEXT NOT NULL,
+            quality_check TEXT NOT NULL,
+            produced_quantity REAL NOT NULL DEFAULT 0,
+            shipped_quantity REAL NOT NULL DEFAULT 0,
+            closing_stock REAL NOT NULL DEFAULT 0,
+            PRIMARY KEY (period, tea_type, quality_check, period_start)
+        )
+    ''',
+    'CREATE INDEX IF NOT EXISTS idx_period_rollup_start ON period_rollup (period, period_start)',
+    # 1行だけのテーブル。初期状態は全期間が未更新（dirty_since = NULL, clean = 0）
+    '''
+        CREATE TABLE IF NOT EXISTS period_rollup_state (
+            id INTEGER PRIMARY KEY CHECK (id = 1),
+            dirty_since DATE,
+            clean INTEGER NOT NULL DEFAULT 0
+        )
+    ''',
+    'INSERT OR IGNORE INTO period_rollup_state (id, dirty_since, clean) VALUES (1, NULL, 0)',
+    f'''
+        CREATE TRIGGER IF NOT EXISTS trg_rollup_production_insert
+        AFTER INSERT ON production
+        BEGIN
+            {_MARK_ROLLUP_DIRTY.format(date='NEW.production_date')}
+        END
+    ''',
+    f'''
+        CREATE TRIGGER IF NOT EXISTS trg_rollup_production_delete
+        AFTER DELETE ON production
+        BEGIN
+            {_MARK_ROLLUP_DIRTY.format(date='OLD.production_date')}
+        END
+    ''',
+    # 茶葉の種類・品質評価が変わった場合は、そのロットの出荷の期間も再計算する
+    f'''
+        CREATE TRIGGER IF NOT EXISTS trg_rollup_production_update
+        AFTER UPDATE OF tea_type, production_date, quantity, quality_check ON production
+        BEGIN
+            {_MARK_ROLLUP_DIRTY.format(date="""MIN(OLD.production_date, NEW.production_date, COALESCE(
+                (SELECT MIN(shipment_date) FROM shipment WHERE production_id = NEW.id), NEW.production_date))""")}
+        END
+    ''',
+    f'''
+        CREATE TRIGGER IF NOT EXISTS trg_rollup_shipment_insert
+        AFTER INSERT ON shipment
+        BEGIN
+            {_MARK_ROLLUP_DIRTY.format(date='NEW.shipment_date')}
+        END
+    ''',
+    f'''
+        CREATE TRIGGER IF NOT EXISTS trg_rollup_shipment_delete
+        AFTER DELETE ON shipment
+        BEGIN
+            {_MARK_ROLLUP_DIRTY.format(date='OLD.shipment_date')}
+        END
+    ''',
+    f'''
+        CREATE TRIGGER IF NOT EXISTS trg_rollup_shipment_update
+        AFTER UPDATE OF production_id, shipment_date, quantity ON shipment
+        BEGIN
+            {_MARK_ROLLUP_DIRTY.format(date='MIN(OLD.shipment_date, NEW.shipment_date)')}
+        END
+    ''',
+]
+
+# 在庫の増減の台帳（追記のみ）と、ロットごとの在庫のスナップショット（計算は ledger.py）
+# 台帳は生産・出荷の書き込みと同じトランザクションでトリガーが追記し、変更・削除は打ち消しの行を追記する
+# スナップショットはその日の終わりの在庫で、それ以前の日付の台帳が追記されたら破棄する
+STOCK_LEDGER_SQL = [
+    '''
+        CREATE TABLE IF NOT EXISTS stock_ledger (
+            id INTEGER PRIMARY KEY AUTOINCREMENT,
+            production_id INTEGER NOT NULL,
+            movement_date DATE NOT NULL,
+            quantity REAL NOT NULL,
+            source TEXT NOT NULL,
+            source_id INTEGER NOT NULL,
+            recorded_at TIMESTAMP DEFAULT CURRENT_TIMESTAMP
+        )
+    ''',
+    'CREATE INDEX IF NOT EXISTS idx_stock_ledger_movement_date ON stock_ledger (movement_date)',
+    '''
+        CREATE TABLE IF NOT EXISTS stock_checkpoint (
+            snapshot_date DATE PRIMARY KEY,
+            lot_count INTEGER NOT NULL,
+            created_at TIMESTAMP DEFAULT CURRENT_TIMESTAMP
+        )
+    ''',
+    '''
+        CREATE TABLE IF NOT EXISTS stock_snapshot (
+            snapshot_date DATE NOT NULL,
+            production_id INTEGER NOT NULL,
+            quantity REAL NOT NULL,
+            PRIMARY KEY (snapshot_date, production_id)
+        )
+    ''',
+    # 既存の生産・出荷データから台帳を作る（トリガーより先に行う）
+    '''
+        INSERT INTO stock_ledger (production_id, movement_date, quantity, source, source_id)
+        SELECT id, production_date, quantity, 'production', id FROM production ORDER BY id
+    ''',
+    '''
+        INSERT INTO stock_ledger (production_id, movement_date, quantity, source, source_id)
+        SELECT production_id, shipment_date, -quantity, 'shipment', id FROM shipment ORDER BY id
+    ''',
+    '''
+        CREATE TRIGGER IF NOT EXISTS trg_stock_ledger_no_update
+        BEFORE UPDATE ON stock_ledger
+        BEGIN
+            SELECT RAISE(ABORT, 'stock_ledger は追記のみです');
+        END
+    ''',
+    '''
+        CREATE TRIGGER IF NOT EXISTS trg_stock_ledger_no_delete
+        BEFORE DELETE ON stock_ledger
+        BEGIN
+            SELECT RAISE(ABORT, 'stock_ledger は追記のみです');
+        END
+    ''',
+    '''
+        CREATE TRIGGER IF NOT EXISTS trg_stock_ledger_invalidate_snapshots
+        AFTER INSERT ON stock_ledger
+        BEGIN
+            DELETE FROM stock_checkpoint WHERE snapshot_date >= NEW.movement_date;
+            DELETE FROM stock_snapshot WHERE snapshot_date >= NEW.movement_date;
+        END
+    ''',
+    # 生産データ
+    '''
+        CREATE TRIGGER IF NOT EXISTS trg_ledger_production_insert
+        AFTER INSERT ON production
+        BEGIN
+            INSERT INTO stock_ledger (production_id, movement_date, quantity, source, source_id)
+            VALUES (NEW.id, NEW.production_date, NEW.quantity, 'production', NEW.id);
+        END
+    ''',
+    '''
+        CREATE TRIGGER IF NOT EXISTS trg_ledger_production_update
+        AFTER UPDATE OF production_date, quantity ON production
+        WHEN OLD.production_date IS NOT NEW.production_date OR OLD.quantity IS NOT NEW.quantity
+        BEGIN
+            INSERT INTO stock_ledger (production_id, movement_date, quantity, source, source_id)
+            VALUES (OLD.id, OLD.production_date, -OLD.quantity, 'production', OLD.id),
+                   (NEW.id, NEW.production_date, NEW.quantity, 'production', NEW.id);
+        END
+    ''',
+    '''
+        CREATE TRIGGER IF NOT EXISTS trg_ledger_production_delete
+        AFTER DELETE ON production
+        BEGIN
+            INSERT INTO stock_ledger (production_id, movement_date, quantity, source, source_id)
+            VALUES (OLD.id, OLD.production_date, -OLD.quantity, 'production', OLD.id);
+        END
+    ''',
+    # 出荷データ
+    '''
+        CREATE TRIGGER IF NOT EXISTS trg_ledger_shipment_insert
+        AFTER INSERT ON shipment
+        BEGIN
+            INSERT INTO stock_ledger (production_id, movement_date, quantity, source, source_id)
+            VALUES (NEW.production_id, NEW.shipment_date, -NEW.quantity, 'shipment', NEW.id);
+        END
+    ''',
+    '''
+        CREATE TRIGGER IF NOT EXISTS trg_ledger_shipment_update
+        AFTER UPDATE OF production_id, shipment_date, quantity ON shipment
+        WHEN OLD.production_id IS NOT NEW.production_id OR OLD.shipment_date IS NOT NEW.shipment_date
+            OR OLD.quantity IS NOT NEW.quantity
+        BEGIN
+            INSERT INTO stock_ledger (production_id, movement_date, quantity, source, source_id)
+            VALUES (OLD.production_id, OLD.shipment_date, OLD.quantity, 'shipment', OLD.id),
+                   (NEW.production_id, NEW.shipment_date, -NEW.quantity, 'shipment', NEW.id);
+        END
+    ''',
+    '''
+        CREATE TRIGGER IF NOT EXISTS trg_ledger_shipment_delete
+        AFTER DELETE ON shipment
+        BEGIN
+            INSERT INTO stock_ledger (production_id, movement_date, quantity, source, source_id)
+            VALUES (OLD.production_id, OLD.shipment_date, OLD.quantity, 'shipment', OLD.id);
+        END
+    ''',
+]
+
+# 変更の記録（Djangoのデータベースとの同期用、同期は tea_production.sync）
+# 行の値は記録せず、同期の時点の行の値を反映する。同期で書き込む間は change_capture.paused を 1 にして記録しない
+CHANGE_CAPTURE_SQL = [
+    '''
+        CREATE TABLE IF NOT EXISTS change_log (
+            seq INTEGER PRIMARY KEY AUTOINCREMENT,
+            table_name TEXT NOT NULL,
+            row_id INTEGER NOT NULL,
+            operation TEXT NOT NULL,
+            changed_at TIMESTAMP DEFAULT CURRENT_TIMESTAMP
+        )
+    ''',
+    # 1行だけのテーブル
+    '''
+        CREATE TABLE IF NOT EXISTS change_capture (
+            id INTEGER PRIMARY KEY CHECK (id = 1),
+            paused INTEGER NOT NULL DEFAULT 0
+        )
+    ''',
+    'INSERT OR IGNORE INTO change_capture (id, paused) VALUES (1, 0)',
+    # 相手のデータベースの変更をどこまで反映したか
+    '''
+        CREATE TABLE IF NOT EXISTS sync_state (
+            source TEXT PRIMARY KEY,
+            last_seq INTEGER NOT NULL,
+            synced_at TIMESTAMP DEFAULT CURRENT_TIMESTAMP
+        )
+    ''',
+    # 同期で作成した行と、元になったDjangoの行のIDの対応
+    '''
+        CREATE TABLE IF NOT EXISTS sync_id_map (
+            table_name TEXT NOT NULL,
+            raw_id INTEGER NOT NULL,
+            django_id INTEGER NOT NULL,
+            PRIMARY KEY (table_name, raw_id),
+            UNIQUE (table_name, django_id)
+        )
+    ''',
+    # 既存の行は最初の同期ですべて反映する（トリガーより先に行う）
+    '''
+        INSERT INTO change_log (table_name, row_id, operation)
+        SELECT 'production', id, 'insert' FROM production ORDER BY id
+    ''',
+    '''
+        INSERT INTO change_log (table_name, row_id, operation)
+        SELECT 'inventory', production_id, 'insert' FROM inventory WHERE production_id IS NOT NULL ORDER BY production_id
+    ''',
+    '''
+        INSERT INTO change_log (table_name, row_id, operation)
+        SELECT 'shipment', id, 'insert' FROM shipment ORDER BY id
+    ''',
+    # 生産データ
+    '''
+        CREATE TRIGGER IF NOT EXISTS trg_capture_production_insert
+        AFTER INSERT ON production
+        WHEN (SELECT paused FROM change_capture WHERE id = 1) = 0
+        BEGIN
+            INSERT INTO change_log (table_name, row_id, operation) VALUES ('production', NEW.id, 'insert');
+        END
+    ''',
+    '''
+        CREATE TRIGGER IF NOT EXISTS trg_capture_production_update
+        AFTER UPDATE OF tea_type, production_date, quantity, quality_check, quality_notes, created_at ON production
+        WHEN (SELECT paused FROM change_capture WHERE id = 1) = 0
+        BEGIN
+            INSERT INTO change_log (table_name, row_id, operation) VALUES ('production', NEW.id, 'update');
+        END
+    ''',
+    '''
+        CREATE TRIGGER IF NOT EXISTS trg_capture_production_delete
+        AFTER DELETE ON production
+        WHEN (SELECT paused FROM change_capture WHERE id = 1) = 0
+        BEGIN
+            INSERT INTO change_log (table_name, row_id, operation) VALUES ('production', OLD.id, 'delete');
+        END
+    ''',
+    # 在庫データ（行は生産データIDで識別し、生産データIDが変わった場合は元の生産データIDの在庫を削除として記録する）
+    '''
+        CREATE TRIGGER IF NOT EXISTS trg_capture_inventory_insert
+        AFTER INSERT ON inventory
+        WHEN (SELECT paused FROM change_capture WHERE id = 1) = 0
+        BEGIN
+            INSERT INTO change_log (table_name, row_id, operation) VALUES ('inventory', NEW.production_id, 'insert');
+        END
+    ''',
+    '''
+        CREATE TRIGGER IF NOT EXISTS trg_capture_inventory_update
+        AFTER UPDATE OF production_id, quantity ON inventory
+        WHEN (SELECT paused FROM change_capture WHERE id = 1) = 0
+        BEGIN
+            INSERT INTO change_log (table_name, row_id, operation) VALUES ('inventory', NEW.production_id, 'update');
+            INSERT INTO change_log (table_name, row_id, operation)
+            SELECT 'inventory', OLD.production_id, 'delete' WHERE OLD.production_id IS NOT NEW.production_id;
+        END
+    ''',
+    '''
+        CREATE TRIGGER IF NOT EXISTS trg_capture_inventory_delete
+        AFTER DELETE ON inventory
+        WHEN (SELECT paused FROM change_capture WHERE id = 1) = 0
+        BEGIN
+            INSERT INTO change_log (table_name, row_id, operation) VALUES ('inventory', OLD.production_id, 'delete');
+        END
+    ''',
+    # 出荷データ
+    '''
+        CREATE TRIGGER IF NOT EXISTS trg_capture_shipment_insert
+        AFTER INSERT ON shipment
+        WHEN (SELECT paused FROM change_capture WHERE id = 1) = 0
+        BEGIN
+            INSERT INTO change_log (table_name, row_id, operation) VALUES ('shipment', NEW.id, 'insert');
+        END
+    ''',
+    '''
+        CREATE TRIGGER IF NOT EXISTS trg_capture_shipment_update
+        AFTER UPDATE OF production_id, shipment_date, quantity, customer_name, customer_contact, created_at ON shipment
+        WHEN (SELECT paused FROM change_capture WHERE id = 1) = 0
+        BEGIN
+            INSERT INTO change_log (table_name, row_id, operation) VALUES ('shipment', NEW.id, 'update');
+        END
+    ''',
+    '''
+        CREATE TRIGGER IF NOT EXISTS trg_capture_shipment_delete
+        AFTER DELETE ON shipment
+        WHEN (SELECT paused FROM change_capture WHERE id = 1) = 0
+        BEGIN
+            INSERT INTO change_log (table_name, row_id, operation) VALUES ('shipment', OLD.id, 'delete');
+        END
+    ''',
+]
+
+# スキーマのマイグレーション
+# 各要素が1バージョン分のSQL文のリストで、適用済みのバージョンは PRAGMA user_version に記録する
+MIGRATIONS = [
+    # 1: 初期スキーマ
+    [
         # 茶葉の生産テーブル
-        cursor.execute('''
+        '''
             CREATE TABLE IF NOT EXISTS production (
                 id INTEGER PRIMARY KEY AUTOINCREMENT,
                 tea_type TEXT NOT NULL,
@@ -32,10 +615,9 @@ def create_tables(conn):
                 quality_notes TEXT,
                 created_at TIMESTAMP DEFAULT CURRENT_TIMESTAMP
             )
-        ''')
-        
+        ''',
         # 出荷テーブル
-        cursor.execute('''
+        '''
             CREATE TABLE IF NOT EXISTS shipment (
                 id INTEGER PRIMARY KEY AUTOINCREMENT,
                 production_id INTEGER,
@@ -46,10 +628,9 @@ def create_tables(conn):
                 created_at TIMESTAMP DEFAULT CURRENT_TIMESTAMP,
                 FOREIGN KEY (production_id) REFERENCES production (id)
             )
-        ''')
-        
+        ''',
         # 在庫テーブル
-        cursor.execute('''
+        '''
             CREATE TABLE IF NOT EXISTS inventory (
                 id INTEGER PRIMARY KEY AUTOINCREMENT,
                 production_id INTEGER,
@@ -57,17 +638,194 @@ def create_tables(conn):
                 last_updated TIMESTAMP DEFAULT CURRENT_TIMESTAMP,
                 FOREIGN KEY (production_id) REFERENCES production (id)
             )
-        ''')
-        
+        ''',
+    ],
+    # 2: 結合と日付範囲検索用のインデックス
+    [
+        'CREATE UNIQUE INDEX IF NOT EXISTS idx_inventory_production_id ON inventory (production_id)',
+        'CREATE INDEX IF NOT EXISTS idx_shipment_production_id ON shipment (production_id)',
+        'CREATE INDEX IF NOT EXISTS idx_shipment_shipment_date ON shipment (shipment_date)',
+        'CREATE INDEX IF NOT EXISTS idx_production_production_date ON production (production_date)',
+        'CREATE INDEX IF NOT EXISTS idx_production_tea_type_date ON production (tea_type, production_date)',
+    ],
+    # 3: 茶葉の種類ごとのサマリーテーブル（既存データから初期化する）
+    SUMMARY_ROLLUP_SQL + REBUILD_SUMMARY_SQL,
+    # 4: 差分エクスポート用の更新日時とウォーターマーク
+    [
+        'ALTER TABLE production ADD COLUMN updated_at TIMESTAMP',
+        '''
+            CREATE TRIGGER IF NOT EXISTS trg_production_updated_at
+            AFTER UPDATE OF tea_type, production_date, quantity, quality_check, quality_notes ON production
+            BEGIN
+                UPDATE production SET updated_at = CURRENT_TIMESTAMP WHERE id = NEW.id;
+            END
+        ''',
+        'CREATE INDEX IF NOT EXISTS idx_production_updated_at ON production (updated_at)',
+        'CREATE INDEX IF NOT EXISTS idx_inventory_last_updated ON inventory (last_updated)',
+        '''
+            CREATE TABLE IF NOT EXISTS export_watermark (
+                target TEXT NOT NULL,
+                table_name TEXT NOT NULL,
+                last_id INTEGER NOT NULL,
+                last_timestamp TIMESTAMP NOT NULL,
+                exported_at TIMESTAMP DEFAULT CURRENT_TIMESTAMP,
+                PRIMARY KEY (target, table_name)
+            )
+        ''',
+    ],
+    # 5: 期間ごとのロールアップテーブル（初回の更新で全期間を集計する）
+    PERIOD_ROLLUP_SQL,
+    # 6: 在庫の台帳とスナップショット（既存データから台帳を作る）
+    STOCK_LEDGER_SQL,
+    # 7: Djangoのデータベースとの同期用の変更の記録（既存データは最初の同期で反映する）
+    CHANGE_CAPTURE_SQL,
+    # 8: 差分エクスポート用の出荷の更新日時（同期でDjangoでの変更が反映されるため）
+    [
+        'ALTER TABLE shipment ADD COLUMN updated_at TIMESTAMP',
+        '''
+            CREATE TRIGGER IF NOT EXISTS trg_shipment_updated_at
+            AFTER UPDATE OF production_id, shipment_date, quantity, customer_name, customer_contact ON shipment
+            BEGIN
+                UPDATE shipment SET updated_at = CURRENT_TIMESTAMP WHERE id = NEW.id;
+            END
+        ''',
+        'CREATE INDEX IF NOT EXISTS idx_shipment_updated_at ON shipment (updated_at)',
+    ],
+    # 9: 在庫がなくなったロットの在庫が戻った回数（引き当ての索引 allocation.LotIndex の版）
+    [
+        '''
+            CREATE TABLE IF NOT EXISTS lot_index_state (
+                id INTEGER PRIMARY KEY CHECK (id = 1),
+                restocks INTEGER NOT NULL DEFAULT 0
+            )
+        ''',
+        'INSERT OR IGNORE INTO lot_index_state (id, restocks) VALUES (1, 0)',
+        # 在庫がなくなったロットは索引から外れるため、在庫が戻ったら索引を作り直させる（1e-9 は allocation.EPSILON）
+        '''
+            CREATE TRIGGER IF NOT EXISTS trg_lot_index_restock
+            AFTER UPDATE OF quantity ON inventory
+            WHEN OLD.quantity <= 1e-9 AND NEW.quantity > 1e-9
+            BEGIN
+                UPDATE lot_index_state SET restocks = restocks + 1 WHERE id = 1;
+            END
+        ''',
+    ],
+]
+
+def get_schema_version(conn):
+    """
+    適用済みのスキーマバージョンを取得する
+
+    :param conn: データベース接続オブジェクト
+    :return: スキーマバージョン
+    """
+    return conn.execute('PRAGMA user_version').fetchone()[0]
+
+def migrate(conn):
+    """
+    未適用のマイグレーションを順に適用する
+    各バージョンは1トランザクションで適用し、失敗した場合はそのバージョンをロールバックする
+
+    :param conn: データベース接続オブジェクト
+    :return: 適用後のスキーマバージョン
+    """
+    current = get_schema_version(conn)
+    for version, statements in enumerate(MIGRATIONS, start=1):
+        if version <= current:
+            continue
+        if not conn.in_transaction:
+            conn.execute('BEGIN IMMEDIATE')
+        try:
+            for statement in statements:
+                conn.execute(statement)
+            conn.execute(f'PRAGMA user_version = {version}')
+            conn.commit()
+        except Error:
+            conn.rollback()
+            raise
+        current = version
+    return current
+
+def rebuild_summary(conn):
+    """
+    tea_type_summary を全履歴から作り直す
+
+    :param conn: データベース接続オブジェクト
+    """
+    if not conn.in_transaction:
+        conn.execute('BEGIN IMMEDIATE')
+    try:
+        for statement in REBUILD_SUMMARY_SQL:
+            conn.execute(statement)
         conn.commit()
+    except Error:
+        conn.rollback()
+        raise
+
+def verify_summary(conn, tolerance: float = 1e-6):
+    """
+    tea_type_summary を全履歴からの再計算結果と比較する
+
+    :param conn: データベース接続オブジェクト
+    :param tolerance: 数量の比較で許容する誤差
+    :return: 不一致のリスト (茶葉の種類, 列名, ロールアップの値, 再計算した値)
+    """
+    columns = ', '.join(SUMMARY_COLUMNS)
+    rollup = {
+        row[0]: row[1:]
+        for row in conn.execute(
+            f'SELECT tea_type, {columns} FROM tea_type_summary WHERE total_productions > 0')
+    }
+    expected = {
+        row[0]: row[1:]
+        for row in conn.execute(f'SELECT tea_type, {columns} FROM ({SUMMARY_RECOMPUTE_QUERY})')
+    }
+
+    mismatches = []
+    for tea_type in sorted(set(rollup) | set(expected)):
+        actual_values = rollup.get(tea_type, (0,) * len(SUMMARY_COLUMNS))
+        expected_values = expected.get(tea_type, (0,) * len(SUMMARY_COLUMNS))
+        for column, actual, value in zip(SUMMARY_COLUMNS, actual_values, expected_values):
+            if abs(actual - value) > tolerance:
+                mismatches.append((tea_type, column, actual, value))
+    return mismatches
+
+def create_tables(conn):
+    """
+    必要なテーブルを作成する
+    :param conn: データベース接続オブジェクト
+    """
+    try:
+        migrate(conn)
     except Error as e:
         print(f"テーブル作成エラー: {e}")
 
 if __name__ == '__main__':
+    import argparse
+
+    parser = argparse.ArgumentParser(description='茶生産管理データベースの管理コマンド')
+    parser.add_argument('--db', help='データベースファイルのパス')
+    subparsers = parser.add_subparsers(dest='command')
+    subparsers.add_parser('migrate', help='テーブルを作成し、マイグレーションを適用する（既定）')
+    rebuild_parser = subparsers.add_parser(
+        'rebuild-summary', help='tea_type_summary を作り直し、全履歴からの再計算と照合する')
+    rebuild_parser.add_argument('--check-only', action='store_true', help='作り直さずに照合だけ行う')
+    args = parser.parse_args()
+
     # データベース接続とテーブル作成
-    conn = create_connection()
-    if conn is not None:
-        create_tables(conn)
+    conn = create_connection(args.db)
+    if conn is None:
+        print("データベース接続を確立できませんでした。")
+        raise SystemExit(1)
+
+    create_tables(conn)
+    if args.command == 'rebuild-summary':
+        if not args.check_only:
+            rebuild_summary(conn)
+        mismatches = verify_summary(conn)
+        for tea_type, column, actual, expected in mismatches:
+            print(f"不一致: {tea_type} {column} ロールアップ={actual} 再計算={expected}")
+        print("サマリーは全履歴と一致しています。" if not mismatches else f"{len(mismatches)}件の不一致があります。")
         conn.close()
-    else:
-        print("データベース接続を確立できませんでした。") 
\ No newline at end of file
+        raise SystemExit(1 if mismatches else 0)
+    conn.close()
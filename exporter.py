@@ -0,0 +1,317 @@
+"""
+テーブルのストリーミングエクスポート
+カーソルからチャンク単位で読み出して書き出すため、メモリ使用量は履歴の件数に依存しない
+"""
+import csv
+import gzip
+import io
+import json
+import os
+from concurrent.futures import ThreadPoolExecutor
+
+from database import create_connection
+
+EXPORT_TABLES = ('production', 'shipment', 'inventory')
+
+# 1回のfetchmanyで読み出す行数
+DEFAULT_CHUNK_SIZE = 10000
+
+# 圧縮形式ごとのファイル拡張子
+COMPRESSION_SUFFIXES = {
+    None: '',
+    'gzip': '.gz',
+    'zstd': '.zst',
+}
+
+# 差分エクスポートで前回以降に追加・更新された行を選ぶ条件
+# 追加された行はIDで、更新された行は更新日時で判定する（出荷も同期でDjangoでの変更が反映される）
+DELTA_CONDITIONS = {
+    'production': 'id > :last_id OR updated_at >= :since',
+    'shipment': 'id > :last_id OR updated_at >= :since',
+    'inventory': 'id > :last_id OR last_updated >= :since',
+}
+
+# 最後の全件エクスポートのマニフェスト（差分エクスポートでは上書きしない）
+MANIFEST_NAME = 'manifest.json'
+
+# 実行ごとのマニフェスト（全件・差分とも書き出す）
+RUN_MANIFEST_NAME = 'manifest_{stamp}.json'
+
+# SQLiteの宣言型からParquetの型への対応（該当しない型は文字列として書き出す）
+_PARQUET_TYPES = {
+    'INTEGER': 'int64',
+    'REAL': 'float64',
+}
+
+
+def output_path(file_path: str, name: str, fmt: str = 'csv', compression: str = None):
+    """
+    エクスポート先のファイルパスを組み立てる
+
+    :param file_path: エクスポート先のディレクトリ
+    :param name: ファイル名（拡張子なし）
+    :param fmt: 出力形式（csv または parquet）
+    :param compression: 圧縮形式（None, gzip, zstd）
+    :return: ファイルパス
+    """
+    if fmt == 'parquet':
+        # Parquetはファイル内部で圧縮する
+        return os.path.join(file_path, f"{name}.parquet")
+    return os.path.join(file_path, f"{name}.csv{COMPRESSION_SUFFIXES[compression]}")
+
+
+def _open_text(path: str, compression: str = None):
+    """
+    圧縮形式に応じた書き込み用のテキストストリームを開く
+    """
+    if compression is None:
+        return open(path, 'w', newline='', encoding='utf-8')
+    if compression == 'gzip':
+        return gzip.open(path, 'wt', newline='', encoding='utf-8')
+    if compression == 'zstd':
+        try:
+            import zstandard
+        except ImportError as e:
+            raise ImportError("zstd圧縮には zstandard パッケージが必要です") from e
+        raw = open(path, 'wb')
+        stream = zstandard.ZstdCompressor().stream_writer(raw, closefd=True)
+        return io.TextIOWrapper(stream, newline='', encoding='utf-8')
+    raise ValueError(f"未対応の圧縮形式です: {compression}")
+
+
+def _write_csv(cursor, path: str, compression: str, chunk_size: int):
+    """
+    カーソルの結果をチャンク単位でCSVに書き出す
+    """
+    columns = [d[0] for d in cursor.description]
+    rows = 0
+    with _open_text(path, compression) as f:
+        writer = csv.writer(f, lineterminator='\n')
+        writer.writerow(columns)
+        while True:
+            chunk = cursor.fetchmany(chunk_size)
+            if not chunk:
+                break
+            writer.writerows(chunk)
+            rows += len(chunk)
+    return rows
+
+
+def _parquet_schema(conn, table: str, columns):
+    """
+    テーブルの宣言型からParquetのスキーマを作る
+    """
+    import pyarrow as pa
+
+    declared = {row[1]: row[2].upper() for row in conn.execute(f'PRAGMA table_info({table})')}
+    return pa.schema([
+        (column, getattr(pa, _PARQUET_TYPES.get(declared.get(column), 'string'))())
+        for column in columns
+    ])
+
+
+def _write_parquet(conn, table: str, cursor, path: str, compression: str, chunk_size: int):
+    """
+    カーソルの結果をチャンクごとに1つのRecordBatchとしてParquetに書き出す
+    """
+    try:
+        import pyarrow as pa
+        import pyarrow.parquet as pq
+    except ImportError as e:
+        raise ImportError("Parquet出力には pyarrow パッケージが必要です") from e
+
+    columns = [d[0] for d in cursor.description]
+    schema = _parquet_schema(conn, table, columns)
+    rows = 0
+    with pq.ParquetWriter(path, schema, compression=compression or 'snappy') as writer:
+        while True:
+            chunk = cursor.fetchmany(chunk_size)
+            if not chunk:
+                break
+            arrays = [
+                pa.array([None if v is None else str(v) for v in values], type=field.type)
+                if pa.types.is_string(field.type) else pa.array(values, type=field.type)
+                for field, values in zip(schema, zip(*chunk))
+            ]
+            writer.write_batch(pa.RecordBatch.from_arrays(arrays, schema=schema))
+            rows += len(chunk)
+    return rows
+
+
+def export_query(db_file: str, table: str, path: str, query: str = None, params=(),
+                 fmt: str = 'csv', compression: str = None, chunk_size: int = DEFAULT_CHUNK_SIZE):
+    """
+    1つのテーブル（またはクエリ結果）をファイルに書き出す
+    専用の接続で読み出すため、別スレッドから並行して呼び出せる
+
+    :param db_file: データベースファイルのパス
+    :param table: テーブル名
+    :param path: 出力先のファイルパス
+    :param query: 読み出しに使うクエリ（省略時はテーブル全体）
+    :param params: クエリのパラメータ
+    :param fmt: 出力形式（csv または parquet）
+    :param compression: 圧縮形式（None, gzip, zstd）
+    :param chunk_size: 1回に読み出す行数
+    :return: 書き出した行数
+    """
+    conn = create_connection(db_file)
+    if conn is None:
+        raise RuntimeError(f"データベースに接続できません: {db_file}")
+    try:
+        cursor = conn.execute(query or f'SELECT * FROM {table} ORDER BY id', params)
+        if fmt == 'parquet':
+            return _write_parquet(conn, table, cursor, path, compression, chunk_size)
+        if fmt == 'csv':
+            return _write_csv(cursor, path, compression, chunk_size)
+        raise ValueError(f"未対応の出力形式です: {fmt}")
+    finally:
+        conn.close()
+
+
+def read_watermarks(conn, target: str):
+    """
+    前回のエクスポートで記録したウォーターマークを取得する
+
+    :param conn: データベース接続オブジェクト
+    :param target: エクスポート先のディレクトリ
+    :return: {テーブル名: (最大ID, 開始日時)}
+    """
+    cursor = conn.execute(
+        'SELECT table_name, last_id, last_timestamp FROM export_watermark WHERE target = ?',
+        (os.path.abspath(target),)
+    )
+    return {table: (last_id, since) for table, last_id, since in cursor}
+
+
+def _current_watermarks(conn, tables):
+    """
+    エクスポート開始時点のウォーターマークを取得する
+    開始後に書き込まれた行は次回の差分に含まれる
+    """
+    since = conn.execute('SELECT CURRENT_TIMESTAMP').fetchone()[0]
+    return {
+        table: (conn.execute(f'SELECT COALESCE(MAX(id), 0) FROM {table}').fetchone()[0], since)
+        for table in tables
+    }
+
+
+def _save_watermarks(conn, target: str, watermarks):
+    """
+    エクスポートが完了したテーブルのウォーターマークを記録する
+    """
+    conn.executemany('''
+        INSERT INTO export_watermark (target, table_name, last_id, last_timestamp)
+        VALUES (?, ?, ?, ?)
+        ON CONFLICT (target, table_name) DO UPDATE SET
+            last_id = excluded.last_id,
+            last_timestamp = excluded.last_timestamp,
+            exported_at = CURRENT_TIMESTAMP
+    ''', [(os.path.abspath(target), table, last_id, since)
+          for table, (last_id, since) in watermarks.items()])
+    conn.commit()
+
+
+def _last_full_manifest(file_path: str):
+    """
+    エクスポート先の最後の全件エクスポートの実行ごとのマニフェストのファイル名を返す（なければNone）
+    """
+    path = os.path.join(file_path, MANIFEST_NAME)
+    if not os.path.exists(path):
+        return None
+    with open(path, encoding='utf-8') as f:
+        manifest = json.load(f)
+    if manifest.get('mode') != 'full':
+        return None
+    return manifest.get('manifest', MANIFEST_NAME)
+
+
+def _write_manifest(path: str, manifest):
+    """
+    マニフェストを書き出す（書き終えてから置き換えるため、読み込み側が途中の内容を読むことはない）
+    """
+    partial = f'{path}.tmp'
+    with open(partial, 'w', encoding='utf-8') as f:
+        json.dump(manifest, f, ensure_ascii=False, indent=2)
+    os.replace(partial, path)
+
+
+def export_tables(db_file: str, file_path: str, tables=EXPORT_TABLES, fmt: str = 'csv',
+                  compression: str = None, chunk_size: int = DEFAULT_CHUNK_SIZE, delta: bool = False):
+    """
+    複数のテーブルを並行してエクスポートし、ウォーターマークとマニフェストを記録する
+
+    全件エクスポートでは <テーブル名>.csv を書き出す
+    差分エクスポートでは前回のウォーターマーク以降に追加・更新された行だけを
+    <テーブル名>_delta_<日時>.csv に書き出す（前回の記録がないテーブルは全件）
+    同じ秒に更新された行は次回にも含まれることがあるため、取り込み側はIDで上書きすること
+
+    マニフェストは実行ごとに manifest_<日時>.json に書き出す
+    manifest.json は最後の全件エクスポートのマニフェストで、差分エクスポートでは上書きしない
+    差分のマニフェストの base には、起点となる全件エクスポートのマニフェストのファイル名を記録する
+
+    :param db_file: データベースファイルのパス
+    :param file_path: エクスポート先のディレクトリ
+    :param tables: エクスポートするテーブル名
+    :param fmt: 出力形式（csv または parquet）
+    :param compression: 圧縮形式（None, gzip, zstd）
+    :param chunk_size: 1回に読み出す行数
+    :param delta: 差分だけをエクスポートするかどうか
+    :return: {テーブル名: (ファイルパス, 行数)}
+    """
+    if compression not in COMPRESSION_SUFFIXES:
+        raise ValueError(f"未対応の圧縮形式です: {compression}")
+    os.makedirs(file_path, exist_ok=True)
+
+    conn = create_connection(db_file)
+    if conn is None:
+        raise RuntimeError(f"データベースに接続できません: {db_file}")
+    try:
+        previous = read_watermarks(conn, file_path) if delta else {}
+        watermarks = _current_watermarks(conn, tables)
+        stamp = watermarks[tables[0]][1].replace('-', '').replace(':', '').replace(' ', 'T')
+
+        with ThreadPoolExecutor(max_workers=len(tables)) as executor:
+            futures = {}
+            for table in tables:
+                query, params = None, ()
+                name = table
+                if delta:
+                    name = f"{table}_delta_{stamp}"
+                    if table in previous:
+                        last_id, since = previous[table]
+                        query = f'SELECT * FROM {table} WHERE {DELTA_CONDITIONS[table]} ORDER BY id'
+                        params = {'last_id': last_id, 'since': since}
+                path = output_path(file_path, name, fmt, compression)
+                futures[table] = (path, executor.submit(
+                    export_query, db_file, table, path, query, params,
+                    fmt=fmt, compression=compression, chunk_size=chunk_size))
+            results = {table: (path, future.result()) for table, (path, future) in futures.items()}
+
+        run_manifest = RUN_MANIFEST_NAME.format(stamp=stamp)
+        manifest = {
+            'mode': 'delta' if delta else 'full',
+            'manifest': run_manifest,
+            'started_at': watermarks[tables[0]][1],
+            'format': fmt,
+            'compression': compression,
+            'tables': {
+                table: {
+                    'file': os.path.basename(path),
+                    'rows': rows,
+                    'since': previous.get(table, (None, None))[1],
+                    'last_id': watermarks[table][0],
+                }
+                for table, (path, rows) in results.items()
+            },
+        }
+        if delta:
+            manifest['base'] = _last_full_manifest(file_path)
+        _write_manifest(os.path.join(file_path, run_manifest), manifest)
+        if not delta:
+            _write_manifest(os.path.join(file_path, MANIFEST_NAME), manifest)
+
+        # すべてのファイルを書き終えてからウォーターマークを進める
+        _save_watermarks(conn, file_path, watermarks)
+        return results
+    finally:
+        conn.close()
@@ -0,0 +1,142 @@
+"""
+在庫の台帳とスナップショットによる時点指定の在庫
+
+在庫（inventory）は現在の値だけを持つため、過去のある日の在庫は生産・出荷の全履歴から求めるしかない
+生産・出荷のたびに増減を追記する台帳（stock_ledger）と、一定の間隔の期末ごとのロットごとの在庫（stock_snapshot）を持ち、
+ある日の在庫はその日以前で最も近いスナップショットに、その後の台帳の範囲だけを足して求める
+
+checkpoint_dates は tea_production.ledger（Django）からも使う
+"""
+import calendar
+import datetime
+
+import pandas as pd
+
+# スナップショットを作る間隔（月数）。四半期末ごとに作る
+SNAPSHOT_INTERVAL_MONTHS = 3
+
+# 浮動小数点の数量の誤差とみなす値（これより小さい在庫はスナップショットに含めない）
+EPSILON = 1e-9
+
+
+def _as_date(value):
+    if isinstance(value, datetime.date):
+        return value
+    return datetime.date.fromisoformat(str(value)[:10])
+
+
+def checkpoint_dates(first, last, interval_months: int = SNAPSHOT_INTERVAL_MONTHS):
+    """
+    first から last までの期末の日付（interval_months ごとの月末）を古い順に返す
+
+    :param first: 最初の日付
+    :param last: 最後の日付（この日以前の期末だけを返す）
+    :param interval_months: スナップショットの間隔（月数、12の約数）
+    :return: datetime.date のリスト
+    """
+    first, last = _as_date(first), _as_date(last)
+    # 年月を通し番号にし、first を含む期の最後の月から interval_months ずつ進める
+    index = first.year * 12 + first.month - 1
+    index += interval_months - 1 - index % interval_months
+    dates = []
+    while True:
+        year, month = divmod(index, 12)
+        date = datetime.date(year, month + 1, calendar.monthrange(year, month + 1)[1])
+        if date > last:
+            return dates
+        dates.append(date)
+        index += interval_months
+
+
+def _latest_checkpoint(conn, as_of):
+    row = conn.execute('SELECT MAX(snapshot_date) FROM stock_checkpoint WHERE snapshot_date <= ?',
+                       (as_of,)).fetchone()
+    return row[0]
+
+
+def ensure_snapshots(conn, until, interval_months: int = SNAPSHOT_INTERVAL_MONTHS):
+    """
+    until 以前の期末のうち、スナップショットがない期末について作る
+    各期末のスナップショットは直前のスナップショットにその間の台帳を足して作るため、全履歴は読まない
+
+    :param conn: データベース接続オブジェクト
+    :param until: この日以前の期末まで作る
+    :param interval_months: スナップショットの間隔（月数）
+    :return: 作成したスナップショットの数
+    """
+    until = _as_date(until).isoformat()
+    if not conn.in_transaction:
+        conn.execute('BEGIN IMMEDIATE')
+    try:
+        previous = _latest_checkpoint(conn, until)
+        first, last = conn.execute(
+            'SELECT MIN(movement_date), MAX(movement_date) FROM stock_ledger WHERE movement_date > ?',
+            (previous or '',)).fetchone()
+        created = 0
+        if first is not None:
+            # 台帳の最後の日より後の期末は、前の期末と同じ内容になるため作らない
+            for date in checkpoint_dates(first, min(until, last), interval_months):
+                date = date.isoformat()
+                cursor = conn.execute('''
+                    INSERT INTO stock_snapshot (snapshot_date, production_id, quantity)
+                    SELECT ?, production_id, SUM(quantity)
+                    FROM (
+                        SELECT production_id, quantity FROM stock_snapshot WHERE snapshot_date = ?
+                        UNION ALL
+                        SELECT production_id, quantity FROM stock_ledger
+                        WHERE movement_date > ? AND movement_date <= ?
+                    )
+                    GROUP BY production_id
+                    HAVING ABS(SUM(quantity)) > ?
+                ''', (date, previous or '', previous or '', date, EPSILON))
+                conn.execute('INSERT INTO stock_checkpoint (snapshot_date, lot_count) VALUES (?, ?)',
+                             (date, cursor.rowcount))
+                previous = date
+                created += 1
+        conn.commit()
+    except Exception:
+        conn.rollback()
+        raise
+    return created
+
+
+def stock_as_of(conn, as_of, tea_type: str = None, quality_check: str = None):
+    """
+    as_of の日の終わりのロットごとの在庫を求める
+    as_of 以前で最も近いスナップショットと、その翌日から as_of までの台帳だけを読む
+    （スナップショットがない場合は台帳の先頭から読む。先に ensure_snapshots を呼んでおく）
+
+    :param conn: データベース接続オブジェクト
+    :param as_of: 日付 (YYYY-MM-DD)
+    :param tea_type: 茶葉の種類
+    :param quality_check: 品質評価
+    :return: 在庫のあるロットのDataFrame (production_id, tea_type, quality_check, production_date, quantity)
+    """
+    as_of = _as_date(as_of).isoformat()
+    base = _latest_checkpoint(conn, as_of) or ''
+    conditions, params = [], [base, base, as_of, EPSILON]
+    if tea_type:
+        conditions.append('p.tea_type = ?')
+        params.append(tea_type)
+    if quality_check:
+        conditions.append('p.quality_check = ?')
+        params.append(quality_check)
+    where = f"WHERE {' AND '.join(conditions)}" if conditions else ''
+    query = f'''
+        SELECT s.production_id, p.tea_type, p.quality_check, p.production_date, s.quantity
+        FROM (
+            SELECT production_id, SUM(quantity) AS quantity
+            FROM (
+                SELECT production_id, quantity FROM stock_snapshot WHERE snapshot_date = ?
+                UNION ALL
+                SELECT production_id, quantity FROM stock_ledger
+                WHERE movement_date > ? AND movement_date <= ?
+            )
+            GROUP BY production_id
+            HAVING ABS(SUM(quantity)) > ?
+        ) s
+        LEFT JOIN production p ON p.id = s.production_id
+        {where}
+        ORDER BY p.production_date, s.production_id
+    '''
+    return pd.read_sql_query(query, conn, params=params)
@@ -0,0 +1,146 @@
+"""
+レポート結果のキャッシュ
+書き込みのたびに世代番号を進め、古い世代で作られた結果は使わない
+"""
+import functools
+import inspect
+import threading
+from collections import OrderedDict
+
+import pandas as pd
+
+
+class ReportCache:
+    """
+    メソッド名と引数をキーにしたLRUキャッシュ
+
+    書き込み系のメソッドは bump() で世代番号を進めて全体を無効にする
+    cross_process=True の場合は PRAGMA data_version も比較し、
+    別の接続（別プロセスや別スレッド）からの書き込みも検出する
+    """
+
+    def __init__(self, maxsize: int = 128, cross_process: bool = False):
+        """
+        :param maxsize: 保持する結果の最大件数（0の場合はキャッシュしない）
+        :param cross_process: 別の接続からの書き込みも検出するかどうか
+        """
+        self.maxsize = maxsize
+        self.cross_process = cross_process
+        self.generation = 0
+        self.hits = 0
+        self.misses = 0
+        self.evictions = 0
+        self._entries = OrderedDict()
+        self._lock = threading.Lock()
+
+    def bump(self):
+        """
+        世代番号を進め、保持している結果をすべて無効にする
+        """
+        with self._lock:
+            self.generation += 1
+            self._entries.clear()
+
+    def _stamp(self, conn):
+        """
+        結果が有効かどうかを判定するための印
+        data_versionは接続ごとの値なので、接続自体も印に含める
+        """
+        if not self.cross_process:
+            return self.generation
+        data_version = conn.execute('PRAGMA data_version').fetchone()[0]
+        return self.generation, id(conn), data_version
+
+    def get_or_compute(self, key, conn, compute):
+        """
+        キャッシュされた結果を返す。なければ計算して保持する
+
+        :param key: キャッシュのキー
+        :param conn: 結果の計算に使う接続
+        :param compute: 結果を計算する関数
+        :return: 結果
+        """
+        if self.maxsize <= 0:
+            return compute()
+
+        stamp = self._stamp(conn)
+        with self._lock:
+            entry = self._entries.get(key)
+            if entry is not None and entry[0] == stamp:
+                self._entries.move_to_end(key)
+                self.hits += 1
+                return _copy(entry[1])
+            self.misses += 1
+
+        value = compute()
+        with self._lock:
+            # 計算中に書き込みがあった場合は保持しない
+            if stamp == self._stamp(conn):
+                self._entries[key] = (stamp, value)
+                self._entries.move_to_end(key)
+                while len(self._entries) > self.maxsize:
+                    self._entries.popitem(last=False)
+                    self.evictions += 1
+        return _copy(value)
+
+    def stats(self):
+        """
+        キャッシュの統計を取得する
+
+        :return: ヒット数、ミス数、ヒット率、追い出し数、保持件数、世代番号の辞書
+        """
+        with self._lock:
+            total = self.hits + self.misses
+            return {
+                'hits': self.hits,
+                'misses': self.misses,
+                'hit_rate': self.hits / total if total else 0.0,
+                'evictions': self.evictions,
+                'size': len(self._entries),
+                'generation': self.generation,
+            }
+
+
+def _copy(value):
+    """
+    呼び出し側での変更がキャッシュに影響しないよう、DataFrameは複製して返す
+    """
+    if isinstance(value, pd.DataFrame):
+        return value.copy()
+    if isinstance(value, tuple):
+        return tuple(_copy(v) for v in value)
+    return value
+
+
+def cached_report(method):
+    """
+    読み取り系のメソッドの結果を self.cache にキャッシュするデコレータ
+    位置引数とキーワード引数の違いや既定値の省略は同じキーにまとめる
+    """
+    signature = inspect.signature(method)
+
+    @functools.wraps(method)
+    def wrapper(self, *args, **kwargs):
+        bound = signature.bind(self, *args, **kwargs)
+        bound.apply_defaults()
+        key = (method.__name__,) + tuple(bound.arguments.items())[1:]
+        try:
+            hash(key)
+        except TypeError:
+            # ハッシュできない引数（リストなど）の場合はキャッシュしない
+            return method(self, *args, **kwargs)
+        return self.cache.get_or_compute(key, self.conn, lambda: method(self, *args, **kwargs))
+    return wrapper
+
+
+def invalidates_cache(method):
+    """
+    書き込み系のメソッドの実行後に self.cache を無効にするデコレータ
+    """
+    @functools.wraps(method)
+    def wrapper(self, *args, **kwargs):
+        try:
+            return method(self, *args, **kwargs)
+        finally:
+            self.cache.bump()
+    return wrapper
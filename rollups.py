@@ -0,0 +1,211 @@
+"""
+期間ごと（日次・週次・月次）のロールアップ
+茶葉の種類・品質評価ごとに、期間内の生産量・出荷量と期末在庫を集計する
+
+書き込みのたびに変更された最も古い日付だけを記録しておき、更新時はその日を含む期間から後ろだけを再計算する
+期末在庫は直前の期間の期末在庫に、期間ごとの生産量から出荷量を引いた値を累積して求める
+（在庫データは生産量から出荷量を差し引いて更新されるため、在庫テーブルの合計と一致する）
+
+compute_rollups はデータベースに依存しない計算部分で、tea_production.rollups（Django）からも使う
+"""
+import numpy as np
+import pandas as pd
+
+# 期間の名前と pandas の頻度（週は月曜始まり）
+PERIODS = {
+    'day': 'D',
+    'week': 'W-SUN',
+    'month': 'M',
+}
+
+ROLLUP_COLUMNS = ['period', 'period_start', 'tea_type', 'quality_check',
+                  'produced_quantity', 'shipped_quantity', 'closing_stock']
+
+# 品質評価が未入力のロットは空文字列の品質評価として集計する
+NO_GRADE = ''
+
+
+def period_floor(date, period: str):
+    """
+    日付を含む期間の開始日を求める
+
+    :param date: 日付（文字列・date・Timestamp）
+    :param period: 期間（day, week, month）
+    :return: 期間の開始日のTimestamp
+    """
+    return pd.Period(pd.Timestamp(date), freq=PERIODS[period]).start_time
+
+
+def compute_rollups(period: str, productions: pd.DataFrame, shipments: pd.DataFrame,
+                    openings: pd.DataFrame, start, end):
+    """
+    start を含む期間から end を含む期間までのロールアップを計算する
+    茶葉の種類・品質評価と期間の2次元の配列に np.bincount で集計し、期末在庫は累積和で求める
+
+    :param period: 期間（day, week, month）
+    :param productions: start 以降の生産量 (date, tea_type, quality_check, quantity)
+    :param shipments: start 以降の出荷量 (date, tea_type, quality_check, quantity)
+    :param openings: start の直前の期間の期末在庫 (tea_type, quality_check, closing_stock)
+    :param start: 再計算する最初の日付
+    :param end: 再計算する最後の日付（生産日・出荷日の最大値）
+    :return: ROLLUP_COLUMNS のDataFrame（各茶葉の種類・品質評価について、期間を欠かさず並べる）
+    """
+    freq = PERIODS[period]
+    first = pd.Period(pd.Timestamp(start), freq=freq)
+    last = pd.Period(pd.Timestamp(end), freq=freq)
+    if last < first:
+        return pd.DataFrame(columns=ROLLUP_COLUMNS)
+    periods = pd.period_range(first, last, freq=freq)
+
+    frames = [df[['tea_type', 'quality_check']] for df in (openings, productions, shipments) if not df.empty]
+    if not frames:
+        return pd.DataFrame(columns=ROLLUP_COLUMNS)
+    keys = pd.concat(frames).fillna(NO_GRADE).drop_duplicates().sort_values(['tea_type', 'quality_check'])
+    key_index = pd.MultiIndex.from_frame(keys)
+    shape = (len(key_index), len(periods))
+
+    def totals(df):
+        if df.empty:
+            return np.zeros(shape)
+        key_codes = key_index.get_indexer(pd.MultiIndex.from_frame(
+            df[['tea_type', 'quality_check']].fillna(NO_GRADE)))
+        period_codes = pd.PeriodIndex(pd.to_datetime(df['date']), freq=freq).asi8 - first.ordinal
+        flat = key_codes * len(periods) + period_codes
+        return np.bincount(flat, weights=df['quantity'].astype(float).to_numpy(),
+                           minlength=shape[0] * shape[1]).reshape(shape)
+
+    produced = totals(productions)
+    shipped = totals(shipments)
+    opening = np.zeros(len(key_index))
+    if not openings.empty:
+        codes = key_index.get_indexer(pd.MultiIndex.from_frame(
+            openings[['tea_type', 'quality_check']].fillna(NO_GRADE)))
+        opening[codes] = openings['closing_stock'].astype(float).to_numpy()
+    closing = opening[:, None] + np.cumsum(produced - shipped, axis=1)
+
+    return pd.DataFrame({
+        'period': period,
+        'period_start': np.tile(periods.start_time, len(key_index)),
+        'tea_type': np.repeat(keys['tea_type'].to_numpy(), len(periods)),
+        'quality_check': np.repeat(keys['quality_check'].to_numpy(), len(periods)),
+        'produced_quantity': produced.ravel().round(2),
+        'shipped_quantity': shipped.ravel().round(2),
+        'closing_stock': closing.ravel().round(2),
+    }, columns=ROLLUP_COLUMNS)
+
+
+def _sqlite_openings(conn, period, start):
+    """
+    start の直前の期間の期末在庫を period_rollup から読む
+    """
+    return pd.read_sql_query('''
+        SELECT tea_type, quality_check, closing_stock
+        FROM period_rollup
+        WHERE period = :period
+          AND period_start = (
+              SELECT MAX(period_start) FROM period_rollup
+              WHERE period = :period AND period_start < :start
+          )
+    ''', conn, params={'period': period, 'start': start})
+
+
+def _sqlite_movements(conn, start):
+    """
+    start 以降の日ごとの生産量と出荷量を茶葉の種類・品質評価ごとに読む
+    """
+    productions = pd.read_sql_query('''
+        SELECT production_date AS date, tea_type, quality_check, SUM(quantity) AS quantity
+        FROM production
+        WHERE production_date >= ?
+        GROUP BY production_date, tea_type, quality_check
+    ''', conn, params=(start,))
+    shipments = pd.read_sql_query('''
+        SELECT s.shipment_date AS date, p.tea_type, p.quality_check, SUM(s.quantity) AS quantity
+        FROM shipment s
+        JOIN production p ON s.production_id = p.id
+        WHERE s.shipment_date >= ?
+        GROUP BY s.shipment_date, p.tea_type, p.quality_check
+    ''', conn, params=(start,))
+    return productions, shipments
+
+
+def _has_new_keys(conn, period, productions, shipments):
+    """
+    period_rollup にまだない茶葉の種類・品質評価が含まれるかどうか
+    """
+    known = set(conn.execute(
+        'SELECT DISTINCT tea_type, quality_check FROM period_rollup WHERE period = ?', (period,)))
+    keys = pd.concat([productions, shipments])[['tea_type', 'quality_check']].fillna(NO_GRADE)
+    return not set(keys.itertuples(index=False, name=None)) <= known
+
+
+def refresh_sqlite(conn, full: bool = False):
+    """
+    database.py のスキーマの period_rollup を、変更された最も古い日付を含む期間から更新する
+    書き込みロックを取ってから読むため、更新中の書き込みが取りこぼされることはない
+
+    :param conn: データベース接続オブジェクト
+    :param full: Trueの場合は全期間を作り直す
+    :return: 書き込んだ行数（更新が不要な場合は0）
+    """
+    if not conn.in_transaction:
+        conn.execute('BEGIN IMMEDIATE')
+    try:
+        dirty_since, clean = conn.execute(
+            'SELECT dirty_since, clean FROM period_rollup_state WHERE id = 1').fetchone()
+        if full:
+            dirty_since, clean = None, False
+        if clean:
+            conn.rollback()
+            return 0
+        first_date, end = conn.execute('''
+            SELECT MIN(d), MAX(d) FROM (
+                SELECT MIN(production_date) AS d FROM production
+                UNION ALL SELECT MAX(production_date) FROM production
+                UNION ALL SELECT MIN(shipment_date) FROM shipment
+                UNION ALL SELECT MAX(shipment_date) FROM shipment
+            )
+        ''').fetchone()
+
+        written = 0
+        for period in PERIODS:
+            since = dirty_since or first_date
+            if since is None:
+                conn.execute('DELETE FROM period_rollup WHERE period = ?', (period,))
+                continue
+            start = period_floor(since, period).strftime('%Y-%m-%d')
+            productions, shipments = _sqlite_movements(conn, start)
+            rebuild = since == first_date
+            if not rebuild and _has_new_keys(conn, period, productions, shipments):
+                # 新しい茶葉の種類・品質評価は、全期間に行をそろえるため最初から作り直す
+                rebuild = True
+                start = period_floor(first_date, period).strftime('%Y-%m-%d')
+                productions, shipments = _sqlite_movements(conn, start)
+            if rebuild:
+                # 最初の日付が後ろにずれた場合に、それより前の期間の行が残らないようにすべて削除する
+                conn.execute('DELETE FROM period_rollup WHERE period = ?', (period,))
+                openings = pd.DataFrame(columns=['tea_type', 'quality_check', 'closing_stock'])
+            else:
+                openings = _sqlite_openings(conn, period, start)
+                # 最新の生産・出荷データが削除された場合は、最後の日付より後の期間の行も削除する
+                last_start = period_floor(end, period).strftime('%Y-%m-%d')
+                conn.execute('DELETE FROM period_rollup WHERE period = ? AND (period_start >= ? OR period_start > ?)',
+                             (period, start, last_start))
+            rollups = compute_rollups(period, productions, shipments, openings, start, end)
+            if rollups.empty:
+                # 最新の生産・出荷データが削除されると、再計算する期間がなくなる
+                continue
+
+            rollups['period_start'] = rollups['period_start'].dt.strftime('%Y-%m-%d')
+            conn.executemany(f'''
+                INSERT INTO period_rollup ({', '.join(ROLLUP_COLUMNS)})
+                VALUES ({', '.join('?' * len(ROLLUP_COLUMNS))})
+            ''', rollups.itertuples(index=False, name=None))
+            written += len(rollups)
+
+        conn.execute('UPDATE period_rollup_state SET dirty_since = NULL, clean = 1 WHERE id = 1')
+        conn.commit()
+    except Exception:
+        conn.rollback()
+        raise
+    return written
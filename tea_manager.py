@@ -1,6 +1,139 @@
 from datetime import datetime
 import pandas as pd
-from database import create_connection
+from allocation import LotIndex
+from database import ConnectionPool, migrate
+from exporter import DEFAULT_CHUNK_SIZE, export_tables
+from ledger import ensure_snapshots, stock_as_of
+from report_cache import ReportCache, cached_report, invalidates_cache
+from rollups import PERIODS, period_floor, refresh_sqlite
+
+# SQLiteの1文あたりのバインド変数の上限（古いSQLiteの既定値に合わせる）
+_SQL_VARIABLE_LIMIT = 999
+
+# 茶葉の種類ごとのサマリー（トリガーで更新されるロールアップテーブルから読む）
+_SUMMARY_QUERY = '''
+    SELECT
+        tea_type,
+        total_productions,
+        total_production_quantity,
+        total_shipments,
+        total_shipment_quantity,
+        current_stock,
+        quality_a_count * 100.0 / total_productions as quality_a_percentage
+    FROM tea_type_summary
+    WHERE total_productions > 0
+    ORDER BY tea_type
+'''
+
+# 引き当て用の索引に読み込む在庫のあるロット（生産データIDが指定より大きいもの）
+_IN_STOCK_LOTS_QUERY = '''
+    SELECT p.id, p.tea_type, p.quality_check, p.production_date
+    FROM production p
+    JOIN inventory i ON i.production_id = p.id
+    WHERE p.id > ? AND i.quantity > 0
+'''
+
+# 引き当て時に読む1ロットの現在の在庫と生産データ
+_LOT_QUERY = '''
+    SELECT i.quantity, p.tea_type, p.quality_check, p.production_date
+    FROM inventory i
+    JOIN production p ON p.id = i.production_id
+    WHERE i.production_id = ?
+'''
+
+# 引き当ての索引の版（在庫がなくなったロットの在庫が戻るとトリガーで増える）
+_LOT_INDEX_VERSION_QUERY = 'SELECT restocks FROM lot_index_state WHERE id = 1'
+
+# ページ単位で取得する履歴の既定の行数
+DEFAULT_PAGE_SIZE = 100
+
+def _where(conditions):
+    """
+    条件のリストからWHERE句を組み立てる
+
+    :param conditions: 条件式のリスト
+    :return: WHERE句（条件がなければ空文字列）
+    """
+    return f"WHERE {' AND '.join(conditions)}" if conditions else ''
+
+def _shipment_filters(start_date=None, end_date=None, customer_name=None, tea_type=None):
+    """
+    出荷履歴の絞り込み条件とパラメータを組み立てる
+
+    :return: (条件式のリスト, パラメータのリスト)
+    """
+    conditions, params = [], []
+    if start_date:
+        conditions.append('s.shipment_date >= ?')
+        params.append(start_date)
+    if end_date:
+        conditions.append('s.shipment_date <= ?')
+        params.append(end_date)
+    if customer_name:
+        conditions.append('s.customer_name = ?')
+        params.append(customer_name)
+    if tea_type:
+        conditions.append('p.tea_type = ?')
+        params.append(tea_type)
+    return conditions, params
+
+def _production_filters(start_date=None, end_date=None, tea_type=None):
+    """
+    生産データの絞り込み条件とパラメータを組み立てる
+
+    :return: (条件式のリスト, パラメータのリスト)
+    """
+    conditions, params = [], []
+    if start_date:
+        conditions.append('p.production_date >= ?')
+        params.append(start_date)
+    if end_date:
+        conditions.append('p.production_date <= ?')
+        params.append(end_date)
+    if tea_type:
+        conditions.append('p.tea_type = ?')
+        params.append(tea_type)
+    return conditions, params
+
+def _next_cursor(df, date_column, page_size):
+    """
+    ページの最後の行から次ページのカーソルを作る
+
+    :return: (日付, ID)。最後のページの場合はNone
+    """
+    if len(df) < page_size:
+        return None
+    last = df.iloc[-1]
+    return last[date_column], int(last['id'])
+
+def _iter_records(rows):
+    """
+    一括処理の入力を辞書の反復に変換する
+
+    :param rows: 辞書の反復可能オブジェクトまたはDataFrame
+    :return: 各行の辞書を返すイテレータ
+    """
+    if isinstance(rows, pd.DataFrame):
+        # 日付・日時の列は YYYY-MM-DD の文字列にする（sqlite3 は Timestamp を書き込めない）
+        dates = [column for column in rows.columns
+                 if pd.api.types.is_datetime64_any_dtype(rows[column])
+                 or pd.api.types.infer_dtype(rows[column], skipna=True) in ('date', 'datetime')]
+        if dates:
+            rows = rows.copy()
+            for column in dates:
+                rows[column] = pd.to_datetime(rows[column]).dt.strftime('%Y-%m-%d')
+        # NaNはNoneとして扱う
+        rows = rows.astype(object).where(rows.notna(), None).to_dict('records')
+    return iter(rows)
+
+def _begin_immediate(conn):
+    """
+    書き込みロックを取得してトランザクションを開始する
+
+    :param conn: データベース接続オブジェクト
+    """
+    if not conn.in_transaction:
+        conn.execute('BEGIN IMMEDIATE')
 
 class TeaProductionManager:
     """
@@ -8,13 +141,33 @@ class TeaProductionManager:
     生産、出荷、在庫管理の機能を提供する
     """
     
-    def __init__(self):
+    def __init__(self, db_file: str = None, pool: ConnectionPool = None,
+                 cache_size: int = 128, cross_process_cache: bool = False):
         """
         TeaProductionManagerの初期化
         データベース接続を確立する
+
+        :param db_file: データベースファイルのパス（省略時は既定のファイル）
+        :param pool: 共有する接続プール（省略時は専用のプールを作成する）
+        :param cache_size: レポート結果のキャッシュ件数（0の場合はキャッシュしない）
+        :param cross_process_cache: 他のプロセスからの書き込みでもキャッシュを無効にするかどうか
         """
-        self.conn = create_connection()
+        self.cache = ReportCache(cache_size, cross_process=cross_process_cache)
+        # 出荷の引き当てに使う在庫のあるロットの索引（最初の引き当て時に読み込む）
+        self.lots = LotIndex()
+        self._owns_pool = pool is None
+        self.pool = pool if pool is not None else ConnectionPool(db_file)
+        # 初期化時に接続を確立し、スキーマを最新にする
+        migrate(self.pool.get_connection())
+
+    @property
+    def conn(self):
+        """
+        現在のスレッド用のデータベース接続
+        """
+        return self.pool.get_connection()
         
+    @invalidates_cache
     def add_production(self, tea_type: str, quantity: float, production_date: str = None, quality_check: str = None):
         """
         新しい生産データを追加する
@@ -44,6 +197,7 @@ class TeaProductionManager:
         self.conn.commit()
         return production_id
         
+    @invalidates_cache
     def record_shipment(self, production_id: int, quantity: float, customer_name: str,
                        shipment_date: str = None, customer_contact: str = None):
         """
@@ -60,31 +214,211 @@ class TeaProductionManager:
             shipment_date = datetime.now().strftime('%Y-%m-%d')
             
         cursor = self.conn.cursor()
-        
-        # 在庫チェック
-        cursor.execute('SELECT quantity FROM inventory WHERE production_id = ?', (production_id,))
-        current_stock = cursor.fetchone()
-        
-        if not current_stock or current_stock[0] < quantity:
-            raise ValueError("在庫が不足しています")
+        try:
+            # 在庫チェックと引き当てを1文で行い、同時出荷による売り越しを防ぐ
+            cursor.execute('''
+                UPDATE inventory
+                SET quantity = quantity - ?,
+                    last_updated = CURRENT_TIMESTAMP
+                WHERE production_id = ? AND quantity >= ?
+            ''', (quantity, production_id, quantity))
+            if cursor.rowcount == 0:
+                raise ValueError("在庫が不足しています")
+                
+            # 出荷データを記録
+            cursor.execute('''
+                INSERT INTO shipment (production_id, shipment_date, quantity, customer_name, customer_contact)
+                VALUES (?, ?, ?, ?, ?)
+            ''', (production_id, shipment_date, quantity, customer_name, customer_contact))
             
-        # 出荷データを記録
-        cursor.execute('''
-            INSERT INTO shipment (production_id, shipment_date, quantity, customer_name, customer_contact)
-            VALUES (?, ?, ?, ?, ?)
-        ''', (production_id, shipment_date, quantity, customer_name, customer_contact))
-        
-        # 在庫を更新
-        cursor.execute('''
-            UPDATE inventory
-            SET quantity = quantity - ?,
-                last_updated = CURRENT_TIMESTAMP
-            WHERE production_id = ?
-        ''', (quantity, production_id))
-        
-        self.conn.commit()
+            self.conn.commit()
+        except Exception:
+            self.conn.rollback()
+            raise
         return cursor.lastrowid
+
+    @invalidates_cache
+    def allocate_shipment(self, tea_type: str, quality_check: str, quantity: float, customer_name: str,
+                          shipment_date: str = None, customer_contact: str = None):
+        """
+        注文量を茶葉の種類・品質評価が一致するロットから生産日の古い順に引き当て、ロットごとに出荷データを記録する
+        引き当てと記録は1トランザクションで行い、在庫が足りない場合は何も記録しない
         
+        :param tea_type: 茶葉の種類
+        :param quality_check: 品質評価
+        :param quantity: 注文量
+        :param customer_name: 顧客名
+        :param shipment_date: 出荷日 (YYYY-MM-DD)
+        :param customer_contact: 顧客連絡先
+        :return: 記録した出荷の [(出荷データID, 生産データID, 出荷量)]（生産日の古い順）
+        """
+        if shipment_date is None:
+            shipment_date = datetime.now().strftime('%Y-%m-%d')
+
+        conn = self.conn
+        cursor = conn.cursor()
+        try:
+            # 書き込みロックを取ってから在庫を読むため、引き当てたロットが他の出荷で減ることはない
+            _begin_immediate(conn)
+            allocations = self.lots.allocate(
+                tea_type, quality_check, quantity,
+                load_lots=lambda after_id: conn.execute(_IN_STOCK_LOTS_QUERY, (after_id,)),
+                read_lot=lambda production_id: conn.execute(_LOT_QUERY, (production_id,)).fetchone(),
+                version=conn.execute(_LOT_INDEX_VERSION_QUERY).fetchone()[0],
+            )
+            shipments = []
+            for production_id, lot_quantity in allocations:
+                cursor.execute('''
+                    UPDATE inventory
+                    SET quantity = quantity - ?,
+                        last_updated = CURRENT_TIMESTAMP
+                    WHERE production_id = ?
+                ''', (lot_quantity, production_id))
+                cursor.execute('''
+                    INSERT INTO shipment (production_id, shipment_date, quantity, customer_name, customer_contact)
+                    VALUES (?, ?, ?, ?, ?)
+                ''', (production_id, shipment_date, lot_quantity, customer_name, customer_contact))
+                shipments.append((cursor.lastrowid, production_id, lot_quantity))
+            conn.commit()
+        except ValueError:
+            # 在庫不足は索引を変更しない
+            conn.rollback()
+            raise
+        except Exception:
+            conn.rollback()
+            self.lots.invalidate()
+            raise
+        return shipments
+
+    @invalidates_cache
+    def add_productions_bulk(self, rows):
+        """
+        生産データを一括で追加する
+        全行を1トランザクションで書き込み、在庫データも同じバッチで作成する
+
+        :param rows: 生産データの反復可能オブジェクトまたはDataFrame
+                     (tea_type, quantity, production_date, quality_check, quality_notes)
+        :return: 追加された生産データのIDのリスト
+        """
+        today = datetime.now().strftime('%Y-%m-%d')
+        params = [
+            (row['tea_type'],
+             row.get('production_date') or today,
+             row['quantity'],
+             row.get('quality_check'),
+             row.get('quality_notes'))
+            for row in _iter_records(rows)
+        ]
+        if not params:
+            return []
+
+        cursor = self.conn.cursor()
+        try:
+            _begin_immediate(self.conn)
+            cursor.execute('SELECT COALESCE(MAX(id), 0) FROM production')
+            last_id = cursor.fetchone()[0]
+
+            cursor.executemany('''
+                INSERT INTO production (tea_type, production_date, quantity, quality_check, quality_notes)
+                VALUES (?, ?, ?, ?, ?)
+            ''', params)
+
+            # 在庫テーブルも同じトランザクションで作成
+            cursor.execute('''
+                INSERT INTO inventory (production_id, quantity)
+                SELECT id, quantity FROM production WHERE id > ?
+                ORDER BY id
+            ''', (last_id,))
+
+            cursor.execute('SELECT id FROM production WHERE id > ? ORDER BY id', (last_id,))
+            production_ids = [r[0] for r in cursor.fetchall()]
+            self.conn.commit()
+        except Exception:
+            self.conn.rollback()
+            raise
+        return production_ids
+
+    @invalidates_cache
+    def record_shipments_bulk(self, rows):
+        """
+        出荷データを一括で記録する
+        在庫チェックはバッチ内でまとめて行い、在庫が不足する行だけを失敗として返す
+
+        :param rows: 出荷データの反復可能オブジェクトまたはDataFrame
+                     (production_id, quantity, customer_name, shipment_date, customer_contact)
+        :return: (追加された出荷データのIDのリスト, 失敗した行のリスト)
+                 失敗した行は {'row': 行番号, 'production_id': ..., 'quantity': ..., 'reason': ...} の辞書
+        """
+        today = datetime.now().strftime('%Y-%m-%d')
+        records = list(_iter_records(rows))
+        if not records:
+            return [], []
+
+        cursor = self.conn.cursor()
+        try:
+            _begin_immediate(self.conn)
+
+            # 対象ロットの在庫をまとめて取得
+            stock = {}
+            production_ids = list({row['production_id'] for row in records})
+            for start in range(0, len(production_ids), _SQL_VARIABLE_LIMIT):
+                chunk = production_ids[start:start + _SQL_VARIABLE_LIMIT]
+                placeholders = ','.join('?' * len(chunk))
+                cursor.execute(
+                    f'SELECT production_id, quantity FROM inventory WHERE production_id IN ({placeholders})',
+                    chunk
+                )
+                stock.update(cursor.fetchall())
+
+            # 行の順に在庫を引き当てる
+            shipments = []
+            decrements = {}
+            failed = []
+            for index, row in enumerate(records):
+                production_id = row['production_id']
+                quantity = row['quantity']
+                if production_id not in stock:
+                    failed.append({'row': index, 'production_id': production_id,
+                                   'quantity': quantity, 'reason': '在庫データがありません'})
+                    continue
+                if stock[production_id] < quantity:
+                    failed.append({'row': index, 'production_id': production_id,
+                                   'quantity': quantity, 'reason': '在庫が不足しています'})
+                    continue
+
+                stock[production_id] -= quantity
+                decrements[production_id] = decrements.get(production_id, 0) + quantity
+                shipments.append((production_id,
+                                  row.get('shipment_date') or today,
+                                  quantity,
+                                  row['customer_name'],
+                                  row.get('customer_contact')))
+
+            cursor.execute('SELECT COALESCE(MAX(id), 0) FROM shipment')
+            last_id = cursor.fetchone()[0]
+
+            cursor.executemany('''
+                INSERT INTO shipment (production_id, shipment_date, quantity, customer_name, customer_contact)
+                VALUES (?, ?, ?, ?, ?)
+            ''', shipments)
+
+            # 在庫はロットごとに集計して1回ずつ更新
+            cursor.executemany('''
+                UPDATE inventory
+                SET quantity = quantity - ?,
+                    last_updated = CURRENT_TIMESTAMP
+                WHERE production_id = ?
+            ''', [(quantity, production_id) for production_id, quantity in decrements.items()])
+
+            cursor.execute('SELECT id FROM shipment WHERE id > ? ORDER BY id', (last_id,))
+            shipment_ids = [r[0] for r in cursor.fetchall()]
+            self.conn.commit()
+        except Exception:
+            self.conn.rollback()
+            raise
+        return shipment_ids, failed
+
+    @cached_report
     def get_inventory_report(self):
         """
         現在の在庫状況レポートを取得する
@@ -104,15 +438,20 @@ class TeaProductionManager:
         '''
         return pd.read_sql_query(query, self.conn)
         
-    def get_shipment_history(self, start_date: str = None, end_date: str = None):
+    @cached_report
+    def get_shipment_history(self, start_date: str = None, end_date: str = None,
+                             customer_name: str = None, tea_type: str = None):
         """
         出荷履歴を取得する
         
         :param start_date: 開始日 (YYYY-MM-DD)
         :param end_date: 終了日 (YYYY-MM-DD)
+        :param customer_name: 顧客名
+        :param tea_type: 茶葉の種類
         :return: 出荷履歴のDataFrame
         """
-        query = '''
+        conditions, params = _shipment_filters(start_date, end_date, customer_name, tea_type)
+        query = f'''
             SELECT 
                 s.shipment_date,
                 p.tea_type,
@@ -121,13 +460,70 @@ class TeaProductionManager:
                 s.customer_contact
             FROM shipment s
             JOIN production p ON s.production_id = p.id
+            {_where(conditions)}
         '''
+        return pd.read_sql_query(query, self.conn, params=params)
+
+    @cached_report
+    def get_shipment_history_page(self, start_date: str = None, end_date: str = None,
+                                  customer_name: str = None, tea_type: str = None,
+                                  after: tuple = None, page_size: int = DEFAULT_PAGE_SIZE):
+        """
+        出荷履歴を (出荷日, ID) 順に1ページ分取得する
+        OFFSETを使わず前ページの最後の行の続きから読むため、深いページでも速度が落ちない
         
-        if start_date and end_date:
-            query += f" WHERE s.shipment_date BETWEEN '{start_date}' AND '{end_date}'"
-            
-        return pd.read_sql_query(query, self.conn)
+        :param start_date: 開始日 (YYYY-MM-DD)
+        :param end_date: 終了日 (YYYY-MM-DD)
+        :param customer_name: 顧客名
+        :param tea_type: 茶葉の種類
+        :param after: 前ページの最後の行の (出荷日, ID)。Noneの場合は先頭から
+        :param page_size: 1ページの行数
+        :return: (出荷履歴のDataFrame, 次ページのカーソル。最後のページではNone)
+        """
+        conditions, params = _shipment_filters(start_date, end_date, customer_name, tea_type)
+        if after is not None:
+            conditions.append('(s.shipment_date, s.id) > (?, ?)')
+            params.extend(after)
+        query = f'''
+            SELECT 
+                s.id,
+                s.shipment_date,
+                p.tea_type,
+                s.quantity,
+                s.customer_name,
+                s.customer_contact
+            FROM shipment s
+            JOIN production p ON s.production_id = p.id
+            {_where(conditions)}
+            ORDER BY s.shipment_date, s.id
+            LIMIT ?
+        '''
+        df = pd.read_sql_query(query, self.conn, params=params + [page_size])
+        return df, _next_cursor(df, 'shipment_date', page_size)
+
+    def iter_shipment_history(self, start_date: str = None, end_date: str = None,
+                              customer_name: str = None, tea_type: str = None,
+                              page_size: int = DEFAULT_PAGE_SIZE):
+        """
+        出荷履歴をページごとに順に返す
+        
+        :param start_date: 開始日 (YYYY-MM-DD)
+        :param end_date: 終了日 (YYYY-MM-DD)
+        :param customer_name: 顧客名
+        :param tea_type: 茶葉の種類
+        :param page_size: 1ページの行数
+        :return: 出荷履歴のDataFrameを1ページずつ返すジェネレータ
+        """
+        after = None
+        while True:
+            df, after = self.get_shipment_history_page(
+                start_date, end_date, customer_name, tea_type, after=after, page_size=page_size)
+            if not df.empty:
+                yield df
+            if after is None:
+                return
         
+    @invalidates_cache
     def update_quality_check(self, production_id: int, quality_check: str, notes: str = None):
         """
         品質チェック結果を更新する
@@ -146,17 +542,22 @@ class TeaProductionManager:
         ''', (quality_check, notes, production_id))
         
         self.conn.commit()
+        # 品質評価が変わったロットは引き当ての索引で別の分類になる
+        self.lots.invalidate()
         return cursor.rowcount
         
-    def get_quality_report(self, start_date: str = None, end_date: str = None):
+    @cached_report
+    def get_quality_report(self, start_date: str = None, end_date: str = None, tea_type: str = None):
         """
         品質チェック結果のレポートを取得する
         
         :param start_date: 開始日 (YYYY-MM-DD)
         :param end_date: 終了日 (YYYY-MM-DD)
+        :param tea_type: 茶葉の種類
         :return: 品質チェック結果のDataFrame
         """
-        query = '''
+        conditions, params = _production_filters(start_date, end_date, tea_type)
+        query = f'''
             SELECT 
                 p.production_date,
                 p.tea_type,
@@ -166,56 +567,179 @@ class TeaProductionManager:
                 i.quantity as current_stock
             FROM production p
             LEFT JOIN inventory i ON p.id = i.production_id
+            {_where(conditions)}
         '''
+        return pd.read_sql_query(query, self.conn, params=params)
+
+    @cached_report
+    def get_quality_report_page(self, start_date: str = None, end_date: str = None, tea_type: str = None,
+                                after: tuple = None, page_size: int = DEFAULT_PAGE_SIZE):
+        """
+        品質チェック結果を (生産日, ID) 順に1ページ分取得する
         
-        if start_date and end_date:
-            query += f" WHERE p.production_date BETWEEN '{start_date}' AND '{end_date}'"
-            
-        return pd.read_sql_query(query, self.conn)
+        :param start_date: 開始日 (YYYY-MM-DD)
+        :param end_date: 終了日 (YYYY-MM-DD)
+        :param tea_type: 茶葉の種類
+        :param after: 前ページの最後の行の (生産日, ID)。Noneの場合は先頭から
+        :param page_size: 1ページの行数
+        :return: (品質チェック結果のDataFrame, 次ページのカーソル。最後のページではNone)
+        """
+        conditions, params = _production_filters(start_date, end_date, tea_type)
+        if after is not None:
+            conditions.append('(p.production_date, p.id) > (?, ?)')
+            params.extend(after)
+        query = f'''
+            SELECT 
+                p.id,
+                p.production_date,
+                p.tea_type,
+                p.quantity,
+                p.quality_check,
+                p.quality_notes,
+                i.quantity as current_stock
+            FROM production p
+            LEFT JOIN inventory i ON p.id = i.production_id
+            {_where(conditions)}
+            ORDER BY p.production_date, p.id
+            LIMIT ?
+        '''
+        df = pd.read_sql_query(query, self.conn, params=params + [page_size])
+        return df, _next_cursor(df, 'production_date', page_size)
+
+    def iter_quality_report(self, start_date: str = None, end_date: str = None, tea_type: str = None,
+                            page_size: int = DEFAULT_PAGE_SIZE):
+        """
+        品質チェック結果をページごとに順に返す
+        
+        :param start_date: 開始日 (YYYY-MM-DD)
+        :param end_date: 終了日 (YYYY-MM-DD)
+        :param tea_type: 茶葉の種類
+        :param page_size: 1ページの行数
+        :return: 品質チェック結果のDataFrameを1ページずつ返すジェネレータ
+        """
+        after = None
+        while True:
+            df, after = self.get_quality_report_page(
+                start_date, end_date, tea_type, after=after, page_size=page_size)
+            if not df.empty:
+                yield df
+            if after is None:
+                return
         
-    def export_data(self, file_path: str):
+    def export_data(self, file_path: str, fmt: str = 'csv', compression: str = None,
+                    chunk_size: int = DEFAULT_CHUNK_SIZE, delta: bool = False):
         """
         データをCSVファイルにエクスポートする
+        各テーブルをチャンク単位で読み出しながら書き出し、3テーブルを並行して処理する
+        エクスポート先ごとにウォーターマークを記録し、実行ごとのマニフェスト（manifest_<日時>.json）を書き出す
+        manifest.json は最後の全件エクスポートのマニフェストで、差分エクスポートでは上書きしない
         
         :param file_path: エクスポート先のファイルパス
+        :param fmt: 出力形式（csv または parquet）
+        :param compression: 圧縮形式（None, gzip, zstd）
+        :param chunk_size: 1回に読み出す行数
+        :param delta: Trueの場合は前回のエクスポート以降に追加・更新された行だけを書き出す
+        :return: {テーブル名: (ファイルパス, 行数)}
         """
-        # 生産データのエクスポート
-        production_df = pd.read_sql_query('SELECT * FROM production', self.conn)
-        production_df.to_csv(f"{file_path}/production.csv", index=False)
-        
-        # 出荷データのエクスポート
-        shipment_df = pd.read_sql_query('SELECT * FROM shipment', self.conn)
-        shipment_df.to_csv(f"{file_path}/shipment.csv", index=False)
-        
-        # 在庫データのエクスポート
-        inventory_df = pd.read_sql_query('SELECT * FROM inventory', self.conn)
-        inventory_df.to_csv(f"{file_path}/inventory.csv", index=False)
+        return export_tables(self.pool.db_file, file_path, fmt=fmt, compression=compression,
+                             chunk_size=chunk_size, delta=delta)
         
+    @cached_report
     def get_summary_report(self):
         """
         生産、出荷、在庫のサマリーレポートを取得する
+        集計値は書き込みと同じトランザクションでトリガーが更新する tea_type_summary から読む
         
         :return: サマリーレポートのDataFrame
         """
-        query = '''
-            SELECT 
-                p.tea_type,
-                COUNT(DISTINCT p.id) as total_productions,
-                SUM(p.quantity) as total_production_quantity,
-                COUNT(DISTINCT s.id) as total_shipments,
-                SUM(s.quantity) as total_shipment_quantity,
-                SUM(i.quantity) as current_stock,
-                AVG(CASE WHEN p.quality_check = 'A級' THEN 1 ELSE 0 END) * 100 as quality_a_percentage
-            FROM production p
-            LEFT JOIN shipment s ON p.id = s.production_id
-            LEFT JOIN inventory i ON p.id = i.production_id
-            GROUP BY p.tea_type
+        return pd.read_sql_query(_SUMMARY_QUERY, self.conn)
+
+    def create_stock_snapshots(self, until: str = None):
+        """
+        指定日以前の期末（四半期末）のうち、まだないロットごとの在庫のスナップショットを作る
+        定期的に呼んでおくと、get_stock_as_of が読む台帳の範囲が1期分に収まる
+        
+        :param until: この日以前の期末まで作る（省略時は今日）
+        :return: 作成したスナップショットの数
+        """
+        return ensure_snapshots(self.conn, until or datetime.now().strftime('%Y-%m-%d'))
+
+    def get_stock_as_of(self, as_of_date: str, tea_type: str = None, quality_check: str = None):
+        """
+        指定日の終わり時点のロットごとの在庫を取得する
+        指定日以前の最も近いスナップショットと、その後の台帳だけを読む（足りないスナップショットは先に作る）
+        
+        :param as_of_date: 日付 (YYYY-MM-DD)
+        :param tea_type: 茶葉の種類
+        :param quality_check: 品質評価
+        :return: 在庫のあるロットのDataFrame (production_id, tea_type, quality_check, production_date, quantity)
+        """
+        self.create_stock_snapshots(as_of_date)
+        return self._get_stock_as_of(as_of_date, tea_type, quality_check)
+
+    @cached_report
+    def _get_stock_as_of(self, as_of_date, tea_type, quality_check):
+        """
+        スナップショットと台帳から指定日の在庫を読む（get_stock_as_of のスナップショット作成後の読み取り部分）
+        """
+        return stock_as_of(self.conn, as_of_date, tea_type, quality_check)
+
+    def refresh_period_rollups(self, full: bool = False):
+        """
+        期間ごとのロールアップを、前回の更新以降に変更された最も古い日付を含む期間から再計算する
+        
+        :param full: Trueの場合は全期間を作り直す
+        :return: 書き込んだ行数（更新が不要な場合は0）
+        """
+        return refresh_sqlite(self.conn, full=full)
+
+    def get_period_rollup(self, period: str = 'month', start_date: str = None, end_date: str = None,
+                          tea_type: str = None, quality_check: str = None):
+        """
+        茶葉の種類・品質評価ごとの期間別の生産量・出荷量・期末在庫を取得する
+        未反映の書き込みがあれば、先にロールアップを更新する
+        
+        :param period: 期間（day, week, month）
+        :param start_date: 開始日 (YYYY-MM-DD)。この日を含む期間から
+        :param end_date: 終了日 (YYYY-MM-DD)
+        :param tea_type: 茶葉の種類
+        :param quality_check: 品質評価（未入力のロットは空文字列）
+        :return: ロールアップのDataFrame
+        """
+        if period not in PERIODS:
+            raise ValueError(f"期間は {', '.join(PERIODS)} のいずれかを指定してください: {period}")
+        self.refresh_period_rollups()
+        return self._get_period_rollup(period, start_date, end_date, tea_type, quality_check)
+
+    @cached_report
+    def _get_period_rollup(self, period, start_date, end_date, tea_type, quality_check):
+        """
+        period_rollup から条件に合う行を読む（get_period_rollup の更新後の読み取り部分）
+        """
+        conditions, params = ['period = ?'], [period]
+        if start_date:
+            conditions.append('period_start >= ?')
+            params.append(period_floor(start_date, period).strftime('%Y-%m-%d'))
+        if end_date:
+            conditions.append('period_start <= ?')
+            params.append(end_date)
+        if tea_type:
+            conditions.append('tea_type = ?')
+            params.append(tea_type)
+        if quality_check is not None:
+            conditions.append('quality_check = ?')
+            params.append(quality_check)
+        query = f'''
+            SELECT period_start, tea_type, quality_check, produced_quantity, shipped_quantity, closing_stock
+            FROM period_rollup
+            {_where(conditions)}
+            ORDER BY period_start, tea_type, quality_check
         '''
-        return pd.read_sql_query(query, self.conn)
+        return pd.read_sql_query(query, self.conn, params=params)
         
     def __del__(self):
         """
         デストラクタ：データベース接続を閉じる
         """
-        if self.conn:
-            self.conn.close() 
\ No newline at end of file
+        if getattr(self, '_owns_pool', False):
+            self.pool.close_all() 
\ No newline at end of file
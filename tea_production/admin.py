@@ -1,23 +1,38 @@
 from django.contrib import admin
 from .models import Production, Shipment, Inventory
+from .pagination import EstimatedCountPaginator
+
+# 件数の多い一覧で全件の COUNT(*) を避ける共通設定
+# （絞り込み時の「全 N 件」表示をやめ、絞り込みのない一覧の件数は見積もりにする）
+class LargeTableAdmin(admin.ModelAdmin):
+    paginator = EstimatedCountPaginator
+    show_full_result_count = False
 
 @admin.register(Production)
-class ProductionAdmin(admin.ModelAdmin):
+class ProductionAdmin(LargeTableAdmin):
     list_display = ('tea_type', 'production_date', 'quantity', 'quality_check', 'created_at')
     list_filter = ('tea_type', 'quality_check', 'production_date')
     search_fields = ('tea_type', 'quality_notes')
     ordering = ('-production_date',)
+    date_hierarchy = 'production_date'
 
 @admin.register(Shipment)
-class ShipmentAdmin(admin.ModelAdmin):
+class ShipmentAdmin(LargeTableAdmin):
     list_display = ('production', 'shipment_date', 'quantity', 'customer_name', 'created_at')
     list_filter = ('shipment_date', 'production__tea_type')
+    list_select_related = ('production',)
     search_fields = ('customer_name', 'customer_contact')
     ordering = ('-shipment_date',)
+    date_hierarchy = 'shipment_date'
+    # 生産データの全件を選択肢に描画しないよう、IDで入力する
+    raw_id_fields = ('production',)
 
 @admin.register(Inventory)
-class InventoryAdmin(admin.ModelAdmin):
+class InventoryAdmin(LargeTableAdmin):
     list_display = ('production', 'quantity', 'last_updated')
     list_filter = ('production__tea_type',)
+    list_select_related = ('production',)
     search_fields = ('production__tea_type',)
-    ordering = ('-last_updated',) 
\ No newline at end of file
+    ordering = ('-last_updated',)
+    date_hierarchy = 'last_updated'
+    raw_id_fields = ('production',)
\ No newline at end of file
@@ -0,0 +1,95 @@
+"""
+注文量の先入れ先出しでのロット引き当て
+
+茶葉の種類・品質評価と注文量から、在庫のあるロットを生産日の古い順に選んでロットごとに出荷データを作る
+ロットの選択はプロセスごとに保持する allocation.LotIndex（ヒープ）で行い、在庫一覧の検索はしない
+"""
+from django.core.cache import cache
+from django.db import transaction
+from django.db.models import F
+from django.utils import timezone
+
+from allocation import LotIndex
+from .changes import capture_changes
+from .models import Inventory, Shipment
+
+# 在庫の差し引きが他の出荷と競合した場合に引き当てをやり直す回数
+MAX_ATTEMPTS = 3
+
+# プロセス全体で共有する索引（生産データ・在庫の変更時にシグナルで版を変えて作り直す）
+lot_index = LotIndex()
+
+# 索引の版（別のプロセスでの変更でも作り直すようにキャッシュに置く）
+LOT_INDEX_VERSION_CACHE_KEY = 'tea_production:lot_index_version'
+
+class AllocationConflict(Exception):
+    """
+    引き当てたロットの在庫が、書き込むまでの間に他の出荷で減った
+    """
+
+def bump_lot_index_version():
+    """
+    索引の版を新しくし、すべてのプロセスで次の引き当て時に索引を作り直させる
+    在庫の戻ったロットは索引から外れているため、既存のロットの在庫を変更したら呼ぶ
+    （書き込みのトランザクションの中では transaction.on_commit に渡す）
+    """
+    cache.set(LOT_INDEX_VERSION_CACHE_KEY, f'{timezone.now().timestamp():.6f}', None)
+
+def _load_lots(after_id):
+    return (Inventory.objects.filter(production_id__gt=after_id, quantity__gt=0)
+            .values_list('production_id', 'production__tea_type', 'production__quality_check',
+                         'production__production_date')
+            .order_by())
+
+def _read_lot(production_id):
+    return (Inventory.objects.filter(production_id=production_id)
+            .values_list('quantity', 'production__tea_type', 'production__quality_check',
+                         'production__production_date')
+            .first())
+
+def allocate_shipments(tea_type, quality_check, quantity, shipment_date, customer_name, customer_contact=None):
+    """
+    注文量を生産日の古いロットから順に引き当て、ロットごとに出荷データを作る
+    すべてのロットの在庫の差し引きと出荷データの作成は1トランザクションで行う
+    トランザクションは在庫の条件付きUPDATEから始め、引き当て後に他の出荷で在庫が減っていた場合はやり直す
+
+    :param tea_type: 茶葉の種類
+    :param quality_check: 品質評価
+    :param quantity: 注文量（Decimal）
+    :param shipment_date: 出荷日
+    :param customer_name: 顧客名
+    :param customer_contact: 連絡先
+    :return: 作成した Shipment のリスト（生産日の古い順）
+    :raises ValueError: 在庫が不足している場合
+    """
+    for _ in range(MAX_ATTEMPTS):
+        allocations = lot_index.allocate(tea_type, quality_check, quantity, _load_lots, _read_lot,
+                                         version=cache.get(LOT_INDEX_VERSION_CACHE_KEY))
+        try:
+            with transaction.atomic():
+                shipments = []
+                for production_id, lot_quantity in allocations:
+                    updated = Inventory.objects.filter(
+                        production_id=production_id,
+                        quantity__gte=lot_quantity,
+                    ).update(
+                        quantity=F('quantity') - lot_quantity,
+                        last_updated=timezone.now(),
+                    )
+                    if not updated:
+                        raise AllocationConflict(production_id)
+                    capture_changes('inventory', [production_id], 'update')
+                    shipments.append(Shipment.objects.create(
+                        production_id=production_id,
+                        shipment_date=shipment_date,
+                        quantity=lot_quantity,
+                        customer_name=customer_name,
+                        customer_contact=customer_contact,
+                    ))
+            return shipments
+        except AllocationConflict:
+            lot_index.invalidate()
+        except Exception:
+            lot_index.invalidate()
+            raise
+    raise ValueError("在庫の引き当てが他の出荷と競合しました。もう一度お試しください")
@@ -0,0 +1,150 @@
+import datetime
+import functools
+import hashlib
+from django.core.cache import cache
+from django.db.models import Count, Max
+from django.http import HttpResponseNotAllowed
+from django.utils import timezone
+from django.utils.cache import get_conditional_response
+from django.utils.http import http_date, quote_etag
+from .models import Shipment, Inventory
+
+DATA_VERSION_CACHE_KEY = 'tea_production:data_version'
+
+# JSON APIで返す項目（在庫と出荷は生産データの茶葉の種類・品質評価も含める）
+INVENTORY_FIELDS = ['id', 'production_id', 'production__tea_type', 'production__quality_check',
+                    'production__production_date', 'quantity', 'last_updated']
+SHIPMENT_FIELDS = ['id', 'production_id', 'production__tea_type', 'shipment_date', 'quantity',
+                   'customer_name', 'customer_contact']
+
+def _new_version():
+    return f'{timezone.now().timestamp():.6f}'
+
+def get_data_version():
+    """
+    シグナルで更新されるデータの版を取得する
+    在庫の最終更新日時と件数が変わらない変更（品質評価の修正など）もETagに反映するために使う
+    """
+    return cache.get_or_set(DATA_VERSION_CACHE_KEY, _new_version, None)
+
+async def aget_data_version():
+    """
+    get_data_version の非同期版
+    """
+    return await cache.aget_or_set(DATA_VERSION_CACHE_KEY, _new_version, None)
+
+def bump_data_version():
+    """
+    データの版を新しくする（以前のETagはすべて一致しなくなる）
+    書き込みのトランザクションの中では transaction.on_commit に渡す
+    （コミット前に変えると、新しいETag・Last-Modifiedで古いデータを返してしまうため）
+    """
+    cache.set(DATA_VERSION_CACHE_KEY, _new_version(), None)
+
+def _version_time(version):
+    """
+    データの版（更新した時刻のUNIX時間）を日時にする
+    """
+    try:
+        return datetime.datetime.fromtimestamp(float(version), tz=datetime.timezone.utc)
+    except (TypeError, ValueError):
+        return None
+
+def _make_validators(stats, shipment_count, version):
+    """
+    集計した値からETagとLast-Modifiedを作る
+    Last-Modified は在庫の最終更新日時とデータの版の新しい方にする
+    （在庫の最終更新日時が変わらない変更で If-Modified-Since だけの条件付きGETが304にならないように）
+    """
+    last_updated = stats['last_updated']
+    source = '|'.join(str(value) for value in (
+        last_updated.isoformat() if last_updated else '',
+        stats['inventory_count'],
+        shipment_count,
+        version,
+    ))
+    last_modified = max(filter(None, (last_updated, _version_time(version))), default=None)
+    return hashlib.sha1(source.encode('utf-8')).hexdigest(), last_modified
+
+def get_validators(request):
+    """
+    条件付きGETの検証子（ETag, Last-Modified）を求める
+    在庫の最終更新日時の最大値と件数、出荷の件数だけを読み、一覧や集計のクエリは実行しない
+    同じリクエストで ETag と Last-Modified の両方を求めるため、結果はリクエストに保持する
+
+    :param request: リクエスト
+    :return: (ETag, Last-Modified)
+    """
+    validators = getattr(request, '_tea_validators', None)
+    if validators is None:
+        stats = Inventory.objects.aggregate(last_updated=Max('last_updated'), inventory_count=Count('id'))
+        validators = request._tea_validators = _make_validators(
+            stats, Shipment.objects.count(), get_data_version())
+    return validators
+
+async def aget_validators(request):
+    """
+    get_validators の非同期版
+    """
+    validators = getattr(request, '_tea_validators', None)
+    if validators is None:
+        stats = await Inventory.objects.aaggregate(
+            last_updated=Max('last_updated'), inventory_count=Count('id'))
+        validators = request._tea_validators = _make_validators(
+            stats, await Shipment.objects.acount(), await aget_data_version())
+    return validators
+
+def async_conditional_get(view):
+    """
+    非同期のビューに条件付きGETを付けるデコレーター
+    django.views.decorators.http.condition と require_GET は Django 4.2 では非同期のビューに使えないため、
+    同じ処理を非同期で行う
+
+    :param view: 非同期のビュー
+    :return: 非同期のビュー
+    """
+    @functools.wraps(view)
+    async def wrapper(request, *args, **kwargs):
+        if request.method not in ('GET', 'HEAD'):
+            return HttpResponseNotAllowed(['GET', 'HEAD'])
+        etag, last_modified = await aget_validators(request)
+        etag = quote_etag(etag)
+        timestamp = int(last_modified.timestamp()) if last_modified else None
+        response = get_conditional_response(request, etag=etag, last_modified=timestamp)
+        if response is None:
+            response = await view(request, *args, **kwargs)
+        if not response.has_header('ETag'):
+            response.headers['ETag'] = etag
+        if timestamp is not None and not response.has_header('Last-Modified'):
+            response.headers['Last-Modified'] = http_date(timestamp)
+        return response
+    return wrapper
+
+def data_etag(request, *args, **kwargs):
+    """
+    django.views.decorators.http.condition に渡すETagの関数
+    """
+    return get_validators(request)[0]
+
+def data_last_modified(request, *args, **kwargs):
+    """
+    django.views.decorators.http.condition に渡すLast-Modifiedの関数
+    """
+    return get_validators(request)[1]
+
+def page_payload(page, fields, date_field):
+    """
+    キーセットページの結果をJSONで返す形にする
+    項目名の production__ は取り除く（production__tea_type -> tea_type）
+
+    :param page: values(*fields) のQuerySetから作ったKeysetPage
+    :param fields: 返す項目
+    :param date_field: キーセットに使った日付（日時）のフィールド名
+    :return: {'results': [...], 'next': 次ページのカーソル}
+    """
+    names = [field.replace('production__', '') for field in fields]
+    results = [{name: item[field] for name, field in zip(names, fields)} for item in page]
+    next_cursor = None
+    if page.next_cursor is not None:
+        next_cursor = {'after': page.next_cursor[0].isoformat(), 'after_id': page.next_cursor[1]}
+    return {'results': results, 'next': next_cursor}
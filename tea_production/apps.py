@@ -3,4 +3,7 @@ from django.apps import AppConfig
 class TeaProductionConfig(AppConfig):
     default_auto_field = 'django.db.models.BigAutoField'
     name = 'tea_production'
-    verbose_name = 'KNGW TEA PRODUCTION' 
\ No newline at end of file
+    verbose_name = 'KNGW TEA PRODUCTION'
+
+    def ready(self):
+        from . import signals  # noqa: F401
@@ -0,0 +1,142 @@
+"""
+参照系ビューの非同期版
+
+ASGIで動かす場合（config/asgi.py、設定 TEA_ASYNC_VIEWS）に tea_production.views の代わりに使う
+データベースの読み出しは非同期のORM（aiterator, aaggregate など）で行い、待っている間もイベントループを止めない
+テンプレートの描画はセッション・メッセージ・ログインユーザーを読むため、同期の render をスレッドで実行する
+"""
+from asgiref.sync import sync_to_async
+from django.http import JsonResponse
+from django.shortcuts import render
+from .models import Production, Shipment, Inventory
+from .dashboard import abuild_production_summary, aget_dashboard_summary
+from .api import INVENTORY_FIELDS, SHIPMENT_FIELDS, async_conditional_get, page_payload
+from .export import aiter_rows, astream_csv, astream_json
+from .ledger import stock_totals_as_of
+from .pagination import akeyset_paginate
+from .rollups import ROLLUP_FIELDS, refresh_rollups
+from .views import (EXPORT_FORMATS, _apply_filters, _export, _keyset_args, _lookup_args, _lookup_payload,
+                    _page_context, _rollup_args, _stock_as_of_args)
+
+arender = sync_to_async(render)
+arefresh_rollups = sync_to_async(refresh_rollups)
+astock_totals_as_of = sync_to_async(stock_totals_as_of)
+
+# ダウンロードの形式ごとの非同期のストリーム（同期のイテレータを渡すと、ASGIでは全体を読み込んでから送るため）
+ASYNC_EXPORT_FORMATS = {
+    'csv': (astream_csv, EXPORT_FORMATS['csv'][1]),
+    'json': (astream_json, EXPORT_FORMATS['json'][1]),
+}
+
+async def _filtered_page(request, queryset, date_field, tea_type_field, customer=False):
+    """
+    一覧画面の絞り込み・並び替え・キーセットページネーションを行う（views._filtered_page の非同期版）
+    """
+    form, cursor, kwargs = _keyset_args(request, queryset, date_field, tea_type_field, customer)
+    return _page_context(request, form, cursor, await akeyset_paginate(**kwargs))
+
+async def index(request):
+    """
+    ダッシュボード画面を表示
+    """
+    return await arender(request, 'tea_production/index.html', await aget_dashboard_summary())
+
+async def production_list(request):
+    """
+    生産データ一覧の表示
+    """
+    context = await _filtered_page(request, Production.objects.all(), 'production_date', 'tea_type')
+    context['productions'] = context['page']
+    return await arender(request, 'tea_production/production_list.html', context)
+
+async def shipment_list(request):
+    """
+    出荷データ一覧の表示
+    """
+    context = await _filtered_page(request, Shipment.objects.select_related('production'),
+                                   'shipment_date', 'production__tea_type', customer=True)
+    context['shipments'] = context['page']
+    return await arender(request, 'tea_production/shipment_list.html', context)
+
+async def inventory_list(request):
+    """
+    在庫一覧の表示
+    """
+    context = await _filtered_page(request, Inventory.objects.select_related('production'),
+                                   'last_updated', 'production__tea_type')
+    context['inventory'] = context['page']
+    return await arender(request, 'tea_production/inventory_list.html', context)
+
+async def production_lookup(request):
+    """
+    出荷登録フォーム用の在庫ロット検索API
+    """
+    queryset, cursor, page_size = _lookup_args(request)
+    page = await akeyset_paginate(queryset, 'production_date', cursor=cursor, page_size=page_size)
+    return JsonResponse(_lookup_payload(page))
+
+@async_conditional_get
+async def inventory_api(request):
+    """
+    在庫一覧のJSON API
+    """
+    _, _, kwargs = _keyset_args(request, Inventory.objects.values(*INVENTORY_FIELDS),
+                                'last_updated', 'production__tea_type')
+    return JsonResponse(page_payload(await akeyset_paginate(**kwargs), INVENTORY_FIELDS, 'last_updated'))
+
+@async_conditional_get
+async def production_summary_api(request):
+    """
+    生産サマリーのJSON API
+    """
+    _, _, queryset = _apply_filters(request, Production.objects.all(), 'production_date', 'tea_type')
+    return JsonResponse({'results': await abuild_production_summary(queryset)})
+
+@async_conditional_get
+async def shipment_history_api(request):
+    """
+    出荷履歴のJSON API
+    """
+    _, _, kwargs = _keyset_args(request, Shipment.objects.values(*SHIPMENT_FIELDS),
+                                'shipment_date', 'production__tea_type', customer=True)
+    return JsonResponse(page_payload(await akeyset_paginate(**kwargs), SHIPMENT_FIELDS, 'shipment_date'))
+
+@async_conditional_get
+async def period_rollup_api(request):
+    """
+    期間別集計（日次・週次・月次）のJSON API
+    """
+    period, kwargs = _rollup_args(request)
+    await arefresh_rollups()
+    return JsonResponse({'period': period, **page_payload(await akeyset_paginate(**kwargs), ROLLUP_FIELDS,
+                                                          'period_start')})
+
+@async_conditional_get
+async def stock_as_of_api(request):
+    """
+    時点指定の在庫のJSON API
+    スナップショットの作成と集計はまとめてスレッドで実行する
+    """
+    kwargs = _stock_as_of_args(request)
+    return JsonResponse({'as_of': kwargs['as_of'], 'results': await astock_totals_as_of(**kwargs)})
+
+async def production_export(request):
+    """
+    生産データのダウンロード
+    """
+    return _export(request, 'production', Production.objects.all(), 'production_date', 'tea_type',
+                   formats=ASYNC_EXPORT_FORMATS, rows=aiter_rows)
+
+async def shipment_export(request):
+    """
+    出荷データのダウンロード
+    """
+    return _export(request, 'shipment', Shipment.objects.all(), 'shipment_date', 'production__tea_type',
+                   customer=True, formats=ASYNC_EXPORT_FORMATS, rows=aiter_rows)
+
+async def inventory_export(request):
+    """
+    在庫データのダウンロード
+    """
+    return _export(request, 'inventory', Inventory.objects.all(), 'last_updated', 'production__tea_type',
+                   formats=ASYNC_EXPORT_FORMATS, rows=aiter_rows)
@@ -0,0 +1,41 @@
+"""
+生産・出荷・在庫データの変更の記録（database.py のデータベースとの同期用）
+
+保存・削除はシグナルで記録し、シグナルを送らない一括の書き込み（bulk_create や QuerySet.update）は
+書き込む側が capture_changes を呼ぶ。同期（tea_production.sync）で反映する間は記録しない
+"""
+import threading
+from contextlib import contextmanager
+
+from .models import ChangeLog
+
+# 1回のINSERTで書き込む行数
+BATCH_SIZE = 2000
+
+_state = threading.local()
+
+@contextmanager
+def capture_paused():
+    """
+    このスレッドでの書き込みを変更として記録しない（同期で相手のデータベースの変更を反映する間に使う）
+    """
+    previous = getattr(_state, 'paused', False)
+    _state.paused = True
+    try:
+        yield
+    finally:
+        _state.paused = previous
+
+def capture_changes(table_name, row_ids, operation):
+    """
+    変更された行を記録する
+
+    :param table_name: テーブル名（production, inventory, shipment）
+    :param row_ids: 行のID（在庫は生産データID）
+    :param operation: insert, update, delete
+    """
+    if getattr(_state, 'paused', False):
+        return
+    ChangeLog.objects.bulk_create([
+        ChangeLog(table_name=table_name, row_id=row_id, operation=operation) for row_id in row_ids
+    ], batch_size=BATCH_SIZE)
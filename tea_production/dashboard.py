@@ -0,0 +1,99 @@
+from django.conf import settings
+from django.core.cache import cache
+from django.db.models import Sum, Count, Case, When, F, FloatField
+from .models import Production, Inventory
+
+DASHBOARD_CACHE_KEY = 'tea_production:dashboard'
+
+def inventory_summary_query():
+    """
+    在庫のあるロットだけを茶葉の種類・品質評価ごとに集計するQuerySet
+    """
+    return Inventory.objects.filter(quantity__gt=0).values(
+        tea_type=F('production__tea_type'),
+        quality_check=F('production__quality_check'),
+    ).annotate(
+        total_quantity=Sum('quantity'),
+        lot_count=Count('id'),
+    ).order_by('tea_type', 'quality_check')
+
+def production_summary_query(queryset):
+    """
+    生産データを茶葉の種類ごとに集計するQuerySet（生産回数・生産量・A級品率）
+
+    :param queryset: 集計する生産データのQuerySet
+    """
+    return queryset.values('tea_type').annotate(
+        total_productions=Count('id'),
+        total_quantity=Sum('quantity'),
+        a_grade_count=Sum(Case(
+            When(quality_check='A級', then=1),
+            default=0,
+            output_field=FloatField(),
+        )),
+    ).annotate(
+        quality_a_percentage=F('a_grade_count') * 100.0 / F('total_productions')
+    ).order_by('tea_type')
+
+def build_dashboard_summary():
+    """
+    ダッシュボードのサマリーをデータベースで集計する
+    在庫は在庫のあるロットだけを茶葉の種類・品質評価ごとに集計する
+    """
+    return {
+        'inventory': list(inventory_summary_query()),
+        'production_summary': build_production_summary(Production.objects.all()),
+    }
+
+async def abuild_dashboard_summary():
+    """
+    build_dashboard_summary の非同期版
+    """
+    return {
+        'inventory': [row async for row in inventory_summary_query()],
+        'production_summary': await abuild_production_summary(Production.objects.all()),
+    }
+
+def build_production_summary(queryset):
+    """
+    生産データを茶葉の種類ごとに集計する（生産回数・生産量・A級品率）
+
+    :param queryset: 集計する生産データのQuerySet
+    :return: 茶葉の種類ごとの集計結果のリスト
+    """
+    return list(production_summary_query(queryset))
+
+async def abuild_production_summary(queryset):
+    """
+    build_production_summary の非同期版
+    """
+    return [row async for row in production_summary_query(queryset)]
+
+def get_dashboard_summary():
+    """
+    ダッシュボードのサマリーを取得する（キャッシュがあればそれを返す）
+    """
+    return cache.get_or_set(
+        DASHBOARD_CACHE_KEY,
+        build_dashboard_summary,
+        getattr(settings, 'DASHBOARD_CACHE_TIMEOUT', 300),
+    )
+
+async def aget_dashboard_summary():
+    """
+    get_dashboard_summary の非同期版
+    """
+    summary = await cache.aget(DASHBOARD_CACHE_KEY)
+    if summary is None:
+        summary = await abuild_dashboard_summary()
+        await cache.aset(DASHBOARD_CACHE_KEY, summary, getattr(settings, 'DASHBOARD_CACHE_TIMEOUT', 300))
+    return summary
+
+def invalidate_dashboard():
+    """
+    ダッシュボードのキャッシュを無効にする
+    シグナルが発生しない一括更新（bulk_create や QuerySet.update）の後にも呼ぶこと
+    書き込みのトランザクションの中では transaction.on_commit に渡す
+    （コミット前に削除すると、同時のリクエストがコミット前のデータをキャッシュし直すため）
+    """
+    cache.delete(DASHBOARD_CACHE_KEY)
@@ -0,0 +1,137 @@
+import csv
+from django.core.serializers.json import DjangoJSONEncoder
+
+# 1回のfetchで読み出す行数
+EXPORT_CHUNK_SIZE = 2000
+
+# エクスポートする項目（export_data と同じ列にし、import_tea_data で取り込めるようにする）
+EXPORT_COLUMNS = {
+    'production': ['id', 'tea_type', 'production_date', 'quantity', 'quality_check',
+                   'quality_notes', 'created_at'],
+    'shipment': ['id', 'production_id', 'shipment_date', 'quantity', 'customer_name',
+                 'customer_contact', 'created_at'],
+    'inventory': ['id', 'production_id', 'quantity', 'last_updated'],
+}
+
+class Echo:
+    """
+    csv.writer の書き込み先として、書き込まれた文字列をそのまま返す
+    """
+    def write(self, value):
+        return value
+
+def iter_rows(queryset, columns, chunk_size=EXPORT_CHUNK_SIZE):
+    """
+    QuerySetの行をチャンク単位で読み出す
+    結果全体をメモリに載せないよう、モデルのインスタンスやキャッシュを作らない
+
+    :param queryset: 対象のQuerySet
+    :param columns: 読み出す項目
+    :param chunk_size: 1回に読み出す行数
+    :return: 行のタプルのイテレータ
+    """
+    return queryset.order_by('id').values_list(*columns).iterator(chunk_size=chunk_size)
+
+def aiter_rows(queryset, columns, chunk_size=EXPORT_CHUNK_SIZE):
+    """
+    iter_rows の非同期版（ASGIの StreamingHttpResponse に非同期のイテレータとして渡す）
+    Django 4.2 の values_list() の aiterator() はイベントループのスレッドでクエリを実行してしまうため、
+    ジェネレータで行を返す named=True を使う
+
+    :param queryset: 対象のQuerySet
+    :param columns: 読み出す項目
+    :param chunk_size: 1回に読み出す行数
+    :return: 行の名前付きタプルの非同期イテレータ
+    """
+    return queryset.order_by('id').values_list(*columns, named=True).aiterator(chunk_size=chunk_size)
+
+def _batched(lines, size=EXPORT_CHUNK_SIZE):
+    """
+    1行ずつの文字列をまとめて返す（レスポンスの書き込み回数を減らす）
+    """
+    buffer = []
+    for line in lines:
+        buffer.append(line)
+        if len(buffer) >= size:
+            yield ''.join(buffer)
+            buffer = []
+    if buffer:
+        yield ''.join(buffer)
+
+async def _abatched(lines, size=EXPORT_CHUNK_SIZE):
+    """
+    _batched の非同期版
+    """
+    buffer = []
+    async for line in lines:
+        buffer.append(line)
+        if len(buffer) >= size:
+            yield ''.join(buffer)
+            buffer = []
+    if buffer:
+        yield ''.join(buffer)
+
+def stream_csv(rows, columns):
+    """
+    行をCSVの文字列にして少しずつ返す
+
+    :param rows: 行のイテレータ
+    :param columns: 見出しの項目
+    :return: CSVの文字列のイテレータ
+    """
+    writer = csv.writer(Echo(), lineterminator='\n')
+    yield writer.writerow(columns)
+    yield from _batched(writer.writerow(row) for row in rows)
+
+def stream_json(rows, columns):
+    """
+    行をJSONの配列として少しずつ返す
+    日付と数量は DjangoJSONEncoder で文字列にする
+
+    :param rows: 行のイテレータ
+    :param columns: 項目名
+    :return: JSONの文字列のイテレータ
+    """
+    encoder = DjangoJSONEncoder(ensure_ascii=False)
+
+    def lines():
+        separator = '[\n'
+        for row in rows:
+            yield separator + encoder.encode(dict(zip(columns, row)))
+            separator = ',\n'
+        yield '[]\n' if separator == '[\n' else '\n]\n'
+
+    yield from _batched(lines())
+
+async def astream_csv(rows, columns):
+    """
+    stream_csv の非同期版
+
+    :param rows: 行の非同期イテレータ
+    :param columns: 見出しの項目
+    :return: CSVの文字列の非同期イテレータ
+    """
+    writer = csv.writer(Echo(), lineterminator='\n')
+    yield writer.writerow(columns)
+    async for chunk in _abatched(writer.writerow(row) async for row in rows):
+        yield chunk
+
+async def astream_json(rows, columns):
+    """
+    stream_json の非同期版
+
+    :param rows: 行の非同期イテレータ
+    :param columns: 項目名
+    :return: JSONの文字列の非同期イテレータ
+    """
+    encoder = DjangoJSONEncoder(ensure_ascii=False)
+
+    async def lines():
+        separator = '[\n'
+        async for row in rows:
+            yield separator + encoder.encode(dict(zip(columns, row)))
+            separator = ',\n'
+        yield '[]\n' if separator == '[\n' else '\n]\n'
+
+    async for chunk in _abatched(lines()):
+        yield chunk
@@ -1,5 +1,6 @@
+from decimal import Decimal
 from django import forms
-from .models import Production, Shipment
+from .models import PeriodRollup, Production, Shipment
 
 class ProductionForm(forms.ModelForm):
     """
@@ -16,17 +17,105 @@ class ProductionForm(forms.ModelForm):
 class ShipmentForm(forms.ModelForm):
     """
     出荷データ登録フォーム
+    生産データは全件の選択肢を描画せず、検索APIで候補を取得してIDを入力する
     """
     class Meta:
         model = Shipment
         fields = ['production', 'shipment_date', 'quantity', 'customer_name', 'customer_contact']
         widgets = {
+            'production': forms.NumberInput(attrs={
+                'list': 'production-lookup-options',
+                'autocomplete': 'off',
+                'placeholder': '茶葉の種類・生産日・品質評価で検索して選択',
+            }),
             'shipment_date': forms.DateInput(attrs={'type': 'date'}),
         }
     
     def __init__(self, *args, **kwargs):
         super().__init__(*args, **kwargs)
-        # 在庫があるものだけを選択肢として表示
+        # 在庫があるものだけを受け付ける（POST時は入力されたIDの1件だけを検索する）
         self.fields['production'].queryset = Production.objects.filter(
             inventory__quantity__gt=0
-        ) 
\ No newline at end of file
+        )
+        self.fields['production'].label = '生産データ（ロットID）'
+
+
+class ShipmentAllocationForm(forms.Form):
+    """
+    注文（茶葉の種類・品質評価・数量）からの出荷登録フォーム
+    ロットは生産日の古い順に自動で引き当てる
+    """
+    tea_type = forms.ChoiceField(label='茶葉の種類', choices=Production.TEA_TYPES)
+    quality_check = forms.ChoiceField(label='品質評価', choices=Production.QUALITY_GRADES)
+    quantity = forms.DecimalField(label='出荷量(kg)', max_digits=10, decimal_places=2, min_value=Decimal('0.01'))
+    shipment_date = forms.DateField(label='出荷日', widget=forms.DateInput(attrs={'type': 'date'}))
+    customer_name = forms.CharField(label='顧客名', max_length=100)
+    customer_contact = forms.CharField(label='連絡先', max_length=100, required=False)
+
+class ProductionLookupForm(forms.Form):
+    """
+    在庫ロット検索APIの検索条件
+    """
+    DEFAULT_PAGE_SIZE = 20
+    MAX_PAGE_SIZE = 100
+
+    tea_type = forms.ChoiceField(required=False, choices=[('', '')] + Production.TEA_TYPES)
+    quality_check = forms.ChoiceField(required=False, choices=[('', '')] + Production.QUALITY_GRADES)
+    start_date = forms.DateField(required=False)
+    end_date = forms.DateField(required=False)
+    after = forms.CharField(required=False)
+    after_id = forms.IntegerField(required=False)
+    page_size = forms.IntegerField(required=False, min_value=1, max_value=MAX_PAGE_SIZE)
+
+class RollupFilterForm(forms.Form):
+    """
+    期間別集計APIの検索条件
+    """
+    DEFAULT_PERIOD = 'month'
+
+    period = forms.ChoiceField(required=False, choices=PeriodRollup.PERIODS)
+    tea_type = forms.ChoiceField(required=False, choices=[('', '')] + Production.TEA_TYPES)
+    quality_check = forms.ChoiceField(required=False, choices=[('', '')] + Production.QUALITY_GRADES)
+    start_date = forms.DateField(required=False)
+    end_date = forms.DateField(required=False)
+    after = forms.CharField(required=False)
+    after_id = forms.IntegerField(required=False)
+    page_size = forms.IntegerField(required=False, min_value=1)
+
+class StockAsOfForm(forms.Form):
+    """
+    時点指定の在庫APIの検索条件（日付を省略した場合は今日）
+    """
+    date = forms.DateField(required=False)
+    tea_type = forms.ChoiceField(required=False, choices=[('', '')] + Production.TEA_TYPES)
+    quality_check = forms.ChoiceField(required=False, choices=[('', '')] + Production.QUALITY_GRADES)
+
+class ListFilterForm(forms.Form):
+    """
+    一覧画面の絞り込み・並び替えフォーム
+    """
+    ORDER_CHOICES = [
+        ('desc', '新しい順'),
+        ('asc', '古い順'),
+    ]
+
+    start_date = forms.DateField(label='開始日', required=False,
+                                 widget=forms.DateInput(attrs={'type': 'date'}))
+    end_date = forms.DateField(label='終了日', required=False,
+                               widget=forms.DateInput(attrs={'type': 'date'}))
+    tea_type = forms.ChoiceField(label='茶葉の種類', required=False,
+                                 choices=[('', 'すべて')] + Production.TEA_TYPES)
+    customer_name = forms.CharField(label='顧客名', required=False, max_length=100)
+    order = forms.ChoiceField(label='並び順', required=False, choices=ORDER_CHOICES)
+    page_size = forms.IntegerField(label='表示件数', required=False, min_value=1)
+    after = forms.CharField(required=False, widget=forms.HiddenInput)
+    after_id = forms.IntegerField(required=False, widget=forms.HiddenInput)
+
+    def __init__(self, *args, customer=False, **kwargs):
+        super().__init__(*args, **kwargs)
+        # 顧客名での絞り込みは出荷一覧だけで使う
+        if not customer:
+            del self.fields['customer_name']
+        for field in self.visible_fields():
+            field.field.widget.attrs.setdefault(
+                'class', 'form-select' if isinstance(field.field, forms.ChoiceField) else 'form-control')
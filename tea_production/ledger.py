@@ -0,0 +1,166 @@
+"""
+在庫の台帳とスナップショットによる時点指定の在庫
+
+生産・出荷データの作成・変更・削除のたびにシグナルが StockMovement に増減を追記し（変更・削除は打ち消しの行を追記する）、
+ある日の在庫はその日以前で最も近い StockSnapshot に、その後の台帳の範囲だけを足して求める
+スナップショットの日付は ledger.checkpoint_dates（database.py のスキーマと共通）を使う
+"""
+from collections import defaultdict
+from decimal import Decimal
+
+from django.db import transaction
+from django.db.models import Max, Min, Sum
+
+from ledger import SNAPSHOT_INTERVAL_MONTHS, checkpoint_dates
+from .models import StockCheckpoint, StockMovement, StockSnapshot
+
+# 1回のINSERTで書き込む行数
+BATCH_SIZE = 2000
+
+# 茶葉の種類・品質評価ごとの集計で使う項目
+GROUP_FIELDS = ('production__tea_type', 'production__quality_check')
+
+def production_movements(productions, reverse=False):
+    """
+    生産データの台帳の行を作る（保存はしない）
+
+    :param productions: Production のリスト
+    :param reverse: Trueの場合は打ち消しの行を作る
+    :return: StockMovement のリスト
+    """
+    sign = -1 if reverse else 1
+    return [
+        StockMovement(production_id=production.pk, movement_date=production.production_date,
+                      quantity=sign * production.quantity, source='production', source_id=production.pk)
+        for production in productions
+    ]
+
+def shipment_movements(shipments, reverse=False):
+    """
+    出荷データの台帳の行を作る（保存はしない）
+
+    :param shipments: Shipment のリスト
+    :param reverse: Trueの場合は打ち消しの行を作る
+    :return: StockMovement のリスト
+    """
+    sign = 1 if reverse else -1
+    return [
+        StockMovement(production_id=shipment.production_id, movement_date=shipment.shipment_date,
+                      quantity=sign * shipment.quantity, source='shipment', source_id=shipment.pk)
+        for shipment in shipments
+    ]
+
+def record_movements(movements, batch_size=BATCH_SIZE):
+    """
+    台帳に行を追記し、追記した最も古い日付以降のスナップショットを削除する
+    （削除したスナップショットは次の参照時に ensure_snapshots で作り直す）
+
+    :param movements: StockMovement のリスト
+    :param batch_size: 1回のINSERTで書き込む行数
+    """
+    if not movements:
+        return
+    with transaction.atomic():
+        StockMovement.objects.bulk_create(movements, batch_size=batch_size)
+        since = min(movement.movement_date for movement in movements)
+        if StockCheckpoint.objects.filter(snapshot_date__gte=since).delete()[0]:
+            StockSnapshot.objects.filter(snapshot_date__gte=since).delete()
+
+def _latest_checkpoint(as_of):
+    return StockCheckpoint.objects.filter(snapshot_date__lte=as_of).aggregate(
+        last=Max('snapshot_date'))['last']
+
+def _balances(base, as_of, fields=(), **filters):
+    """
+    base のスナップショットに、base の翌日から as_of までの台帳を足してロットごとの在庫を求める
+
+    :param base: スナップショットの日付（Noneの場合は台帳の先頭から）
+    :param as_of: 日付
+    :param fields: ロットのIDとあわせてキーにする項目
+    :param filters: スナップショットと台帳の絞り込み条件
+    :return: {(生産データID, *fields): 在庫量}（在庫のあるロットだけ）
+    """
+    querysets = []
+    movements = StockMovement.objects.filter(movement_date__lte=as_of, **filters)
+    if base:
+        querysets.append(StockSnapshot.objects.filter(snapshot_date=base, **filters)
+                         .values_list('production_id', *fields, 'quantity'))
+        movements = movements.filter(movement_date__gt=base)
+    querysets.append(movements.values('production_id', *fields).annotate(total=Sum('quantity'))
+                     .values_list('production_id', *fields, 'total').order_by())
+
+    balances = defaultdict(Decimal)
+    for queryset in querysets:
+        for *key, quantity in queryset.iterator(chunk_size=BATCH_SIZE):
+            balances[tuple(key)] += quantity
+    return {key: quantity for key, quantity in balances.items() if quantity}
+
+def _lot_filters(tea_type, quality_check):
+    filters = {}
+    if tea_type:
+        filters['production__tea_type'] = tea_type
+    if quality_check:
+        filters['production__quality_check'] = quality_check
+    return filters
+
+def ensure_snapshots(until, interval_months=SNAPSHOT_INTERVAL_MONTHS):
+    """
+    until 以前の期末のうち、スナップショットがない期末について作る
+    各期末のスナップショットは直前のスナップショットにその間の台帳を足して作るため、全履歴は読まない
+
+    :param until: この日以前の期末まで作る
+    :param interval_months: スナップショットの間隔（月数）
+    :return: 作成したスナップショットの数
+    """
+    created = 0
+    with transaction.atomic():
+        previous = _latest_checkpoint(until)
+        movements = StockMovement.objects.all()
+        if previous:
+            movements = movements.filter(movement_date__gt=previous)
+        bounds = movements.aggregate(first=Min('movement_date'), last=Max('movement_date'))
+        if bounds['first'] is None:
+            return created
+        # 台帳の最後の日より後の期末は、前の期末と同じ内容になるため作らない
+        for date in checkpoint_dates(bounds['first'], min(until, bounds['last']), interval_months):
+            balances = _balances(previous, date)
+            StockSnapshot.objects.bulk_create([
+                StockSnapshot(snapshot_date=date, production_id=production_id, quantity=quantity)
+                for (production_id,), quantity in balances.items()
+            ], batch_size=BATCH_SIZE)
+            StockCheckpoint.objects.create(snapshot_date=date, lot_count=len(balances))
+            previous = date
+            created += 1
+    return created
+
+def stock_as_of(as_of, tea_type=None, quality_check=None):
+    """
+    as_of の日の終わりのロットごとの在庫を求める
+    as_of 以前のスナップショットがない期末があれば先に作る
+
+    :param as_of: 日付
+    :param tea_type: 茶葉の種類
+    :param quality_check: 品質評価
+    :return: {生産データID: 在庫量}
+    """
+    ensure_snapshots(as_of)
+    balances = _balances(_latest_checkpoint(as_of), as_of, **_lot_filters(tea_type, quality_check))
+    return {production_id: quantity for (production_id,), quantity in balances.items()}
+
+def stock_totals_as_of(as_of, tea_type=None, quality_check=None):
+    """
+    as_of の日の終わりの在庫を茶葉の種類・品質評価ごとに合計する
+    生産データが削除されたロットは茶葉の種類がわからないため含めない
+
+    :param as_of: 日付
+    :param tea_type: 茶葉の種類
+    :param quality_check: 品質評価
+    :return: [{'tea_type', 'quality_check', 'quantity', 'lots'}]（茶葉の種類・品質評価の順）
+    """
+    ensure_snapshots(as_of)
+    balances = _balances(_latest_checkpoint(as_of), as_of, GROUP_FIELDS, **_lot_filters(tea_type, quality_check))
+    totals = defaultdict(lambda: {'quantity': Decimal(0), 'lots': 0})
+    for (_, *key), quantity in balances.items():
+        totals[tuple(key)]['quantity'] += quantity
+        totals[tuple(key)]['lots'] += 1
+    return [{'tea_type': key[0], 'quality_check': key[1], **total} for key, total in sorted(totals.items())]
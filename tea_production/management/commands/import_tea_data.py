@@ -0,0 +1,378 @@
+"""
+export_data が書き出したCSVを生産・在庫・出荷のモデルに一括で取り込む
+
+    python manage.py import_tea_data /path/to/export
+    python manage.py import_tea_data /path/to/export --batch-size 5000 --rejects rejects.csv
+"""
+import csv
+import datetime
+import gzip
+import io
+import json
+import os
+import time
+from collections import Counter, defaultdict
+from decimal import Decimal, InvalidOperation
+from itertools import islice
+
+from django.core.management.base import BaseCommand, CommandError
+from django.db import transaction
+from django.db.models import Case, DecimalField, F, Value, When
+from django.utils import timezone
+from django.utils.dateparse import parse_date, parse_datetime
+
+from tea_production.allocation import bump_lot_index_version
+from tea_production.api import bump_data_version
+from tea_production.changes import capture_changes
+from tea_production.dashboard import invalidate_dashboard
+from tea_production.ledger import production_movements, record_movements, shipment_movements
+from tea_production.models import Inventory, Production, Shipment
+from tea_production.rollups import mark_rollups_dirty
+
+# 取り込む順序（在庫と出荷は生産データのIDを参照する）
+TABLES = ('production', 'inventory', 'shipment')
+
+# 1回のINSERTで書き込む行数
+DEFAULT_BATCH_SIZE = 2000
+
+# 1回に検証して1トランザクションで書き込む行数
+DEFAULT_CHUNK_SIZE = 20000
+
+# 在庫の差し引きで1文のCASE式にまとめるロット数
+DECREMENT_BATCH_SIZE = 500
+
+# 数量のフィールド（max_digits=10, decimal_places=2）で扱える範囲
+QUANTITY_STEP = Decimal('0.01')
+QUANTITY_LIMIT = Decimal('100000000')
+
+MANIFEST_NAME = 'manifest.json'
+SUFFIXES = ('.csv', '.csv.gz', '.csv.zst')
+
+TEA_TYPES = {value for value, _ in Production.TEA_TYPES}
+QUALITY_GRADES = {value for value, _ in Production.QUALITY_GRADES}
+
+
+def find_files(path):
+    """
+    エクスポート先のディレクトリから取り込むCSVファイルを探す
+    manifest.json（最後の全件エクスポートのマニフェスト）があればそこに記録されたファイル名を使う
+    以前の版の export_data は差分エクスポートでも manifest.json を上書きしたため、
+    差分のマニフェストだった場合は全件エクスポートのファイル名（<テーブル名>.csv）から探す
+
+    :param path: エクスポート先のディレクトリ
+    :return: {テーブル名: ファイルパス}
+    """
+    manifest_path = os.path.join(path, MANIFEST_NAME)
+    manifest = None
+    if os.path.exists(manifest_path):
+        with open(manifest_path, encoding='utf-8') as f:
+            manifest = json.load(f)
+    if manifest is not None and manifest.get('mode') == 'full':
+        if manifest.get('format') != 'csv':
+            raise CommandError(f"CSV以外の形式には対応していません: {manifest.get('format')}")
+        return {
+            table: os.path.join(path, info['file'])
+            for table, info in manifest['tables'].items() if table in TABLES
+        }
+
+    files = {}
+    for table in TABLES:
+        for suffix in SUFFIXES:
+            candidate = os.path.join(path, table + suffix)
+            if os.path.exists(candidate):
+                files[table] = candidate
+                break
+    return files
+
+
+def open_csv(path):
+    """
+    拡張子に応じて圧縮を展開し、読み込み用のテキストストリームを開く
+    """
+    if path.endswith('.gz'):
+        return gzip.open(path, 'rt', newline='', encoding='utf-8')
+    if path.endswith('.zst'):
+        try:
+            import zstandard
+        except ImportError as e:
+            raise CommandError('zstd圧縮のファイルには zstandard パッケージが必要です') from e
+        stream = zstandard.ZstdDecompressor().stream_reader(open(path, 'rb'), closefd=True)
+        return io.TextIOWrapper(stream, newline='', encoding='utf-8')
+    return open(path, newline='', encoding='utf-8')
+
+
+def _quantity(value, allow_zero=False):
+    """
+    数量を小数第2位までのDecimalに変換する
+    """
+    quantity = Decimal(value).quantize(QUANTITY_STEP)
+    if quantity < 0 or (quantity == 0 and not allow_zero):
+        raise ValueError(f'数量が不正です: {value}')
+    if quantity >= QUANTITY_LIMIT:
+        raise ValueError(f'数量が大きすぎます: {value}')
+    return quantity
+
+
+def _date(value):
+    """
+    YYYY-MM-DD 形式の日付を変換する
+    """
+    date = parse_date(value or '')
+    if date is None:
+        raise ValueError(f'日付が不正です: {value}')
+    return date
+
+
+def _timestamp(value, default):
+    """
+    登録日時を変換する
+    database.py は CURRENT_TIMESTAMP（UTC）で記録するため、タイムゾーンのない値はUTCとみなす
+    """
+    value = parse_datetime(value) if value else None
+    if value is None:
+        return default
+    if timezone.is_naive(value):
+        value = timezone.make_aware(value, datetime.timezone.utc)
+    return value
+
+
+def _text(value, max_length, required=False):
+    """
+    文字列の項目を検証する
+    """
+    value = (value or '').strip()
+    if required and not value:
+        raise ValueError('必須の項目が空です')
+    if len(value) > max_length:
+        raise ValueError(f'{max_length}文字を超えています')
+    return value or None
+
+
+def _chunks(reader, size):
+    """
+    CSVの行を (行番号, 行) のリストにまとめて返す
+    """
+    numbered = enumerate(reader, start=2)
+    while True:
+        chunk = list(islice(numbered, size))
+        if not chunk:
+            return
+        yield chunk
+
+
+class Command(BaseCommand):
+    help = 'export_data が書き出したCSVを生産・在庫・出荷データとして一括で取り込む'
+
+    def add_arguments(self, parser):
+        parser.add_argument('path', help='export_data のエクスポート先のディレクトリ')
+        parser.add_argument('--batch-size', type=int, default=DEFAULT_BATCH_SIZE,
+                            help='1回のINSERTで書き込む行数')
+        parser.add_argument('--chunk-size', type=int, default=DEFAULT_CHUNK_SIZE,
+                            help='1回に検証して1トランザクションで書き込む行数')
+        parser.add_argument('--rejects', help='取り込めなかった行と理由を書き出すCSVファイル')
+
+    def handle(self, *args, **options):
+        path = options['path']
+        if not os.path.isdir(path):
+            raise CommandError(f'ディレクトリが見つかりません: {path}')
+        files = find_files(path)
+        if 'production' not in files:
+            raise CommandError(f'生産データのCSVが見つかりません: {path}')
+
+        self.batch_size = options['batch_size']
+        self.verbosity = options['verbosity']
+        # エクスポート元の生産データIDから取り込み先のIDへの対応
+        self.lot_ids = {}
+        # 在庫のCSVがない場合は生産量を在庫とし、出荷分を差し引く
+        self.stock = None if 'inventory' in files else {}
+        self.rejected = Counter()
+        self.rejects_file = open(options['rejects'], 'w', newline='', encoding='utf-8') \
+            if options['rejects'] else None
+        self.rejects_writer = csv.writer(self.rejects_file, lineterminator='\n') \
+            if self.rejects_file else None
+        if self.rejects_writer:
+            self.rejects_writer.writerow(['table', 'line', 'reason', 'row'])
+
+        importers = {
+            'production': self._import_productions,
+            'inventory': self._import_inventory,
+            'shipment': self._import_shipments,
+        }
+        try:
+            for table in TABLES:
+                if table in files:
+                    self._import_file(table, files[table], importers[table], options['chunk_size'])
+        finally:
+            if self.rejects_file:
+                self.rejects_file.close()
+            # bulk_create と update はシグナルを送らないため、まとめて無効にする（在庫台帳は書き込み時に追記する）
+            transaction.on_commit(invalidate_dashboard)
+            transaction.on_commit(bump_data_version)
+            transaction.on_commit(bump_lot_index_version)
+            mark_rollups_dirty()
+
+        total_rejected = sum(self.rejected.values())
+        if total_rejected:
+            for (table, reason), count in self.rejected.most_common(10):
+                self.stdout.write(self.style.WARNING(f'  {table}: {reason} ({count}件)'))
+        self.stdout.write(self.style.SUCCESS(f'取り込みが完了しました（除外 {total_rejected}件）'))
+
+    def _import_file(self, table, path, importer, chunk_size):
+        """
+        1つのCSVをチャンク単位で検証して取り込み、件数と処理速度を表示する
+        """
+        start = time.perf_counter()
+        imported = rejected = 0
+        with open_csv(path) as f:
+            for chunk in _chunks(csv.DictReader(f), chunk_size):
+                count = importer(chunk)
+                imported += count
+                rejected += len(chunk) - count
+                if self.verbosity >= 2:
+                    self.stdout.write(f'  {table}: {imported + rejected}行')
+        elapsed = time.perf_counter() - start
+        self.stdout.write(
+            f'{table}: {imported}件を取り込み、{rejected}件を除外しました '
+            f'({elapsed:.1f}秒, {imported / elapsed if elapsed else 0:.0f}件/秒)'
+        )
+
+    def _reject(self, table, line, reason, row):
+        """
+        取り込めなかった行を記録する
+        """
+        reason = str(reason) if not isinstance(reason, KeyError) else f'項目がありません: {reason}'
+        self.rejected[(table, reason.split(':')[0])] += 1
+        if self.rejects_writer:
+            self.rejects_writer.writerow([table, line, reason, json.dumps(row, ensure_ascii=False)])
+
+    def _lot_id(self, row):
+        """
+        エクスポート元の生産データIDを取り込み先のIDに変換する
+        """
+        lot_id = self.lot_ids.get(int(row['production_id']))
+        if lot_id is None:
+            raise ValueError(f"生産データが見つかりません: {row['production_id']}")
+        return lot_id
+
+    def _import_productions(self, chunk):
+        """
+        生産データを検証して書き込む
+        在庫のCSVがない場合は生産量をそのまま在庫として作る
+        """
+        now = timezone.now()
+        productions, sources = [], []
+        seen = set()
+        for line, row in chunk:
+            try:
+                source_id = int(row['id'])
+                if source_id in self.lot_ids or source_id in seen:
+                    raise ValueError(f'IDが重複しています: {source_id}')
+                if row['tea_type'] not in TEA_TYPES:
+                    raise ValueError(f"茶葉の種類が不正です: {row['tea_type']}")
+                if row['quality_check'] not in QUALITY_GRADES:
+                    raise ValueError(f"品質評価が不正です: {row['quality_check']}")
+                productions.append(Production(
+                    tea_type=row['tea_type'],
+                    production_date=_date(row['production_date']),
+                    quantity=_quantity(row['quantity']),
+                    quality_check=row['quality_check'],
+                    quality_notes=row.get('quality_notes') or None,
+                    created_at=_timestamp(row.get('created_at'), now),
+                ))
+                sources.append(source_id)
+                seen.add(source_id)
+            except (KeyError, ValueError, InvalidOperation) as e:
+                self._reject('production', line, e, row)
+
+        with transaction.atomic():
+            # SQLiteはRETURNINGで採番されたIDを返すため、そのまま対応表を作れる
+            Production.objects.bulk_create(productions, batch_size=self.batch_size)
+            record_movements(production_movements(productions), batch_size=self.batch_size)
+            capture_changes('production', [production.pk for production in productions], 'insert')
+            if self.stock is not None:
+                Inventory.objects.bulk_create([
+                    Inventory(production=production, quantity=production.quantity)
+                    for production in productions
+                ], batch_size=self.batch_size)
+                capture_changes('inventory', [production.pk for production in productions], 'insert')
+
+        for source_id, production in zip(sources, productions):
+            self.lot_ids[source_id] = production.pk
+            if self.stock is not None:
+                self.stock[production.pk] = production.quantity
+        return len(productions)
+
+    def _import_inventory(self, chunk):
+        """
+        在庫データを書き込む
+        エクスポートされた在庫は出荷分を差し引いた後の値なので、出荷の取り込みでは差し引かない
+        """
+        inventories = []
+        seen = set()
+        for line, row in chunk:
+            try:
+                lot_id = self._lot_id(row)
+                if lot_id in seen:
+                    raise ValueError(f"在庫データが重複しています: {row['production_id']}")
+                inventories.append(Inventory(production_id=lot_id,
+                                             quantity=_quantity(row['quantity'], allow_zero=True)))
+                seen.add(lot_id)
+            except (KeyError, ValueError, InvalidOperation) as e:
+                self._reject('inventory', line, e, row)
+
+        with transaction.atomic():
+            Inventory.objects.bulk_create(inventories, batch_size=self.batch_size)
+            capture_changes('inventory', [inventory.production_id for inventory in inventories], 'insert')
+        return len(inventories)
+
+    def _import_shipments(self, chunk):
+        """
+        出荷データを検証して書き込み、在庫をロットごとに合計して差し引く
+        """
+        now = timezone.now()
+        shipments = []
+        decrements = defaultdict(Decimal)
+        for line, row in chunk:
+            try:
+                lot_id = self._lot_id(row)
+                quantity = _quantity(row['quantity'])
+                shipment = Shipment(
+                    production_id=lot_id,
+                    shipment_date=_date(row['shipment_date']),
+                    quantity=quantity,
+                    customer_name=_text(row['customer_name'], 100, required=True),
+                    customer_contact=_text(row.get('customer_contact'), 100),
+                    created_at=_timestamp(row.get('created_at'), now),
+                )
+                if self.stock is not None:
+                    if self.stock[lot_id] < quantity:
+                        raise ValueError(f"在庫が不足しています: {row['production_id']}")
+                    self.stock[lot_id] -= quantity
+                    decrements[lot_id] += quantity
+                shipments.append(shipment)
+            except (KeyError, ValueError, InvalidOperation) as e:
+                self._reject('shipment', line, e, row)
+
+        with transaction.atomic():
+            Shipment.objects.bulk_create(shipments, batch_size=self.batch_size)
+            record_movements(shipment_movements(shipments), batch_size=self.batch_size)
+            capture_changes('shipment', [shipment.pk for shipment in shipments], 'insert')
+            self._apply_decrements(decrements)
+        return len(shipments)
+
+    def _apply_decrements(self, decrements):
+        """
+        ロットごとの出荷量の合計を、CASE式を使ったUPDATEでまとめて在庫から差し引く
+        """
+        items = list(decrements.items())
+        now = timezone.now()
+        for start in range(0, len(items), DECREMENT_BATCH_SIZE):
+            batch = items[start:start + DECREMENT_BATCH_SIZE]
+            Inventory.objects.filter(production_id__in=[lot_id for lot_id, _ in batch]).update(
+                quantity=F('quantity') - Case(
+                    *[When(production_id=lot_id, then=Value(quantity)) for lot_id, quantity in batch],
+                    output_field=DecimalField(max_digits=10, decimal_places=2),
+                ),
+                last_updated=now,
+            )
+            capture_changes('inventory', [lot_id for lot_id, _ in batch], 'update')
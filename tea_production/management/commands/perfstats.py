@@ -0,0 +1,84 @@
+"""
+PerfStatsMiddleware が記録したビューごとの応答時間とSQLの集計を表示する
+
+    python manage.py perfstats
+    python manage.py perfstats --sort queries --top 10
+    python manage.py perfstats --json > perfstats.json
+    python manage.py perfstats --reset
+"""
+import json
+
+from django.conf import settings
+from django.core.management.base import BaseCommand, CommandError
+
+from tea_production.perf import LATENCY_BUCKETS_MS, load_stats, percentile, reset_stats
+
+SORT_KEYS = {
+    'total': lambda stats: stats['total_ms'],
+    'mean': lambda stats: stats['total_ms'] / stats['requests'],
+    'queries': lambda stats: stats['queries'] / stats['requests'],
+    'sql': lambda stats: stats['sql_ms'],
+    'requests': lambda stats: stats['requests'],
+}
+
+
+def _format_ms(value):
+    return f'>{LATENCY_BUCKETS_MS[-1]}' if value is None else str(value)
+
+
+class Command(BaseCommand):
+    help = 'ビューごとの応答時間とSQLの集計を表示する'
+
+    def add_arguments(self, parser):
+        parser.add_argument('--sort', choices=sorted(SORT_KEYS), default='total',
+                            help='並び替えの基準（既定は応答時間の合計）')
+        parser.add_argument('--top', type=int, help='表示するビューの数')
+        parser.add_argument('--json', action='store_true', help='集計をJSONで出力する')
+        parser.add_argument('--reset', action='store_true', help='記録された集計を削除する')
+
+    def handle(self, *args, **options):
+        directory = getattr(settings, 'TEA_PERF_STATS_DIR', None)
+        if not directory:
+            raise CommandError('TEA_PERF_STATS_DIR が設定されていません')
+
+        if options['reset']:
+            count = reset_stats(directory)
+            self.stdout.write(self.style.SUCCESS(f'集計ファイルを {count} 件削除しました'))
+            return
+
+        views = load_stats(directory)
+        if options['json']:
+            self.stdout.write(json.dumps({
+                'latency_buckets_ms': LATENCY_BUCKETS_MS,
+                'views': views,
+            }, ensure_ascii=False, indent=2))
+            return
+        if not views:
+            self.stdout.write('記録された集計はありません（TEA_PERF_ENABLED を有効にしてください）')
+            return
+
+        ranked = sorted(views.items(), key=lambda item: SORT_KEYS[options['sort']](item[1]), reverse=True)
+        if options['top']:
+            ranked = ranked[:options['top']]
+
+        self.stdout.write(f"{'view':<44} {'reqs':>7} {'mean ms':>9} {'p50':>6} {'p95':>6} {'max ms':>9} "
+                          f"{'queries':>8} {'sql ms':>8} {'N+1':>5}")
+        for view, stats in ranked:
+            requests = stats['requests']
+            self.stdout.write(
+                f"{view:<44} {requests:>7} {stats['total_ms'] / requests:>9.1f} "
+                f"{_format_ms(percentile(stats['histogram'], 0.5)):>6} "
+                f"{_format_ms(percentile(stats['histogram'], 0.95)):>6} {stats['max_ms']:>9.1f} "
+                f"{stats['queries'] / requests:>8.1f} {stats['sql_ms'] / requests:>8.1f} "
+                f"{stats['n_plus_one_requests']:>5}"
+            )
+
+        flagged = [(view, stats) for view, stats in ranked if stats['n_plus_one_shapes']]
+        if flagged:
+            self.stdout.write('')
+            self.stdout.write(self.style.WARNING('N+1 の疑いがあるSQL（同じ形のSQLを繰り返したリクエスト数）'))
+            for view, stats in flagged:
+                self.stdout.write(f'  {view}')
+                shapes = sorted(stats['n_plus_one_shapes'].items(), key=lambda item: item[1], reverse=True)
+                for shape, count in shapes:
+                    self.stdout.write(f'    {count:>5}  {shape[:160]}')
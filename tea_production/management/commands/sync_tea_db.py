@@ -0,0 +1,49 @@
+"""
+database.py のデータベース（tea_production.db）とDjangoのデータベースを、前回の同期以降の変更だけで同期する
+
+    python manage.py sync_tea_db
+    python manage.py sync_tea_db --raw-db /path/to/tea_production.db --batch-size 1000
+    python manage.py sync_tea_db --direction pull
+"""
+import sqlite3
+import time
+
+from django.core.management.base import BaseCommand, CommandError
+from django.db import DatabaseError
+
+from database import DEFAULT_DB_PATH, create_connection, migrate
+from tea_production.sync import BATCH_SIZE, SyncError, sync
+
+# 同期の方向（pull: tea_production.db からDjangoへ、push: Djangoから tea_production.db へ）
+DIRECTIONS = ('both', 'pull', 'push')
+
+
+class Command(BaseCommand):
+    help = 'tea_production.db とDjangoのデータベースを、前回の同期以降の変更だけで同期します'
+
+    def add_arguments(self, parser):
+        parser.add_argument('--raw-db', default=DEFAULT_DB_PATH, help='tea_production.db のパス')
+        parser.add_argument('--batch-size', type=int, default=BATCH_SIZE,
+                            help='1トランザクションで反映する変更の件数')
+        parser.add_argument('--direction', choices=DIRECTIONS, default='both', help='同期の方向')
+
+    def handle(self, *args, **options):
+        conn = create_connection(options['raw_db'])
+        if conn is None:
+            raise CommandError(f"データベースに接続できません: {options['raw_db']}")
+        direction = options['direction']
+        start = time.perf_counter()
+        try:
+            # 変更の記録用のテーブルとトリガーがなければ作る
+            migrate(conn)
+            result = sync(conn, options['batch_size'],
+                          pull=direction in ('both', 'pull'), push=direction in ('both', 'push'))
+        except SyncError as e:
+            raise CommandError(f'同期を中断しました（反映済みのバッチは次回の同期で再開します）: {e}') from e
+        except (DatabaseError, sqlite3.Error) as e:
+            raise CommandError(f'データベースのエラーで同期を中断しました（反映済みのバッチは次回の同期で再開します）: {e}') from e
+        finally:
+            conn.close()
+        self.stdout.write(self.style.SUCCESS(
+            f"同期が完了しました（tea_production.db から {result['pulled']}件、"
+            f"Djangoから {result['pushed']}件の変更を反映、{time.perf_counter() - start:.1f}秒）"))
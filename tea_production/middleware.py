@@ -0,0 +1,66 @@
+import time
+from asgiref.sync import iscoroutinefunction, markcoroutinefunction
+from django.conf import settings
+from django.core.exceptions import MiddlewareNotUsed
+from django.db import connections
+from django.db.backends.signals import connection_created
+from .perf import QueryRecorder, install_query_recorder, perf_stats, recording
+
+class PerfStatsMiddleware:
+    """
+    ビューごとの応答時間・SQLの件数と合計時間を記録するミドルウェア
+    設定 TEA_PERF_ENABLED が有効な場合だけ動き、同じ形のSQLを TEA_PERF_N_PLUS_ONE_THRESHOLD 回以上
+    実行したリクエストを N+1 の疑いとして数える。集計は manage.py perfstats で表示する
+    TEA_PERF_SERVER_TIMING が有効な場合は Server-Timing ヘッダーで応答ごとの計測結果も返す
+    """
+    sync_capable = True
+    async_capable = True
+
+    def __init__(self, get_response):
+        if not getattr(settings, 'TEA_PERF_ENABLED', False):
+            raise MiddlewareNotUsed
+        self.get_response = get_response
+        self.threshold = getattr(settings, 'TEA_PERF_N_PLUS_ONE_THRESHOLD', 5)
+        self.server_timing = getattr(settings, 'TEA_PERF_SERVER_TIMING', False)
+        self.async_mode = iscoroutinefunction(get_response)
+        if self.async_mode:
+            markcoroutinefunction(self)
+        # SQLを記録する execute_wrapper は接続ごとに1つだけ入れ、どのリクエストの記録かはコンテキストで区別する
+        connection_created.connect(install_query_recorder, dispatch_uid='tea_production.perf')
+        for connection in connections.all(initialized_only=True):
+            install_query_recorder(connection)
+
+    def __call__(self, request):
+        if self.async_mode:
+            return self.__acall__(request)
+        recorder = QueryRecorder()
+        start = time.perf_counter()
+        with recording(recorder):
+            response = self.get_response(request)
+        return self._finish(request, response, recorder, start)
+
+    async def __acall__(self, request):
+        recorder = QueryRecorder()
+        start = time.perf_counter()
+        # 同時に処理する他のリクエストのSQLと混ざらないよう、このリクエストのコンテキストで記録する
+        with recording(recorder):
+            response = await self.get_response(request)
+        return self._finish(request, response, recorder, start)
+
+    def _finish(self, request, response, recorder, start):
+        # ストリーミングレスポンスは本文を送る前までの時間になる
+        elapsed_ms = (time.perf_counter() - start) * 1000
+        match = request.resolver_match
+        # URLに一致しなかったリクエストはまとめて数える（ビューの名前の種類が増えすぎないようにする）
+        view = match.view_name if match else '(unresolved)'
+        repeated = recorder.repeated_shapes(self.threshold)
+        perf_stats.record(view, elapsed_ms, recorder, repeated)
+        if self.server_timing:
+            timings = [
+                f'total;dur={elapsed_ms:.1f}',
+                f'db;dur={recorder.seconds * 1000:.1f};desc="{recorder.count} queries"',
+            ]
+            if repeated:
+                timings.append(f'nplusone;desc="{max(repeated.values())} repeated queries"')
+            response.headers['Server-Timing'] = ', '.join(timings)
+        return response
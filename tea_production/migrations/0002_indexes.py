@@ -0,0 +1,55 @@
+# Generated by Django 4.2.20 on 2026-10-17 16:24
+
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ("tea_production", "0001_initial"),
+    ]
+
+    operations = [
+        migrations.AddIndex(
+            model_name="inventory",
+            index=models.Index(
+                fields=["last_updated"], name="inventory_last_updated_idx"
+            ),
+        ),
+        migrations.AddIndex(
+            model_name="inventory",
+            index=models.Index(
+                condition=models.Q(("quantity__gt", 0)),
+                fields=["production", "quantity"],
+                name="inventory_in_stock_idx",
+            ),
+        ),
+        migrations.AddIndex(
+            model_name="production",
+            index=models.Index(fields=["production_date"], name="production_date_idx"),
+        ),
+        migrations.AddIndex(
+            model_name="production",
+            index=models.Index(
+                fields=["tea_type", "production_date"],
+                name="production_tea_type_date_idx",
+            ),
+        ),
+        migrations.AddIndex(
+            model_name="production",
+            index=models.Index(
+                fields=["quality_check"], name="production_quality_check_idx"
+            ),
+        ),
+        migrations.AddIndex(
+            model_name="shipment",
+            index=models.Index(fields=["shipment_date"], name="shipment_date_idx"),
+        ),
+        migrations.AddIndex(
+            model_name="shipment",
+            index=models.Index(
+                fields=["customer_name", "shipment_date"],
+                name="shipment_customer_date_idx",
+            ),
+        ),
+    ]
@@ -0,0 +1,55 @@
+# Generated by Django 4.2.20 on 2026-10-17 17:34
+
+from django.db import migrations, models
+
+
+def create_rollup_state(apps, schema_editor):
+    # 初回の更新で全期間を集計する
+    apps.get_model('tea_production', 'RollupState').objects.create(pk=1, dirty_since=None, clean=False)
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('tea_production', '0002_indexes'),
+    ]
+
+    operations = [
+        migrations.CreateModel(
+            name='RollupState',
+            fields=[
+                ('id', models.BigAutoField(auto_created=True, primary_key=True, serialize=False, verbose_name='ID')),
+                ('dirty_since', models.DateField(blank=True, null=True, verbose_name='未更新の開始日')),
+                ('clean', models.BooleanField(default=False, verbose_name='更新済み')),
+                ('version', models.PositiveIntegerField(default=0, verbose_name='変更の版')),
+            ],
+            options={
+                'verbose_name': '期間別集計の状態',
+                'verbose_name_plural': '期間別集計の状態',
+            },
+        ),
+        migrations.CreateModel(
+            name='PeriodRollup',
+            fields=[
+                ('id', models.BigAutoField(auto_created=True, primary_key=True, serialize=False, verbose_name='ID')),
+                ('period', models.CharField(choices=[('day', '日次'), ('week', '週次'), ('month', '月次')], max_length=10, verbose_name='期間')),
+                ('period_start', models.DateField(verbose_name='期間の開始日')),
+                ('tea_type', models.CharField(max_length=50, verbose_name='茶葉の種類')),
+                ('quality_check', models.CharField(blank=True, max_length=50, verbose_name='品質評価')),
+                ('produced_quantity', models.DecimalField(decimal_places=2, max_digits=12, verbose_name='生産量(kg)')),
+                ('shipped_quantity', models.DecimalField(decimal_places=2, max_digits=12, verbose_name='出荷量(kg)')),
+                ('closing_stock', models.DecimalField(decimal_places=2, max_digits=12, verbose_name='期末在庫(kg)')),
+            ],
+            options={
+                'verbose_name': '期間別集計',
+                'verbose_name_plural': '期間別集計',
+                'ordering': ['period', 'period_start', 'tea_type', 'quality_check'],
+                'indexes': [models.Index(fields=['period', 'period_start'], name='period_rollup_start_idx')],
+            },
+        ),
+        migrations.AddConstraint(
+            model_name='periodrollup',
+            constraint=models.UniqueConstraint(fields=('period', 'tea_type', 'quality_check', 'period_start'), name='period_rollup_unique'),
+        ),
+        migrations.RunPython(create_rollup_state, migrations.RunPython.noop),
+    ]
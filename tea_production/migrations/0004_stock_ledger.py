@@ -0,0 +1,84 @@
+# Generated by Django 4.2.20 on 2026-10-17 17:45
+
+from django.db import migrations, models
+import django.db.models.deletion
+import django.utils.timezone
+
+
+def backfill_stock_ledger(apps, schema_editor):
+    # 既存の生産・出荷データから台帳を作る（変更の履歴はないため、現在の値を作成時の増減とする）
+    Production = apps.get_model('tea_production', 'Production')
+    Shipment = apps.get_model('tea_production', 'Shipment')
+    StockMovement = apps.get_model('tea_production', 'StockMovement')
+    productions = Production.objects.values_list('id', 'production_date', 'quantity').order_by('id')
+    shipments = Shipment.objects.values_list('id', 'production_id', 'shipment_date', 'quantity').order_by('id')
+    StockMovement.objects.bulk_create((
+        StockMovement(production_id=pk, movement_date=date, quantity=quantity, source='production', source_id=pk)
+        for pk, date, quantity in productions.iterator(chunk_size=2000)
+    ), batch_size=2000)
+    StockMovement.objects.bulk_create((
+        StockMovement(production_id=production_id, movement_date=date, quantity=-quantity, source='shipment',
+                      source_id=pk)
+        for pk, production_id, date, quantity in shipments.iterator(chunk_size=2000)
+    ), batch_size=2000)
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('tea_production', '0003_period_rollup'),
+    ]
+
+    operations = [
+        migrations.CreateModel(
+            name='StockCheckpoint',
+            fields=[
+                ('id', models.BigAutoField(auto_created=True, primary_key=True, serialize=False, verbose_name='ID')),
+                ('snapshot_date', models.DateField(unique=True, verbose_name='スナップショットの日付')),
+                ('lot_count', models.PositiveIntegerField(verbose_name='ロット数')),
+                ('created_at', models.DateTimeField(default=django.utils.timezone.now, verbose_name='作成日時')),
+            ],
+            options={
+                'verbose_name': '在庫スナップショット',
+                'verbose_name_plural': '在庫スナップショット',
+            },
+        ),
+        migrations.CreateModel(
+            name='StockSnapshot',
+            fields=[
+                ('id', models.BigAutoField(auto_created=True, primary_key=True, serialize=False, verbose_name='ID')),
+                ('snapshot_date', models.DateField(verbose_name='スナップショットの日付')),
+                ('quantity', models.DecimalField(decimal_places=2, max_digits=12, verbose_name='在庫量(kg)')),
+                ('production', models.ForeignKey(db_constraint=False, on_delete=django.db.models.deletion.DO_NOTHING, related_name='+', to='tea_production.production', verbose_name='生産データ')),
+            ],
+            options={
+                'verbose_name': '在庫スナップショットの明細',
+                'verbose_name_plural': '在庫スナップショットの明細',
+            },
+        ),
+        migrations.CreateModel(
+            name='StockMovement',
+            fields=[
+                ('id', models.BigAutoField(auto_created=True, primary_key=True, serialize=False, verbose_name='ID')),
+                ('movement_date', models.DateField(verbose_name='日付')),
+                ('quantity', models.DecimalField(decimal_places=2, max_digits=12, verbose_name='増減量(kg)')),
+                ('source', models.CharField(choices=[('production', '生産'), ('shipment', '出荷')], max_length=20, verbose_name='種別')),
+                ('source_id', models.BigIntegerField(verbose_name='元データID')),
+                ('recorded_at', models.DateTimeField(default=django.utils.timezone.now, verbose_name='記録日時')),
+                ('production', models.ForeignKey(db_constraint=False, on_delete=django.db.models.deletion.DO_NOTHING, related_name='+', to='tea_production.production', verbose_name='生産データ')),
+            ],
+            options={
+                'verbose_name': '在庫台帳',
+                'verbose_name_plural': '在庫台帳',
+            },
+        ),
+        migrations.AddConstraint(
+            model_name='stocksnapshot',
+            constraint=models.UniqueConstraint(fields=('snapshot_date', 'production'), name='stock_snapshot_unique'),
+        ),
+        migrations.AddIndex(
+            model_name='stockmovement',
+            index=models.Index(fields=['movement_date'], name='stock_movement_date_idx'),
+        ),
+        migrations.RunPython(backfill_stock_ledger, migrations.RunPython.noop),
+    ]
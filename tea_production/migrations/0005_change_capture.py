@@ -0,0 +1,74 @@
+# Generated by Django 4.2.20 on 2026-10-17 17:52
+
+from django.db import migrations, models
+import django.utils.timezone
+
+
+def seed_change_log(apps, schema_editor):
+    # 既存の行は最初の同期ですべて反映する（在庫は生産データIDで識別する）
+    ChangeLog = apps.get_model('tea_production', 'ChangeLog')
+    for model_name, key in (('Production', 'id'), ('Inventory', 'production_id'), ('Shipment', 'id')):
+        keys = apps.get_model('tea_production', model_name).objects.values_list(key, flat=True).order_by(key)
+        ChangeLog.objects.bulk_create((
+            ChangeLog(table_name=model_name.lower(), row_id=row_id, operation='insert')
+            for row_id in keys.iterator(chunk_size=2000)
+        ), batch_size=2000)
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('tea_production', '0004_stock_ledger'),
+    ]
+
+    operations = [
+        migrations.CreateModel(
+            name='ChangeLog',
+            fields=[
+                ('id', models.BigAutoField(auto_created=True, primary_key=True, serialize=False, verbose_name='ID')),
+                ('table_name', models.CharField(max_length=20, verbose_name='テーブル')),
+                ('row_id', models.BigIntegerField(verbose_name='行のID')),
+                ('operation', models.CharField(choices=[('insert', '追加'), ('update', '更新'), ('delete', '削除')], max_length=10, verbose_name='操作')),
+                ('changed_at', models.DateTimeField(default=django.utils.timezone.now, verbose_name='変更日時')),
+            ],
+            options={
+                'verbose_name': '変更の記録',
+                'verbose_name_plural': '変更の記録',
+            },
+        ),
+        migrations.CreateModel(
+            name='SyncCursor',
+            fields=[
+                ('id', models.BigAutoField(auto_created=True, primary_key=True, serialize=False, verbose_name='ID')),
+                ('source', models.CharField(max_length=20, unique=True, verbose_name='同期元')),
+                ('last_seq', models.BigIntegerField(default=0, verbose_name='反映済みの記録番号')),
+                ('synced_at', models.DateTimeField(default=django.utils.timezone.now, verbose_name='同期日時')),
+            ],
+            options={
+                'verbose_name': '同期の状態',
+                'verbose_name_plural': '同期の状態',
+            },
+        ),
+        migrations.CreateModel(
+            name='SyncedRow',
+            fields=[
+                ('id', models.BigAutoField(auto_created=True, primary_key=True, serialize=False, verbose_name='ID')),
+                ('table_name', models.CharField(max_length=20, verbose_name='テーブル')),
+                ('raw_id', models.BigIntegerField(verbose_name='元の行のID')),
+                ('django_id', models.BigIntegerField(verbose_name='作成した行のID')),
+            ],
+            options={
+                'verbose_name': '同期した行',
+                'verbose_name_plural': '同期した行',
+            },
+        ),
+        migrations.AddConstraint(
+            model_name='syncedrow',
+            constraint=models.UniqueConstraint(fields=('table_name', 'raw_id'), name='synced_row_raw_unique'),
+        ),
+        migrations.AddConstraint(
+            model_name='syncedrow',
+            constraint=models.UniqueConstraint(fields=('table_name', 'django_id'), name='synced_row_django_unique'),
+        ),
+        migrations.RunPython(seed_change_log, migrations.RunPython.noop),
+    ]
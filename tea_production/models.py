@@ -1,6 +1,7 @@
 from django.db import models
 from django.utils import timezone
 
+
 class Production(models.Model):
     """
     茶葉の生産データを管理するモデル
@@ -29,10 +30,17 @@ class Production(models.Model):
         verbose_name = '生産データ'
         verbose_name_plural = '生産データ'
         ordering = ['-production_date']
+        # SQLiteのインデックスは末尾にIDを含むため、(日付, ID) の並び替えにもそのまま使える
+        indexes = [
+            models.Index(fields=['production_date'], name='production_date_idx'),
+            models.Index(fields=['tea_type', 'production_date'], name='production_tea_type_date_idx'),
+            models.Index(fields=['quality_check'], name='production_quality_check_idx'),
+        ]
 
     def __str__(self):
         return f"{self.production_date} - {self.tea_type} ({self.quantity}kg)"
 
+
 class Shipment(models.Model):
     """
     出荷データを管理するモデル
@@ -52,10 +60,15 @@ class Shipment(models.Model):
         verbose_name = '出荷データ'
         verbose_name_plural = '出荷データ'
         ordering = ['-shipment_date']
+        indexes = [
+            models.Index(fields=['shipment_date'], name='shipment_date_idx'),
+            models.Index(fields=['customer_name', 'shipment_date'], name='shipment_customer_date_idx'),
+        ]
 
     def __str__(self):
         return f"{self.shipment_date} - {self.customer_name} ({self.quantity}kg)"
 
+
 class Inventory(models.Model):
     """
     在庫データを管理するモデル
@@ -72,6 +85,183 @@ class Inventory(models.Model):
         verbose_name = '在庫データ'
         verbose_name_plural = '在庫データ'
         ordering = ['-last_updated']
+        indexes = [
+            models.Index(fields=['last_updated'], name='inventory_last_updated_idx'),
+            # 在庫のあるロットだけを対象にする部分インデックス（ダッシュボードと在庫ロット検索で使う）
+            models.Index(fields=['production', 'quantity'], condition=models.Q(quantity__gt=0),
+                         name='inventory_in_stock_idx'),
+        ]
+
+    def __str__(self):
+        return f"{self.production.tea_type} - {self.quantity}kg" 
+
+
+class PeriodRollup(models.Model):
+    """
+    茶葉の種類・品質評価ごとの期間別（日次・週次・月次）の生産量・出荷量・期末在庫
+    tea_production.rollups が生産・出荷データから再計算する
+    """
+    PERIODS = [
+        ('day', '日次'),
+        ('week', '週次'),
+        ('month', '月次'),
+    ]
+
+    period = models.CharField('期間', max_length=10, choices=PERIODS)
+    period_start = models.DateField('期間の開始日')
+    tea_type = models.CharField('茶葉の種類', max_length=50)
+    quality_check = models.CharField('品質評価', max_length=50, blank=True)
+    produced_quantity = models.DecimalField('生産量(kg)', max_digits=12, decimal_places=2)
+    shipped_quantity = models.DecimalField('出荷量(kg)', max_digits=12, decimal_places=2)
+    closing_stock = models.DecimalField('期末在庫(kg)', max_digits=12, decimal_places=2)
+
+    class Meta:
+        verbose_name = '期間別集計'
+        verbose_name_plural = '期間別集計'
+        ordering = ['period', 'period_start', 'tea_type', 'quality_check']
+        constraints = [
+            models.UniqueConstraint(fields=['period', 'tea_type', 'quality_check', 'period_start'],
+                                    name='period_rollup_unique'),
+        ]
+        indexes = [
+            models.Index(fields=['period', 'period_start'], name='period_rollup_start_idx'),
+        ]
 
     def __str__(self):
-        return f"{self.production.tea_type} - {self.quantity}kg" 
\ No newline at end of file
+        return f"{self.get_period_display()} {self.period_start} - {self.tea_type} {self.quality_check}"
+
+
+class RollupState(models.Model):
+    """
+    期間別集計の未更新の範囲（1行だけのテーブル）
+    dirty_since 以降の期間が未更新。clean が偽で dirty_since が空の場合は全期間を作り直す
+    """
+    dirty_since = models.DateField('未更新の開始日', blank=True, null=True)
+    clean = models.BooleanField('更新済み', default=False)
+    version = models.PositiveIntegerField('変更の版', default=0)
+
+    class Meta:
+        verbose_name = '期間別集計の状態'
+        verbose_name_plural = '期間別集計の状態'
+
+
+class StockMovement(models.Model):
+    """
+    在庫の増減の台帳（追記のみ）
+    生産で増え、出荷で減る。生産・出荷データの変更・削除は打ち消しの行を追記する
+    削除された生産データの行も残すため、外部キー制約は付けない
+    """
+    SOURCES = [
+        ('production', '生産'),
+        ('shipment', '出荷'),
+    ]
+
+    production = models.ForeignKey(
+        Production,
+        on_delete=models.DO_NOTHING,
+        db_constraint=False,
+        related_name='+',
+        verbose_name='生産データ'
+    )
+    movement_date = models.DateField('日付')
+    quantity = models.DecimalField('増減量(kg)', max_digits=12, decimal_places=2)
+    source = models.CharField('種別', max_length=20, choices=SOURCES)
+    source_id = models.BigIntegerField('元データID')
+    recorded_at = models.DateTimeField('記録日時', default=timezone.now)
+
+    class Meta:
+        verbose_name = '在庫台帳'
+        verbose_name_plural = '在庫台帳'
+        indexes = [
+            models.Index(fields=['movement_date'], name='stock_movement_date_idx'),
+        ]
+
+    def __str__(self):
+        return f"{self.movement_date} - ロット{self.production_id} ({self.quantity}kg)"
+
+
+class StockCheckpoint(models.Model):
+    """
+    ロットごとの在庫のスナップショットを作った日（その日の終わりの在庫）
+    """
+    snapshot_date = models.DateField('スナップショットの日付', unique=True)
+    lot_count = models.PositiveIntegerField('ロット数')
+    created_at = models.DateTimeField('作成日時', default=timezone.now)
+
+    class Meta:
+        verbose_name = '在庫スナップショット'
+        verbose_name_plural = '在庫スナップショット'
+
+
+class StockSnapshot(models.Model):
+    """
+    スナップショットの日の終わりのロットごとの在庫（在庫のあるロットだけ）
+    """
+    snapshot_date = models.DateField('スナップショットの日付')
+    production = models.ForeignKey(
+        Production,
+        on_delete=models.DO_NOTHING,
+        db_constraint=False,
+        related_name='+',
+        verbose_name='生産データ'
+    )
+    quantity = models.DecimalField('在庫量(kg)', max_digits=12, decimal_places=2)
+
+    class Meta:
+        verbose_name = '在庫スナップショットの明細'
+        verbose_name_plural = '在庫スナップショットの明細'
+        constraints = [
+            models.UniqueConstraint(fields=['snapshot_date', 'production'], name='stock_snapshot_unique'),
+        ]
+
+
+class ChangeLog(models.Model):
+    """
+    生産・出荷・在庫データの変更の記録（database.py のデータベースとの同期用）
+    行の値は記録せず、同期の時点の行の値を反映する。在庫は生産データIDで識別する
+    """
+    OPERATIONS = [
+        ('insert', '追加'),
+        ('update', '更新'),
+        ('delete', '削除'),
+    ]
+
+    table_name = models.CharField('テーブル', max_length=20)
+    row_id = models.BigIntegerField('行のID')
+    operation = models.CharField('操作', max_length=10, choices=OPERATIONS)
+    changed_at = models.DateTimeField('変更日時', default=timezone.now)
+
+    class Meta:
+        verbose_name = '変更の記録'
+        verbose_name_plural = '変更の記録'
+
+
+class SyncedRow(models.Model):
+    """
+    同期で作成した行と、元になった database.py のデータベースの行のIDの対応
+    （database.py のデータベースに作成した行の対応は、そちらの sync_id_map に記録する）
+    """
+    table_name = models.CharField('テーブル', max_length=20)
+    raw_id = models.BigIntegerField('元の行のID')
+    django_id = models.BigIntegerField('作成した行のID')
+
+    class Meta:
+        verbose_name = '同期した行'
+        verbose_name_plural = '同期した行'
+        constraints = [
+            models.UniqueConstraint(fields=['table_name', 'raw_id'], name='synced_row_raw_unique'),
+            models.UniqueConstraint(fields=['table_name', 'django_id'], name='synced_row_django_unique'),
+        ]
+
+
+class SyncCursor(models.Model):
+    """
+    相手のデータベースの変更をどこまで反映したか
+    """
+    source = models.CharField('同期元', max_length=20, unique=True)
+    last_seq = models.BigIntegerField('反映済みの記録番号', default=0)
+    synced_at = models.DateTimeField('同期日時', default=timezone.now)
+
+    class Meta:
+        verbose_name = '同期の状態'
+        verbose_name_plural = '同期の状態'
@@ -0,0 +1,135 @@
+import datetime
+from django.conf import settings
+from django.core.paginator import Paginator
+from django.db.models import DateTimeField, Max, Q, QuerySet
+from django.utils import timezone
+from django.utils.functional import cached_property
+
+DEFAULT_PAGE_SIZE = 50
+MAX_PAGE_SIZE = 500
+
+def get_page_size(requested=None):
+    """
+    1ページの表示件数を決める
+    指定がなければ設定値 TEA_LIST_PAGE_SIZE を使い、TEA_LIST_MAX_PAGE_SIZE を上限とする
+    """
+    default = getattr(settings, 'TEA_LIST_PAGE_SIZE', DEFAULT_PAGE_SIZE)
+    maximum = getattr(settings, 'TEA_LIST_MAX_PAGE_SIZE', MAX_PAGE_SIZE)
+    return min(requested or default, maximum)
+
+def filter_date_range(queryset, field_name, start_date=None, end_date=None):
+    """
+    日付範囲で絞り込む
+    日時のフィールドは日の境界の日時に変換し、インデックスを使える範囲条件にする
+    """
+    field = queryset.model._meta.get_field(field_name)
+    if isinstance(field, DateTimeField):
+        tz = timezone.get_current_timezone()
+        if start_date:
+            start = timezone.make_aware(datetime.datetime.combine(start_date, datetime.time.min), tz)
+            queryset = queryset.filter(**{f'{field_name}__gte': start})
+        if end_date:
+            end = timezone.make_aware(
+                datetime.datetime.combine(end_date + datetime.timedelta(days=1), datetime.time.min), tz)
+            queryset = queryset.filter(**{f'{field_name}__lt': end})
+        return queryset
+    if start_date:
+        queryset = queryset.filter(**{f'{field_name}__gte': start_date})
+    if end_date:
+        queryset = queryset.filter(**{f'{field_name}__lte': end_date})
+    return queryset
+
+class KeysetPage:
+    """
+    キーセット方式の1ページ分の結果
+    OFFSETを使わず、前ページの最後の (日付, ID) より後ろの行を読む
+    """
+    def __init__(self, items, date_field, has_next):
+        self.items = items
+        self.has_next = has_next
+        self.next_cursor = None
+        if has_next:
+            last = items[-1]
+            # values() の結果（辞書）にも対応する
+            if isinstance(last, dict):
+                self.next_cursor = (last[date_field], last['id'])
+            else:
+                self.next_cursor = (getattr(last, date_field), last.pk)
+
+    def __iter__(self):
+        return iter(self.items)
+
+    def __len__(self):
+        return len(self.items)
+
+def parse_cursor(model, date_field, after, after_id):
+    """
+    クエリ文字列のカーソルを (日付, ID) に変換する
+    不正な値の場合は None を返す（先頭ページを表示する）
+    """
+    if not after or after_id is None:
+        return None
+    try:
+        value = model._meta.get_field(date_field).to_python(after)
+    except Exception:
+        return None
+    if value is None:
+        return None
+    return value, after_id
+
+def keyset_query(queryset, date_field, cursor=None, page_size=DEFAULT_PAGE_SIZE, descending=True):
+    """
+    (日付, ID) の順でキーセットページネーションを行うQuerySetを作る
+    次ページの有無を判定するため、page_size より1件多く読む
+
+    :param queryset: 対象のQuerySet
+    :param date_field: 並び替えに使う日付（日時）のフィールド名
+    :param cursor: 前ページの最後の行の (日付, ID)。None の場合は先頭ページ
+    :param page_size: 1ページの件数
+    :param descending: 新しい順に並べるかどうか
+    :return: 1ページ分（+1件）のQuerySet
+    """
+    if descending:
+        queryset = queryset.order_by(f'-{date_field}', '-id')
+        op = 'lt'
+    else:
+        queryset = queryset.order_by(date_field, 'id')
+        op = 'gt'
+
+    if cursor is not None:
+        value, pk = cursor
+        queryset = queryset.filter(
+            Q(**{f'{date_field}__{op}': value}) | Q(**{date_field: value, f'id__{op}': pk})
+        )
+    return queryset[:page_size + 1]
+
+def keyset_paginate(queryset, date_field, cursor=None, page_size=DEFAULT_PAGE_SIZE, descending=True):
+    """
+    (日付, ID) の順でキーセットページネーションを行う
+    引数は keyset_query と同じ
+
+    :return: KeysetPage
+    """
+    items = list(keyset_query(queryset, date_field, cursor, page_size, descending))
+    return KeysetPage(items[:page_size], date_field, len(items) > page_size)
+
+async def akeyset_paginate(queryset, date_field, cursor=None, page_size=DEFAULT_PAGE_SIZE, descending=True):
+    """
+    keyset_paginate の非同期版
+    """
+    items = [item async for item in keyset_query(queryset, date_field, cursor, page_size, descending)]
+    return KeysetPage(items[:page_size], date_field, len(items) > page_size)
+
+class EstimatedCountPaginator(Paginator):
+    """
+    管理画面の一覧用のページネーター
+    絞り込みのない一覧では件数を COUNT(*) で数えず、主キーの最大値（インデックスの末尾を読むだけ）で見積もる
+    IDは再利用されず削除もまれなため、全件数の見積もりとしては十分に近い（削除があった分だけ多めになる）
+    絞り込み・検索がある場合はインデックスで対象を絞れるため、正確な件数を数える
+    """
+    @cached_property
+    def count(self):
+        queryset = self.object_list
+        if isinstance(queryset, QuerySet) and not queryset.query.where:
+            return queryset.aggregate(max_id=Max('pk'))['max_id'] or 0
+        return super().count
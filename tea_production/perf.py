@@ -0,0 +1,241 @@
+"""
+リクエストごとの応答時間とSQLの計測結果の集計
+
+PerfStatsMiddleware（設定 TEA_PERF_ENABLED）が記録し、manage.py perfstats で表示する
+集計はプロセスごとにメモリに持ち、一定の間隔で TEA_PERF_STATS_DIR にプロセスごとのJSONファイルとして書き出す
+（複数のワーカープロセスの結果は perfstats が読み込むときに合算する）
+"""
+import atexit
+import contextvars
+import glob
+import json
+import os
+import re
+import threading
+import time
+from collections import Counter
+from contextlib import contextmanager
+
+from django.conf import settings
+
+# 応答時間のヒストグラムの境界（ミリ秒）。最後の区間はこれより遅いもの
+LATENCY_BUCKETS_MS = (5, 10, 25, 50, 100, 250, 500, 1000, 2500, 5000)
+
+# 1つのビューについて記録する N+1 の疑いがあるSQLの種類の上限
+MAX_SHAPES_PER_VIEW = 20
+
+# IN句の値の数が違うだけのSQLを同じ形として扱う
+_IN_LIST = re.compile(r'\(\s*%s(?:\s*,\s*%s)*\s*\)')
+
+def query_shape(sql):
+    """
+    SQLの形（パラメータを除いた文）を求める
+    Djangoのクエリはパラメータが %s で渡されるため、IN句の値の数だけをそろえる
+    """
+    return _IN_LIST.sub('(%s, ...)', sql)
+
+class QueryRecorder:
+    """
+    1リクエストで実行されたSQLを記録する（connection.execute_wrapper に渡す）
+    """
+
+    def __init__(self):
+        self.count = 0
+        self.seconds = 0.0
+        self.shapes = Counter()
+
+    def __call__(self, execute, sql, params, many, context):
+        start = time.perf_counter()
+        try:
+            return execute(sql, params, many, context)
+        finally:
+            self.seconds += time.perf_counter() - start
+            self.count += 1
+            self.shapes[query_shape(sql)] += 1
+
+    def repeated_shapes(self, threshold):
+        """
+        threshold 回以上実行された同じ形のSQL（N+1 の疑い）を {SQL: 回数} で返す
+        """
+        return {shape: count for shape, count in self.shapes.items() if count >= threshold}
+
+# 処理中のリクエストの QueryRecorder
+# ASGIでは同じ接続で複数のリクエストのSQLが実行されるため、接続ではなくリクエストのコンテキストごとに持つ
+_current_recorder = contextvars.ContextVar('tea_perf_recorder', default=None)
+
+@contextmanager
+def recording(recorder):
+    """
+    このコンテキストで実行されるSQLを recorder に記録する
+    （非同期のORMが別スレッドで実行するSQLも、sync_to_async がコンテキストを引き継ぐため記録される）
+    """
+    token = _current_recorder.set(recorder)
+    try:
+        yield recorder
+    finally:
+        _current_recorder.reset(token)
+
+def record_query(execute, sql, params, many, context):
+    """
+    処理中のリクエストの QueryRecorder にSQLを記録する execute_wrapper（接続ごとに1つだけ入れる）
+    """
+    recorder = _current_recorder.get()
+    if recorder is None:
+        return execute(sql, params, many, context)
+    return recorder(execute, sql, params, many, context)
+
+def install_query_recorder(connection, **kwargs):
+    """
+    接続に record_query を入れる（connection_created シグナルの受信側）
+    他の execute_wrapper が出入りしても外れないように先頭に入れる
+    """
+    if record_query not in connection.execute_wrappers:
+        connection.execute_wrappers.insert(0, record_query)
+
+def _empty_view_stats():
+    return {
+        'requests': 0,
+        'total_ms': 0.0,
+        'max_ms': 0.0,
+        'histogram': [0] * (len(LATENCY_BUCKETS_MS) + 1),
+        'queries': 0,
+        'sql_ms': 0.0,
+        'n_plus_one_requests': 0,
+        'n_plus_one_shapes': {},
+    }
+
+class PerfStats:
+    """
+    ビューごとの計測結果をプロセス内で集計し、定期的にファイルに書き出す
+    """
+
+    def __init__(self, directory=None, flush_interval=None):
+        self.directory = directory
+        self.flush_interval = flush_interval
+        self.views = {}
+        self.lock = threading.Lock()
+        self.started = time.time()
+        self.last_flush = time.monotonic()
+
+    def _settings(self):
+        directory = self.directory or getattr(settings, 'TEA_PERF_STATS_DIR', None)
+        interval = self.flush_interval
+        if interval is None:
+            interval = getattr(settings, 'TEA_PERF_FLUSH_INTERVAL', 10)
+        return directory, interval
+
+    @property
+    def path(self):
+        directory, _ = self._settings()
+        if not directory:
+            return None
+        return os.path.join(directory, f'perfstats-{os.getpid()}-{int(self.started)}.json')
+
+    def record(self, view, elapsed_ms, recorder, repeated):
+        """
+        1リクエストの計測結果を加える
+
+        :param view: ビューの名前
+        :param elapsed_ms: 応答時間（ミリ秒）
+        :param recorder: そのリクエストの QueryRecorder
+        :param repeated: N+1 の疑いがあるSQLの {SQL: 回数}
+        """
+        with self.lock:
+            stats = self.views.setdefault(view, _empty_view_stats())
+            stats['requests'] += 1
+            stats['total_ms'] += elapsed_ms
+            stats['max_ms'] = max(stats['max_ms'], elapsed_ms)
+            bucket = next((i for i, bound in enumerate(LATENCY_BUCKETS_MS) if elapsed_ms <= bound),
+                          len(LATENCY_BUCKETS_MS))
+            stats['histogram'][bucket] += 1
+            stats['queries'] += recorder.count
+            stats['sql_ms'] += recorder.seconds * 1000
+            if repeated:
+                stats['n_plus_one_requests'] += 1
+                shapes = stats['n_plus_one_shapes']
+                for shape in repeated:
+                    if shape in shapes or len(shapes) < MAX_SHAPES_PER_VIEW:
+                        shapes[shape] = shapes.get(shape, 0) + 1
+            due = time.monotonic() - self.last_flush >= self._settings()[1]
+        if due:
+            self.flush()
+
+    def flush(self):
+        """
+        このプロセスの集計をファイルに書き出す（一時ファイルに書いてから置き換える）
+        """
+        with self.lock:
+            self.last_flush = time.monotonic()
+            if not self.views:
+                return
+            data = json.dumps({'pid': os.getpid(), 'started': self.started, 'views': self.views},
+                              ensure_ascii=False)
+        path = self.path
+        if not path:
+            return
+        os.makedirs(os.path.dirname(path), exist_ok=True)
+        tmp = f'{path}.tmp'
+        with open(tmp, 'w', encoding='utf-8') as f:
+            f.write(data)
+        os.replace(tmp, path)
+
+def merge_view_stats(total, stats):
+    """
+    ビューの集計 stats を total に合算する
+    """
+    total['requests'] += stats['requests']
+    total['total_ms'] += stats['total_ms']
+    total['max_ms'] = max(total['max_ms'], stats['max_ms'])
+    total['histogram'] = [a + b for a, b in zip(total['histogram'], stats['histogram'])]
+    total['queries'] += stats['queries']
+    total['sql_ms'] += stats['sql_ms']
+    total['n_plus_one_requests'] += stats['n_plus_one_requests']
+    for shape, count in stats['n_plus_one_shapes'].items():
+        total['n_plus_one_shapes'][shape] = total['n_plus_one_shapes'].get(shape, 0) + count
+    return total
+
+def load_stats(directory):
+    """
+    TEA_PERF_STATS_DIR に書き出された全プロセスの集計を読み込み、ビューごとに合算する
+
+    :param directory: 集計ファイルのディレクトリ
+    :return: {ビューの名前: 集計}
+    """
+    views = {}
+    for path in sorted(glob.glob(os.path.join(directory, 'perfstats-*.json'))):
+        with open(path, encoding='utf-8') as f:
+            data = json.load(f)
+        for view, stats in data['views'].items():
+            merge_view_stats(views.setdefault(view, _empty_view_stats()), stats)
+    return views
+
+def reset_stats(directory):
+    """
+    書き出された集計ファイルを削除する
+
+    :return: 削除したファイルの数
+    """
+    paths = glob.glob(os.path.join(directory, 'perfstats-*.json'))
+    for path in paths:
+        os.remove(path)
+    return len(paths)
+
+def percentile(histogram, fraction):
+    """
+    ヒストグラムから分位点（その区間の上限のミリ秒）を求める
+    最後の区間に入る場合は None（上限なし）を返す
+    """
+    total = sum(histogram)
+    if not total:
+        return None
+    target = total * fraction
+    seen = 0
+    for i, count in enumerate(histogram):
+        seen += count
+        if seen >= target:
+            return LATENCY_BUCKETS_MS[i] if i < len(LATENCY_BUCKETS_MS) else None
+    return None
+
+# プロセス全体で共有する集計（終了時にも書き出す）
+perf_stats = PerfStats()
+atexit.register(perf_stats.flush)
@@ -0,0 +1,171 @@
+"""
+期間別集計（日次・週次・月次）の更新と読み出し
+
+生産・出荷データの変更時にシグナルが変更された最も古い日付を RollupState に記録し、
+参照時にその日を含む期間から後ろだけを再計算する（計算は rollups.compute_rollups を使う）
+"""
+from decimal import Decimal
+
+import pandas as pd
+from django.db import transaction
+from django.db.models import Case, DateField, F, Max, Min, Q, Sum, Value, When
+from django.db.models.functions import Least
+
+from rollups import PERIODS, NO_GRADE, compute_rollups, period_floor
+from .models import PeriodRollup, Production, RollupState, Shipment
+
+# RollupState の唯一の行のID
+STATE_ID = 1
+
+# 1回のINSERTで書き込む行数
+BATCH_SIZE = 2000
+
+# JSON APIで返す項目
+ROLLUP_FIELDS = ['id', 'period_start', 'tea_type', 'quality_check',
+                 'produced_quantity', 'shipped_quantity', 'closing_stock']
+
+MOVEMENT_COLUMNS = ['date', 'tea_type', 'quality_check', 'quantity']
+
+def mark_rollups_dirty(since=None):
+    """
+    期間別集計を since を含む期間から後ろについて未更新にする
+
+    :param since: 変更された最も古い日付（Noneの場合は全期間を作り直す）
+    """
+    values = {'clean': False, 'version': F('version') + 1}
+    if since is None:
+        values['dirty_since'] = None
+    else:
+        since = Value(since, output_field=DateField())
+        # SQLiteの MIN() は NULL を含むと NULL を返すため、全期間が未更新の状態はそのまま残る
+        values['dirty_since'] = Case(When(clean=True, then=since), default=Least('dirty_since', since))
+    if not RollupState.objects.filter(pk=STATE_ID).update(**values):
+        RollupState.objects.get_or_create(pk=STATE_ID)
+
+def _movements(start):
+    """
+    start 以降の日ごとの生産量と出荷量を茶葉の種類・品質評価ごとに読む
+    """
+    productions = (Production.objects.filter(production_date__gte=start)
+                   .values('tea_type', 'quality_check', date=F('production_date'))
+                   .annotate(total=Sum('quantity')).values_list('date', 'tea_type', 'quality_check', 'total')
+                   .order_by())
+    shipments = (Shipment.objects.filter(shipment_date__gte=start)
+                 .values(date=F('shipment_date'), tea_type=F('production__tea_type'),
+                         quality_check=F('production__quality_check'))
+                 .annotate(total=Sum('quantity')).values_list('date', 'tea_type', 'quality_check', 'total')
+                 .order_by())
+    return (pd.DataFrame.from_records(list(productions), columns=MOVEMENT_COLUMNS),
+            pd.DataFrame.from_records(list(shipments), columns=MOVEMENT_COLUMNS))
+
+def _openings(period, start):
+    """
+    start の直前の期間の期末在庫を読む
+    """
+    rollups = PeriodRollup.objects.filter(period=period)
+    previous = rollups.filter(period_start__lt=start).aggregate(last=Max('period_start'))['last']
+    return pd.DataFrame.from_records(
+        list(rollups.filter(period_start=previous).values_list('tea_type', 'quality_check', 'closing_stock'))
+        if previous else [],
+        columns=['tea_type', 'quality_check', 'closing_stock'])
+
+def _has_new_keys(period, productions, shipments):
+    """
+    期間別集計にまだない茶葉の種類・品質評価が含まれるかどうか
+    """
+    known = set(PeriodRollup.objects.filter(period=period)
+                .values_list('tea_type', 'quality_check').distinct().order_by())
+    keys = pd.concat([productions, shipments])[['tea_type', 'quality_check']].fillna(NO_GRADE)
+    return not set(keys.itertuples(index=False, name=None)) <= known
+
+def _date_bounds():
+    """
+    生産日・出荷日の最小値と最大値（データがなければ (None, None)）
+    """
+    production = Production.objects.aggregate(first=Min('production_date'), last=Max('production_date'))
+    shipment = Shipment.objects.aggregate(first=Min('shipment_date'), last=Max('shipment_date'))
+    firsts = [d for d in (production['first'], shipment['first']) if d]
+    lasts = [d for d in (production['last'], shipment['last']) if d]
+    return (min(firsts), max(lasts)) if firsts else (None, None)
+
+def _decimal(value):
+    return Decimal(f'{value:.2f}')
+
+def refresh_rollups(full=False):
+    """
+    期間別集計を、前回の更新以降に変更された最も古い日付を含む期間から再計算する
+    再計算中に書き込みがあった場合は未更新のまま残し、次の参照時にもう一度更新する
+
+    :param full: Trueの場合は全期間を作り直す
+    :return: 書き込んだ行数（更新が不要な場合は0）
+    """
+    state, _ = RollupState.objects.get_or_create(pk=STATE_ID)
+    if state.clean and not full:
+        return 0
+    since = None if full else state.dirty_since
+    first_date, end = _date_bounds()
+
+    written = 0
+    with transaction.atomic():
+        for period in PERIODS:
+            if first_date is None:
+                PeriodRollup.objects.filter(period=period).delete()
+                continue
+            start = period_floor(since or first_date, period).date()
+            productions, shipments = _movements(start)
+            rebuild = not since
+            if not rebuild and _has_new_keys(period, productions, shipments):
+                # 新しい茶葉の種類・品質評価は、全期間に行をそろえるため最初から作り直す
+                rebuild = True
+                start = period_floor(first_date, period).date()
+                productions, shipments = _movements(start)
+            if rebuild:
+                # 最初の日付が後ろにずれた場合に、それより前の期間の行が残らないようにすべて削除する
+                PeriodRollup.objects.filter(period=period).delete()
+                openings = pd.DataFrame(columns=['tea_type', 'quality_check', 'closing_stock'])
+            else:
+                openings = _openings(period, start)
+                # 最新の生産・出荷データが削除された場合は、最後の日付より後の期間の行も削除する
+                last_start = period_floor(end, period).date()
+                PeriodRollup.objects.filter(period=period).filter(
+                    Q(period_start__gte=start) | Q(period_start__gt=last_start)).delete()
+            rollups = compute_rollups(period, productions, shipments, openings, start, end)
+
+            PeriodRollup.objects.bulk_create([
+                PeriodRollup(
+                    period=period,
+                    period_start=row.period_start.date(),
+                    tea_type=row.tea_type,
+                    quality_check=row.quality_check,
+                    produced_quantity=_decimal(row.produced_quantity),
+                    shipped_quantity=_decimal(row.shipped_quantity),
+                    closing_stock=_decimal(row.closing_stock),
+                )
+                for row in rollups.itertuples(index=False)
+            ], batch_size=BATCH_SIZE)
+            written += len(rollups)
+
+        RollupState.objects.filter(pk=STATE_ID, version=state.version).update(clean=True, dirty_since=None)
+    return written
+
+def rollup_queryset(period, start_date=None, end_date=None, tea_type=None, quality_check=None):
+    """
+    期間別集計を絞り込むQuerySet（更新は行わない）
+
+    :param period: 期間（day, week, month）
+    :param start_date: 開始日。この日を含む期間から
+    :param end_date: 終了日
+    :param tea_type: 茶葉の種類
+    :param quality_check: 品質評価
+    :return: PeriodRollup のQuerySet
+    """
+    queryset = PeriodRollup.objects.filter(period=period)
+    if start_date:
+        queryset = queryset.filter(period_start__gte=period_floor(start_date, period).date())
+    if end_date:
+        queryset = queryset.filter(period_start__lte=end_date)
+    if tea_type:
+        queryset = queryset.filter(tea_type=tea_type)
+    if quality_check:
+        queryset = queryset.filter(quality_check=quality_check)
+    return queryset
@@ -0,0 +1,139 @@
+from django.db import transaction
+from django.db.models import Min
+from django.db.models.signals import post_save, post_delete, pre_save
+from django.dispatch import receiver
+from .models import Production, Shipment, Inventory
+from .dashboard import invalidate_dashboard
+from .api import bump_data_version
+from .rollups import mark_rollups_dirty
+from .allocation import bump_lot_index_version
+from .ledger import production_movements, record_movements, shipment_movements
+from .changes import capture_changes
+
+# 期間別集計の再計算の起点にする日付のフィールド
+ROLLUP_DATE_FIELDS = {
+    Production: 'production_date',
+    Shipment: 'shipment_date',
+}
+
+# 変更の記録で使うテーブル名と、行を識別するフィールド（在庫は生産データIDで識別する）
+CHANGE_TABLES = {
+    Production: ('production', 'pk'),
+    Inventory: ('inventory', 'production_id'),
+    Shipment: ('shipment', 'pk'),
+}
+
+# 在庫台帳に影響する項目（変更前の値を打ち消しの行に使う）
+LEDGER_FIELDS = {
+    Production: ['production_date', 'quantity'],
+    Shipment: ['shipment_date', 'quantity', 'production_id'],
+}
+
+# 在庫台帳の行を作る関数
+LEDGER_MOVEMENTS = {
+    Production: production_movements,
+    Shipment: shipment_movements,
+}
+
+@receiver(post_save, sender=Production)
+@receiver(post_save, sender=Shipment)
+@receiver(post_save, sender=Inventory)
+@receiver(post_delete, sender=Production)
+@receiver(post_delete, sender=Shipment)
+@receiver(post_delete, sender=Inventory)
+def invalidate_dashboard_on_change(sender, **kwargs):
+    """
+    生産・出荷・在庫データの変更時にダッシュボードのキャッシュを無効にし、JSON APIのETagを変える
+    キャッシュの無効化と版の更新は、トランザクションのコミット後に行う
+    """
+    transaction.on_commit(invalidate_dashboard)
+    transaction.on_commit(bump_data_version)
+
+@receiver(pre_save, sender=Production)
+@receiver(pre_save, sender=Shipment)
+def remember_previous_values(sender, instance, **kwargs):
+    """
+    更新前の値を記録する
+    - 日付・茶葉の種類・品質評価が変わった場合に、変更前の期間も再計算するための日付
+      （生産データはそのロットの出荷も集計先が変わるため、最初の出荷日も含める）
+    - 在庫台帳に打ち消しの行を追記するための、日付・数量・ロット
+    """
+    instance._rollup_dates = []
+    instance._ledger_previous = None
+    if instance.pk is None:
+        return
+    previous = sender.objects.filter(pk=instance.pk).values(*LEDGER_FIELDS[sender]).first()
+    if previous is None:
+        return
+    instance._ledger_previous = previous
+    instance._rollup_dates.append(previous[ROLLUP_DATE_FIELDS[sender]])
+    if sender is Production:
+        first_shipment = Shipment.objects.filter(production_id=instance.pk).aggregate(
+            first=Min('shipment_date'))['first']
+        if first_shipment:
+            instance._rollup_dates.append(first_shipment)
+
+@receiver(post_save, sender=Production)
+@receiver(post_save, sender=Shipment)
+@receiver(post_delete, sender=Production)
+@receiver(post_delete, sender=Shipment)
+def mark_rollups_on_change(sender, instance, **kwargs):
+    """
+    生産・出荷データの変更時に、変更された最も古い日付から期間別集計を未更新にする
+    """
+    dates = [getattr(instance, ROLLUP_DATE_FIELDS[sender])] + getattr(instance, '_rollup_dates', [])
+    mark_rollups_dirty(min(date for date in dates if date))
+
+@receiver(post_save, sender=Production)
+@receiver(post_save, sender=Shipment)
+def record_stock_movements(sender, instance, **kwargs):
+    """
+    生産・出荷データの作成・変更時に在庫台帳に増減を追記する
+    変更の場合は変更前の値の打ち消しの行も追記する（日付・数量・ロットが変わっていなければ追記しない）
+    """
+    fields = LEDGER_FIELDS[sender]
+    previous = getattr(instance, '_ledger_previous', None)
+    if previous and all(previous[field] == getattr(instance, field) for field in fields):
+        return
+    movements = LEDGER_MOVEMENTS[sender]
+    entries = movements([sender(pk=instance.pk, **previous)], reverse=True) if previous else []
+    record_movements(entries + movements([instance]))
+
+@receiver(post_delete, sender=Production)
+@receiver(post_delete, sender=Shipment)
+def reverse_stock_movements(sender, instance, **kwargs):
+    """
+    生産・出荷データの削除時に在庫台帳に打ち消しの行を追記する
+    """
+    record_movements(LEDGER_MOVEMENTS[sender]([instance], reverse=True))
+
+@receiver(post_save, sender=Production)
+@receiver(post_save, sender=Shipment)
+@receiver(post_save, sender=Inventory)
+def capture_saved_row(sender, instance, created, **kwargs):
+    """
+    生産・出荷・在庫データの保存を変更として記録する（database.py のデータベースとの同期用）
+    """
+    table_name, key = CHANGE_TABLES[sender]
+    capture_changes(table_name, [getattr(instance, key)], 'insert' if created else 'update')
+
+@receiver(post_delete, sender=Production)
+@receiver(post_delete, sender=Shipment)
+@receiver(post_delete, sender=Inventory)
+def capture_deleted_row(sender, instance, **kwargs):
+    """
+    生産・出荷・在庫データの削除を変更として記録する
+    """
+    table_name, key = CHANGE_TABLES[sender]
+    capture_changes(table_name, [getattr(instance, key)], 'delete')
+
+@receiver(post_save, sender=Production)
+@receiver(post_save, sender=Inventory)
+def invalidate_lot_index(sender, created, **kwargs):
+    """
+    既存のロットの生産データ・在庫が変更された場合に、コミット後に引き当ての索引の版を変えて作り直させる
+    （在庫がなくなって索引から外れたロットの在庫が、出荷の修正や同期で戻った場合も読み込まれる）
+    （新しいロットは引き当て時に読み足し、出荷で減った在庫は引き当て時に読むため対象外）
+    """
+    if not created:
+        transaction.on_commit(bump_lot_index_version)
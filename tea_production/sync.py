@@ -0,0 +1,419 @@
+"""
+database.py のデータベース（tea_production.db）とDjangoのデータベースの同期
+
+双方の変更の記録（change_log と ChangeLog）のうち、相手にまだ反映していない分だけを記録順にバッチで読み、
+変更された行の現在の値を相手のデータベースに追加・更新・削除として反映する
+- バッチごとに、反映と「どこまで反映したか」の記録を反映先の1トランザクションでコミットするため、
+  途中で止まっても次の実行で続きから再開できる
+- 行のIDは双方で別々に採番されるため、同期で作成した行のIDの対応を反映先に記録する
+  （Django側は SyncedRow、tea_production.db 側は sync_id_map）
+- 反映先の行がすでに同じ値なら書き込まないため、同じバッチを再び反映しても結果は変わらない
+- 両方で同じ行が変更された場合は、先に反映する tea_production.db の値にそろう
+  ただし在庫量はコピーせず、反映先で生産量から出荷量の合計を引いて求め直す
+  （双方で同じロットから出荷されても、どちらの引き当ても失われない）
+  一方で変更された行が相手で削除されていた場合も、変更された側の値で作り直す
+  （ロットは在庫・出荷もあわせて作り直し、IDの対応も作り直した行に付け替える）
+
+同期の費用は変更された行の数に比例し、テーブル全体は読まない
+"""
+import datetime
+from collections import defaultdict
+from contextlib import contextmanager
+from decimal import Decimal
+
+from django.db import transaction
+from django.db.models import ProtectedError, Sum
+from django.utils import timezone
+
+import change_capture
+from change_capture import TABLES, KEY_COLUMNS, COLUMNS, chunked
+from .api import bump_data_version
+from .changes import capture_paused
+from .dashboard import invalidate_dashboard
+from .ledger import production_movements, record_movements, shipment_movements
+from .models import ChangeLog, Inventory, Production, Shipment, SyncCursor, SyncedRow
+from .rollups import mark_rollups_dirty
+
+# 1回に読んで1トランザクションで反映する変更の件数
+BATCH_SIZE = 500
+
+# 同期元の名前（反映先に「どこまで反映したか」を記録するときのキー）
+RAW_SOURCE = 'raw'
+DJANGO_SOURCE = 'django'
+
+MODELS = {
+    'production': Production,
+    'inventory': Inventory,
+    'shipment': Shipment,
+}
+
+DATE_FIELDS = {
+    'production': 'production_date',
+    'shipment': 'shipment_date',
+}
+
+QUANTITY_STEP = Decimal('0.01')
+
+class SyncError(Exception):
+    """
+    変更を反映できない（参照先の生産データが同期されていない、削除できないなど）
+    """
+
+def _from_raw(row):
+    """
+    tea_production.db の行の値をDjangoのフィールドの値に変換する
+    """
+    values = dict(row)
+    for field in ('production_date', 'shipment_date'):
+        if field in values:
+            values[field] = datetime.date.fromisoformat(str(values[field])[:10])
+    values['quantity'] = Decimal(str(values['quantity'])).quantize(QUANTITY_STEP)
+    if 'quality_check' in values and values['quality_check'] is None:
+        values['quality_check'] = ''
+    if 'created_at' in values:
+        if values['created_at'] is None:
+            # 登録日時がない行は反映先の値をそのまま使う
+            del values['created_at']
+        else:
+            values['created_at'] = datetime.datetime.fromisoformat(values['created_at']).replace(
+                tzinfo=datetime.timezone.utc)
+    return values
+
+def _to_raw(values):
+    """
+    Djangoのフィールドの値を tea_production.db の列の値に変換する（CURRENT_TIMESTAMP と同じくUTCで書く）
+    """
+    row = dict(values)
+    for field, value in row.items():
+        if isinstance(value, datetime.datetime):
+            row[field] = value.astimezone(datetime.timezone.utc).replace(tzinfo=None).isoformat(sep=' ')
+        elif isinstance(value, datetime.date):
+            row[field] = value.isoformat()
+        elif isinstance(value, Decimal):
+            row[field] = float(value)
+    return row
+
+def _id_pairs(conn, table, column, ids):
+    """
+    同期で作成した行のIDの対応を、双方の記録から読む
+
+    :return: [(tea_production.db のID, DjangoのID)]
+    """
+    pairs = change_capture.read_id_map(conn, table, column, ids)
+    for chunk in chunked(ids):
+        pairs.extend(SyncedRow.objects.filter(table_name=table, **{f'{column}__in': chunk})
+                     .values_list('raw_id', 'django_id'))
+    return pairs
+
+def _forget_pairs(conn, table, column, ids):
+    """
+    同期で作成した行のIDの対応を、双方の記録から削除する
+    """
+    change_capture.forget_ids(conn, table, column, ids)
+    for chunk in chunked(ids):
+        SyncedRow.objects.filter(table_name=table, **{f'{column}__in': chunk}).delete()
+
+class RawDatabase:
+    """
+    tea_production.db の読み書き
+    """
+
+    def __init__(self, conn):
+        self.conn = conn
+
+    def changes(self, after, limit):
+        return change_capture.read_changes(self.conn, after, limit)
+
+    def read(self, table, keys):
+        return {key: _from_raw(row) for key, row in change_capture.read_rows(self.conn, table, keys).items()}
+
+    def prune(self, upto):
+        change_capture.prune_changes(self.conn, upto)
+
+    def position(self):
+        return change_capture.get_sync_position(self.conn, DJANGO_SOURCE)
+
+    def id_map(self, table, django_ids):
+        return {django_id: raw_id for raw_id, django_id in _id_pairs(self.conn, table, 'django_id', django_ids)}
+
+    def forget(self, table, django_ids):
+        _forget_pairs(self.conn, table, 'django_id', django_ids)
+
+    def shipment_keys(self, lots):
+        return change_capture.read_shipment_ids(self.conn, lots)
+
+    @contextmanager
+    def applying(self, last_seq):
+        """
+        反映するトランザクション（反映と同時に、反映した位置を記録する）
+        """
+        with change_capture.applying(self.conn):
+            yield
+            change_capture.set_sync_position(self.conn, DJANGO_SOURCE, last_seq)
+
+    def insert(self, table, rows):
+        return [change_capture.insert_row(self.conn, table, _to_raw(values), source_key)
+                for source_key, values in rows]
+
+    def update(self, table, key, values):
+        change_capture.update_row(self.conn, table, key, _to_raw(values))
+
+    def delete(self, table, keys):
+        change_capture.delete_rows(self.conn, table, keys)
+
+    def recompute_inventory(self, lots):
+        change_capture.recompute_inventory(self.conn, lots)
+
+class DjangoDatabase:
+    """
+    Djangoのデータベースの読み書き
+    更新と削除はモデルの save() と delete() で行い、在庫台帳・期間別集計などはシグナルで更新する
+    一括で追加した行はシグナルが送られないため、反映の終わりにまとめて更新する
+    """
+
+    def __init__(self, conn):
+        self.conn = conn
+        self._inserted = False
+        self._inserted_dates = []
+
+    def changes(self, after, limit):
+        return list(ChangeLog.objects.filter(id__gt=after).order_by('id')
+                    .values_list('id', 'table_name', 'row_id')[:limit])
+
+    def read(self, table, keys):
+        key_field = KEY_COLUMNS[table]
+        rows = {}
+        for chunk in chunked(keys):
+            for values in MODELS[table].objects.filter(**{f'{key_field}__in': chunk}).values(
+                    key_field, *COLUMNS[table]).order_by():
+                rows[values[key_field]] = {column: values[column] for column in COLUMNS[table]}
+        return rows
+
+    def prune(self, upto):
+        ChangeLog.objects.filter(id__lte=upto).delete()
+
+    def position(self):
+        return SyncCursor.objects.filter(source=RAW_SOURCE).values_list('last_seq', flat=True).first() or 0
+
+    def id_map(self, table, raw_ids):
+        return dict(_id_pairs(self.conn, table, 'raw_id', raw_ids))
+
+    def forget(self, table, raw_ids):
+        _forget_pairs(self.conn, table, 'raw_id', raw_ids)
+        # tea_production.db 側の記録は反映先のトランザクションの外なので、すぐにコミットする
+        self.conn.commit()
+
+    def shipment_keys(self, lots):
+        keys = set()
+        for chunk in chunked(lots):
+            keys.update(Shipment.objects.filter(production_id__in=chunk).values_list('id', flat=True))
+        return keys
+
+    @contextmanager
+    def applying(self, last_seq):
+        """
+        反映するトランザクション（反映と同時に、反映した位置を記録する）
+        """
+        with transaction.atomic(), capture_paused():
+            yield
+            self._finish_inserts()
+            SyncCursor.objects.update_or_create(
+                source=RAW_SOURCE, defaults={'last_seq': last_seq, 'synced_at': timezone.now()})
+
+    def insert(self, table, rows):
+        model = MODELS[table]
+        objects = model.objects.bulk_create([model(**values) for _, values in rows], batch_size=BATCH_SIZE)
+        self._inserted = True
+        if table == 'inventory':
+            return [obj.production_id for obj in objects]
+        SyncedRow.objects.bulk_create([
+            SyncedRow(table_name=table, raw_id=source_key, django_id=obj.pk)
+            for (source_key, _), obj in zip(rows, objects)
+        ], batch_size=BATCH_SIZE)
+        movements = production_movements if table == 'production' else shipment_movements
+        record_movements(movements(objects), batch_size=BATCH_SIZE)
+        self._inserted_dates.extend(getattr(obj, DATE_FIELDS[table]) for obj in objects)
+        return [obj.pk for obj in objects]
+
+    def update(self, table, key, values):
+        obj = MODELS[table].objects.get(**{KEY_COLUMNS[table]: key})
+        for field, value in values.items():
+            setattr(obj, field, value)
+        obj.save()
+
+    def delete(self, table, keys):
+        key_field = KEY_COLUMNS[table]
+        try:
+            for chunk in chunked(keys):
+                MODELS[table].objects.filter(**{f'{key_field}__in': chunk}).delete()
+        except ProtectedError as e:
+            raise SyncError(f'{table} の行を削除できません（参照している行が残っています）: {keys}') from e
+
+    def recompute_inventory(self, lots):
+        """
+        ロットの在庫量を、生産量から出荷量の合計を引いた値に更新する（change_capture.recompute_inventory と同じ）
+        """
+        for chunk in chunked(lots):
+            shipped = dict(Shipment.objects.filter(production_id__in=chunk).values('production_id')
+                           .annotate(total=Sum('quantity')).values_list('production_id', 'total').order_by())
+            for inventory in Inventory.objects.filter(production_id__in=chunk).select_related('production'):
+                quantity = inventory.production.quantity - shipped.get(inventory.production_id, 0)
+                if inventory.quantity != quantity:
+                    inventory.quantity = quantity
+                    inventory.save(update_fields=['quantity', 'last_updated'])
+
+    def _finish_inserts(self):
+        """
+        一括で追加した行の分の期間別集計・ダッシュボード・JSON APIのETagを更新する
+        """
+        if self._inserted_dates:
+            mark_rollups_dirty(min(self._inserted_dates))
+        if self._inserted:
+            transaction.on_commit(invalidate_dashboard)
+            transaction.on_commit(bump_data_version)
+        self._inserted, self._inserted_dates = False, []
+
+def _target_key(table, key, ids):
+    """
+    反映元の行のIDを反映先の行のIDに変換する（在庫は生産データIDで変換する）
+    """
+    return ids['production' if table == 'inventory' else table].get(key)
+
+def _deleted_in_target(target, table, mapping):
+    """
+    IDの対応はあるが、反映先ではすでに削除されている行の、反映元のID
+    """
+    existing = target.read(table, mapping.values())
+    return {key for key, target_key in mapping.items() if target_key not in existing}
+
+def _revive_deleted(source, target, keys, rows, ids):
+    """
+    反映先で削除された行を、反映元の値で作り直す対象にする
+    古いIDの対応は削除し、作り直した行の対応を新しく記録する（同じ行に2つの対応を作らない）
+    ロットは反映元に残っている在庫・出荷もあわせて作り直す
+    """
+    deleted_lots = _deleted_in_target(target, 'production', ids['production'])
+    if deleted_lots:
+        target.forget('production', deleted_lots)
+        for lot in deleted_lots:
+            del ids['production'][lot]
+        revived = source.read('production', deleted_lots).keys()
+        keys['production'] |= revived
+        keys['inventory'] |= revived
+        keys['shipment'] |= source.shipment_keys(revived)
+        for table in TABLES:
+            rows[table] = source.read(table, keys[table])
+
+    ids['shipment'] = target.id_map('shipment', keys['shipment'])
+    deleted_shipments = _deleted_in_target(target, 'shipment', ids['shipment'])
+    if deleted_shipments:
+        target.forget('shipment', deleted_shipments)
+        for key in deleted_shipments:
+            del ids['shipment'][key]
+
+def _apply_upserts(target, table, rows, ids):
+    """
+    反映元にある行を、反映先に追加または更新する（同じ値の行は書き込まない）
+    在庫量は反映先で求め直すため、既存の在庫の行には書き込まない
+    """
+    pending = {}
+    for key, values in rows.items():
+        if 'production_id' in values:
+            lot = ids['production'].get(values['production_id'])
+            if lot is None:
+                raise SyncError(f"{table} {key} の生産データ {values['production_id']} が同期されていません")
+            values = {**values, 'production_id': lot}
+        pending[key] = values
+    target_keys = {key: _target_key(table, key, ids) for key in pending}
+    current = target.read(table, [key for key in target_keys.values() if key is not None])
+
+    inserts = []
+    for key in sorted(pending):
+        values, target_key = pending[key], target_keys[key]
+        if target_key in current:
+            changed = {field: value for field, value in values.items()
+                       if current[target_key].get(field) != value and (table, field) != ('inventory', 'quantity')}
+            if changed:
+                target.update(table, target_key, changed)
+        else:
+            inserts.append((key, values))
+    if inserts:
+        new_keys = target.insert(table, inserts)
+        if table != 'inventory':
+            ids[table].update(zip((key for key, _ in inserts), new_keys))
+
+def _changed_lots(keys, rows, ids):
+    """
+    在庫量を求め直す、反映先のロットのID（変更された生産データ・在庫と、変更された出荷のロット）
+    """
+    lots = {values['production_id'] for values in rows['shipment'].values()}
+    lots |= keys['production'] | keys['inventory']
+    return {ids['production'][lot] for lot in lots if lot in ids['production']}
+
+def _apply_batch(source, target, changes):
+    """
+    1バッチ分の変更を反映する
+    変更された行の現在の値を読み、生産データ・在庫・出荷の順に追加・更新してから、逆の順に削除する
+    最後に、変更に関係するロットの在庫量を反映先の生産・出荷データから求め直す
+    """
+    keys = defaultdict(set)
+    for _, table, key in changes:
+        keys[table].add(key)
+    rows = {table: source.read(table, keys[table]) for table in TABLES}
+    lots = keys['production'] | keys['inventory'] | {values['production_id'] for values in rows['shipment'].values()}
+    lots.discard(None)
+    ids = {'production': target.id_map('production', lots)}
+
+    with target.applying(changes[-1][0]):
+        _revive_deleted(source, target, keys, rows, ids)
+        # 出荷の削除やロットの付け替えで在庫が戻るロットは、反映前の出荷の行から求める
+        restocked = {values['production_id'] for values in target.read('shipment', ids['shipment'].values()).values()}
+        for table in TABLES:
+            if rows[table]:
+                _apply_upserts(target, table, rows[table], ids)
+        for table in reversed(TABLES):
+            deleted = [_target_key(table, key, ids) for key in keys[table] - rows[table].keys()]
+            deleted = [key for key in deleted if key is not None]
+            if deleted:
+                target.delete(table, deleted)
+        target.recompute_inventory(restocked | _changed_lots(keys, rows, ids))
+
+def replay(source, target, batch_size=BATCH_SIZE):
+    """
+    source の変更のうち target にまだ反映していない分を、バッチごとに反映する
+    すべて反映したら、反映済みの変更の記録を source から削除する
+
+    :param source: 反映元（RawDatabase または DjangoDatabase）
+    :param target: 反映先
+    :param batch_size: 1トランザクションで反映する変更の件数
+    :return: 反映した変更の件数
+    """
+    position = target.position()
+    applied = 0
+    while True:
+        changes = source.changes(position, batch_size)
+        if not changes:
+            break
+        _apply_batch(source, target, changes)
+        position = changes[-1][0]
+        applied += len(changes)
+    if position:
+        source.prune(position)
+    return applied
+
+def sync(conn, batch_size=BATCH_SIZE, pull=True, push=True):
+    """
+    tea_production.db とDjangoのデータベースを同期する
+    先に tea_production.db の変更をDjangoに反映し、次にDjangoの変更を tea_production.db に反映する
+
+    :param conn: tea_production.db の接続（database.migrate 済みであること）
+    :param batch_size: 1トランザクションで反映する変更の件数
+    :param pull: tea_production.db の変更をDjangoに反映するかどうか
+    :param push: Djangoの変更を tea_production.db に反映するかどうか
+    :return: {'pulled': 件数, 'pushed': 件数}
+    """
+    raw, django_db = RawDatabase(conn), DjangoDatabase(conn)
+    return {
+        'pulled': replay(raw, django_db, batch_size) if pull else 0,
+        'pushed': replay(django_db, raw, batch_size) if push else 0,
+    }
@@ -1,13 +1,30 @@
+from django.conf import settings
 from django.urls import path
 from . import views
 
 app_name = 'tea_production'
 
+# ASGIで動かす場合は参照系のビューとダウンロードを非同期版にする（登録は同期のビューのまま）
+if settings.TEA_ASYNC_VIEWS:
+    from . import async_views as read_views
+else:
+    read_views = views
+
 urlpatterns = [
-    path('', views.index, name='index'),
-    path('production/', views.production_list, name='production_list'),
+    path('', read_views.index, name='index'),
+    path('production/', read_views.production_list, name='production_list'),
     path('production/create/', views.production_create, name='production_create'),
-    path('shipment/', views.shipment_list, name='shipment_list'),
+    path('production/export/', read_views.production_export, name='production_export'),
+    path('shipment/', read_views.shipment_list, name='shipment_list'),
     path('shipment/create/', views.shipment_create, name='shipment_create'),
-    path('inventory/', views.inventory_list, name='inventory_list'),
+    path('shipment/allocate/', views.shipment_allocate, name='shipment_allocate'),
+    path('shipment/export/', read_views.shipment_export, name='shipment_export'),
+    path('production/lookup/', read_views.production_lookup, name='production_lookup'),
+    path('inventory/', read_views.inventory_list, name='inventory_list'),
+    path('inventory/export/', read_views.inventory_export, name='inventory_export'),
+    path('api/inventory/', read_views.inventory_api, name='inventory_api'),
+    path('api/production/summary/', read_views.production_summary_api, name='production_summary_api'),
+    path('api/shipment/', read_views.shipment_history_api, name='shipment_history_api'),
+    path('api/rollups/', read_views.period_rollup_api, name='period_rollup_api'),
+    path('api/inventory/as-of/', read_views.stock_as_of_api, name='stock_as_of_api'),
 ] 
\ No newline at end of file
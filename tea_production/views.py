@@ -1,35 +1,121 @@
-from django.shortcuts import render, redirect, get_object_or_404
+from django.shortcuts import render, redirect
+from django.http import HttpResponseBadRequest, JsonResponse, StreamingHttpResponse
 from django.contrib import messages
-from django.db.models import Sum, Count, Case, When, F, FloatField
 from django.db import transaction
-from .models import Production, Shipment, Inventory
-from .forms import ProductionForm, ShipmentForm
+from django.db.models import F
+from django.views.decorators.http import condition, require_GET
+from django.utils import timezone
+from .models import PeriodRollup, Production, Shipment, Inventory
+from .forms import (ProductionForm, ShipmentForm, ShipmentAllocationForm, ListFilterForm, ProductionLookupForm,
+                    RollupFilterForm, StockAsOfForm)
+from .allocation import allocate_shipments
+from .changes import capture_changes
+from .dashboard import build_production_summary, get_dashboard_summary
+from .api import INVENTORY_FIELDS, SHIPMENT_FIELDS, data_etag, data_last_modified, page_payload
+from .export import EXPORT_COLUMNS, iter_rows, stream_csv, stream_json
+from .ledger import stock_totals_as_of
+from .pagination import filter_date_range, get_page_size, keyset_paginate, parse_cursor
+from .rollups import ROLLUP_FIELDS, refresh_rollups, rollup_queryset
+
+def _apply_filters(request, queryset, date_field, tea_type_field, customer=False):
+    """
+    一覧画面と同じ条件（日付範囲・茶葉の種類・顧客名）で絞り込む
+
+    :param request: リクエスト
+    :param queryset: 対象のQuerySet
+    :param date_field: 日付範囲の絞り込みに使うフィールド名
+    :param tea_type_field: 茶葉の種類のフィールド名
+    :param customer: 顧客名で絞り込めるようにするかどうか
+    :return: (絞り込みフォーム, 入力された条件, 絞り込んだQuerySet)
+    """
+    form = ListFilterForm(request.GET or None, customer=customer)
+    # 不正な値の項目は無視し、正しく入力された項目だけで絞り込む
+    filters = {}
+    if form.is_bound:
+        form.is_valid()
+        filters = form.cleaned_data
+
+    queryset = filter_date_range(queryset, date_field, filters.get('start_date'), filters.get('end_date'))
+    if filters.get('tea_type'):
+        queryset = queryset.filter(**{tea_type_field: filters['tea_type']})
+    if filters.get('customer_name'):
+        queryset = queryset.filter(customer_name=filters['customer_name'])
+    return form, filters, queryset
+
+def _keyset_args(request, queryset, date_field, tea_type_field, customer=False):
+    """
+    一覧画面と同じ条件で絞り込み、キーセットページネーションの引数を作る
+    （同期・非同期のビューで共通に使い、データベースにはアクセスしない）
+
+    :return: (絞り込みフォーム, 現在のカーソル, keyset_paginate の引数)
+    """
+    form, filters, queryset = _apply_filters(request, queryset, date_field, tea_type_field, customer)
+
+    cursor = parse_cursor(queryset.model, date_field, filters.get('after'), filters.get('after_id'))
+    return form, cursor, {
+        'queryset': queryset,
+        'date_field': date_field,
+        'cursor': cursor,
+        'page_size': get_page_size(filters.get('page_size')),
+        'descending': filters.get('order') != 'asc',
+    }
+
+def _keyset_page(request, queryset, date_field, tea_type_field, customer=False):
+    """
+    一覧画面と同じ条件で絞り込み、(日付, ID) のキーセットで1ページ分を読む
+
+    :return: (絞り込みフォーム, 現在のカーソル, KeysetPage)
+    """
+    form, cursor, kwargs = _keyset_args(request, queryset, date_field, tea_type_field, customer)
+    return form, cursor, keyset_paginate(**kwargs)
+
+def _filtered_page(request, queryset, date_field, tea_type_field, customer=False):
+    """
+    一覧画面の絞り込み・並び替え・キーセットページネーションを行う
+
+    :param request: リクエスト
+    :param queryset: 対象のQuerySet
+    :param date_field: 並び替えと日付範囲の絞り込みに使うフィールド名
+    :param tea_type_field: 茶葉の種類のフィールド名
+    :param customer: 顧客名で絞り込めるようにするかどうか
+    :return: テンプレートに渡すコンテキスト
+    """
+    return _page_context(request, *_keyset_page(request, queryset, date_field, tea_type_field, customer))
+
+def _page_context(request, form, cursor, page):
+    """
+    一覧画面のテンプレートに渡すコンテキスト（次ページ・先頭ページ・ダウンロードのリンクを含む）
+    """
+    # 次ページ・先頭ページへのリンクは現在の絞り込み条件を引き継ぐ
+    params = request.GET.copy()
+    params.pop('after', None)
+    params.pop('after_id', None)
+    # ダウンロードは絞り込み条件だけを引き継ぐ
+    export_params = params.copy()
+    export_params.pop('order', None)
+    export_params.pop('page_size', None)
+    first_url = f"?{params.urlencode()}" if params else '?'
+    next_url = None
+    if page.next_cursor is not None:
+        value, pk = page.next_cursor
+        params['after'] = value.isoformat()
+        params['after_id'] = pk
+        next_url = f"?{params.urlencode()}"
+
+    return {
+        'filter_form': form,
+        'page': page,
+        'next_url': next_url,
+        'first_url': first_url if cursor is not None else None,
+        'export_query': export_params.urlencode(),
+    }
 
 def index(request):
     """
     ダッシュボード画面を表示
+    在庫状況と生産サマリーはデータベースで集計し、更新されるまでキャッシュする
     """
-    # 在庫状況
-    inventory = Inventory.objects.select_related('production').all()
-    
-    # 生産サマリー
-    production_summary = Production.objects.values('tea_type').annotate(
-        total_productions=Count('id'),
-        total_quantity=Sum('quantity'),
-        a_grade_count=Sum(Case(
-            When(quality_check='A級', then=1),
-            default=0,
-            output_field=FloatField(),
-        )),
-    ).annotate(
-        quality_a_percentage=F('a_grade_count') * 100.0 / F('total_productions')
-    )
-    
-    context = {
-        'inventory': inventory,
-        'production_summary': production_summary,
-    }
-    return render(request, 'tea_production/index.html', context)
+    return render(request, 'tea_production/index.html', get_dashboard_summary())
 
 @transaction.atomic
 def production_create(request):
@@ -48,7 +134,7 @@ def production_create(request):
             )
             
             messages.success(request, '生産データを登録しました。')
-            return redirect('production_list')
+            return redirect('tea_production:production_list')
     else:
         form = ProductionForm()
     
@@ -57,57 +143,287 @@ def production_create(request):
 def production_list(request):
     """
     生産データ一覧の表示
+    生産日・茶葉の種類で絞り込み、(生産日, ID) のキーセットでページを分ける
     """
-    productions = Production.objects.all()
-    return render(request, 'tea_production/production_list.html', {
-        'productions': productions
-    })
+    context = _filtered_page(request, Production.objects.all(), 'production_date', 'tea_type')
+    context['productions'] = context['page']
+    return render(request, 'tea_production/production_list.html', context)
+
+def _shipment_form_context(form):
+    """
+    出荷登録画面のコンテキスト（在庫ロット検索の選択肢を含む）
+    """
+    return {
+        'form': form,
+        'tea_types': Production.TEA_TYPES,
+        'quality_grades': Production.QUALITY_GRADES,
+    }
 
-@transaction.atomic
 def shipment_create(request):
     """
     出荷データの登録
+    トランザクションは在庫の引き当てから始め、最初の文で書き込みロックを取る
+    （読み取りから始めると、SQLiteでは同時出荷時にロックの昇格に失敗する）
     """
     if request.method == 'POST':
         form = ShipmentForm(request.POST)
         if form.is_valid():
             shipment = form.save(commit=False)
-            inventory = get_object_or_404(
-                Inventory,
-                production=shipment.production
-            )
             
-            # 在庫チェック
-            if inventory.quantity < shipment.quantity:
-                messages.error(request, '在庫が不足しています。')
-                return render(request, 'tea_production/shipment_form.html', {'form': form})
+            with transaction.atomic():
+                # 在庫チェックと引き当てを1文の条件付きUPDATEで行い、同時出荷による売り越しを防ぐ
+                updated = Inventory.objects.filter(
+                    production=shipment.production,
+                    quantity__gte=shipment.quantity,
+                ).update(
+                    quantity=F('quantity') - shipment.quantity,
+                    last_updated=timezone.now(),
+                )
+                if updated:
+                    # QuerySet.update はシグナルを送らないため、在庫の変更は直接記録する
+                    capture_changes('inventory', [shipment.production_id], 'update')
+                    shipment.save()
             
-            # 在庫を更新
-            inventory.quantity -= shipment.quantity
-            inventory.save()
+            if not updated:
+                messages.error(request, '在庫が不足しています。')
+                return render(request, 'tea_production/shipment_form.html', _shipment_form_context(form))
             
-            shipment.save()
             messages.success(request, '出荷データを登録しました。')
-            return redirect('shipment_list')
+            return redirect('tea_production:shipment_list')
     else:
         form = ShipmentForm()
     
-    return render(request, 'tea_production/shipment_form.html', {'form': form})
+    return render(request, 'tea_production/shipment_form.html', _shipment_form_context(form))
+
+def shipment_allocate(request):
+    """
+    注文からの出荷登録
+    茶葉の種類・品質評価が一致するロットから生産日の古い順に引き当て、ロットごとに出荷データを作る
+    """
+    if request.method == 'POST':
+        form = ShipmentAllocationForm(request.POST)
+        if form.is_valid():
+            data = form.cleaned_data
+            try:
+                shipments = allocate_shipments(
+                    data['tea_type'], data['quality_check'], data['quantity'], data['shipment_date'],
+                    data['customer_name'], data['customer_contact'] or None,
+                )
+            except ValueError as e:
+                messages.error(request, str(e))
+            else:
+                lots = '、'.join(f'ロット{s.production_id} {s.quantity}kg' for s in shipments)
+                messages.success(request, f'{len(shipments)}件の出荷データを登録しました（{lots}）。')
+                return redirect('tea_production:shipment_list')
+    else:
+        form = ShipmentAllocationForm(initial={'shipment_date': timezone.localdate()})
+    
+    return render(request, 'tea_production/shipment_allocate_form.html', {'form': form})
 
 def shipment_list(request):
     """
     出荷データ一覧の表示
+    出荷日・茶葉の種類・顧客名で絞り込み、(出荷日, ID) のキーセットでページを分ける
     """
-    shipments = Shipment.objects.select_related('production').all()
-    return render(request, 'tea_production/shipment_list.html', {
-        'shipments': shipments
-    })
+    context = _filtered_page(request, Shipment.objects.select_related('production'),
+                             'shipment_date', 'production__tea_type', customer=True)
+    context['shipments'] = context['page']
+    return render(request, 'tea_production/shipment_list.html', context)
 
 def inventory_list(request):
     """
     在庫一覧の表示
+    最終更新日・茶葉の種類で絞り込み、(最終更新日時, ID) のキーセットでページを分ける
+    """
+    context = _filtered_page(request, Inventory.objects.select_related('production'),
+                             'last_updated', 'production__tea_type')
+    context['inventory'] = context['page']
+    return render(request, 'tea_production/inventory_list.html', context)
+
+def production_lookup(request):
+    """
+    出荷登録フォーム用の在庫ロット検索API
+    茶葉の種類・生産日・品質評価で絞り込み、(生産日, ID) のキーセットでページを分けてJSONで返す
+    """
+    queryset, cursor, page_size = _lookup_args(request)
+    return JsonResponse(_lookup_payload(keyset_paginate(queryset, 'production_date', cursor=cursor,
+                                                        page_size=page_size)))
+
+def _lookup_args(request):
+    """
+    在庫ロット検索APIの検索条件から、対象のQuerySet・カーソル・1ページの件数を作る
+    """
+    form = ProductionLookupForm(request.GET)
+    form.is_valid()
+    filters = form.cleaned_data
+
+    queryset = Production.objects.filter(inventory__quantity__gt=0)
+    if filters.get('tea_type'):
+        queryset = queryset.filter(tea_type=filters['tea_type'])
+    if filters.get('quality_check'):
+        queryset = queryset.filter(quality_check=filters['quality_check'])
+    queryset = filter_date_range(queryset, 'production_date',
+                                 filters.get('start_date'), filters.get('end_date'))
+    queryset = queryset.values('id', 'tea_type', 'production_date', 'quality_check',
+                               stock=F('inventory__quantity'))
+
+    cursor = parse_cursor(Production, 'production_date', filters.get('after'), filters.get('after_id'))
+    return queryset, cursor, filters.get('page_size') or ProductionLookupForm.DEFAULT_PAGE_SIZE
+
+def _lookup_payload(page):
+    """
+    在庫ロット検索APIの結果をJSONで返す形にする
+    """
+    results = [{
+        'id': item['id'],
+        'tea_type': item['tea_type'],
+        'production_date': item['production_date'].isoformat(),
+        'quality_check': item['quality_check'],
+        'stock': str(item['stock']),
+        'label': f"{item['production_date']} - {item['tea_type']} {item['quality_check']} (在庫 {item['stock']}kg)",
+    } for item in page]
+    next_cursor = None
+    if page.next_cursor is not None:
+        next_cursor = {'after': page.next_cursor[0].isoformat(), 'after_id': page.next_cursor[1]}
+    return {'results': results, 'next': next_cursor}
+
+EXPORT_FORMATS = {
+    'csv': (stream_csv, 'text/csv; charset=utf-8'),
+    'json': (stream_json, 'application/json; charset=utf-8'),
+}
+
+def _export(request, table, queryset, date_field, tea_type_field, customer=False,
+            formats=EXPORT_FORMATS, rows=iter_rows):
+    """
+    一覧画面と同じ条件で絞り込んだデータをCSVまたはJSONでダウンロードさせる
+    行はチャンク単位で読み出しながら送るため、件数が多くてもメモリに結果全体を載せない
+    （非同期のビューは formats と rows に非同期版を渡す。データベースにはアクセスしない）
+
+    :param request: リクエスト（format=csv|json と一覧画面の絞り込み条件）
+    :param table: テーブル名（ファイル名と項目の選択に使う）
+    :param queryset: 対象のQuerySet
+    :param date_field: 日付範囲の絞り込みに使うフィールド名
+    :param tea_type_field: 茶葉の種類のフィールド名
+    :param customer: 顧客名で絞り込めるようにするかどうか
+    :param formats: {形式: (文字列にする関数, Content-Type)}
+    :param rows: QuerySetの行を読み出す関数
+    :return: StreamingHttpResponse
+    """
+    fmt = request.GET.get('format', 'csv')
+    if fmt not in formats:
+        return HttpResponseBadRequest(f'未対応の形式です: {fmt}')
+    stream, content_type = formats[fmt]
+
+    _, _, queryset = _apply_filters(request, queryset, date_field, tea_type_field, customer)
+    columns = EXPORT_COLUMNS[table]
+    response = StreamingHttpResponse(stream(rows(queryset, columns), columns),
+                                     content_type=content_type)
+    filename = f"{table}_{timezone.localdate():%Y%m%d}.{fmt}"
+    response['Content-Disposition'] = f'attachment; filename="{filename}"'
+    return response
+
+def production_export(request):
+    """
+    生産データのダウンロード
+    """
+    return _export(request, 'production', Production.objects.all(), 'production_date', 'tea_type')
+
+def shipment_export(request):
+    """
+    出荷データのダウンロード
+    """
+    return _export(request, 'shipment', Shipment.objects.all(), 'shipment_date',
+                   'production__tea_type', customer=True)
+
+def inventory_export(request):
+    """
+    在庫データのダウンロード
+    """
+    return _export(request, 'inventory', Inventory.objects.all(), 'last_updated', 'production__tea_type')
+
+@require_GET
+@condition(etag_func=data_etag, last_modified_func=data_last_modified)
+def inventory_api(request):
+    """
+    在庫一覧のJSON API
+    在庫一覧と同じ条件・ページ分けで返す。データが変わっていなければ一覧を読まずに304を返す
+    """
+    _, _, page = _keyset_page(request, Inventory.objects.values(*INVENTORY_FIELDS),
+                              'last_updated', 'production__tea_type')
+    return JsonResponse(page_payload(page, INVENTORY_FIELDS, 'last_updated'))
+
+@require_GET
+@condition(etag_func=data_etag, last_modified_func=data_last_modified)
+def production_summary_api(request):
+    """
+    生産サマリーのJSON API
+    生産一覧と同じ条件（生産日・茶葉の種類）で絞り込んで茶葉の種類ごとに集計する
+    """
+    _, _, queryset = _apply_filters(request, Production.objects.all(), 'production_date', 'tea_type')
+    return JsonResponse({'results': build_production_summary(queryset)})
+
+@require_GET
+@condition(etag_func=data_etag, last_modified_func=data_last_modified)
+def shipment_history_api(request):
+    """
+    出荷履歴のJSON API
+    出荷一覧と同じ条件・ページ分けで返す。データが変わっていなければ一覧を読まずに304を返す
+    """
+    _, _, page = _keyset_page(request, Shipment.objects.values(*SHIPMENT_FIELDS),
+                              'shipment_date', 'production__tea_type', customer=True)
+    return JsonResponse(page_payload(page, SHIPMENT_FIELDS, 'shipment_date'))
+
+def _rollup_args(request):
+    """
+    期間別集計APIの検索条件から、期間と keyset_paginate の引数を作る
+    （同期・非同期のビューで共通に使い、データベースにはアクセスしない）
+    """
+    form = RollupFilterForm(request.GET)
+    form.is_valid()
+    filters = form.cleaned_data
+
+    period = filters.get('period') or RollupFilterForm.DEFAULT_PERIOD
+    queryset = rollup_queryset(period, filters.get('start_date'), filters.get('end_date'),
+                               filters.get('tea_type'), filters.get('quality_check'))
+    return period, {
+        'queryset': queryset.values(*ROLLUP_FIELDS),
+        'date_field': 'period_start',
+        'cursor': parse_cursor(PeriodRollup, 'period_start', filters.get('after'), filters.get('after_id')),
+        'page_size': get_page_size(filters.get('page_size')),
+        'descending': False,
+    }
+
+@require_GET
+@condition(etag_func=data_etag, last_modified_func=data_last_modified)
+def period_rollup_api(request):
+    """
+    期間別集計（日次・週次・月次）のJSON API
+    未反映の変更があれば、変更された最も古い日付を含む期間から再計算してから、期間の開始日順に返す
+    """
+    period, kwargs = _rollup_args(request)
+    refresh_rollups()
+    return JsonResponse({'period': period, **page_payload(keyset_paginate(**kwargs), ROLLUP_FIELDS, 'period_start')})
+
+def _stock_as_of_args(request):
+    """
+    時点指定の在庫APIの検索条件から stock_totals_as_of の引数を作る
+    （同期・非同期のビューで共通に使い、データベースにはアクセスしない）
+    """
+    form = StockAsOfForm(request.GET)
+    form.is_valid()
+    filters = form.cleaned_data
+    return {
+        'as_of': filters.get('date') or timezone.localdate(),
+        'tea_type': filters.get('tea_type'),
+        'quality_check': filters.get('quality_check'),
+    }
+
+@require_GET
+@condition(etag_func=data_etag, last_modified_func=data_last_modified)
+def stock_as_of_api(request):
+    """
+    指定した日の終わりの在庫を茶葉の種類・品質評価ごとに返すJSON API
+    最も近い在庫スナップショットとその後の在庫台帳だけを読む
     """
-    inventory = Inventory.objects.select_related('production').all()
-    return render(request, 'tea_production/inventory_list.html', {
-        'inventory': inventory
-    }) 
\ No newline at end of file
+    kwargs = _stock_as_of_args(request)
+    return JsonResponse({'as_of': kwargs['as_of'], 'results': stock_totals_as_of(**kwargs)})